@@ -1,9 +1,11 @@
 import pickle
 import os
+from functools import lru_cache
 from joblib import load
+import numpy as np
 import pandas as pd
 
-from .utils import generate_dummy, convert_to_datetime, get_distance
+from .utils import generate_dummy, convert_to_datetime, get_distance, get_distances, local_time_features
 
 cur_dir = os.path.dirname(os.path.abspath(__file__))
 
@@ -13,7 +15,11 @@ class RewardModelException(Exception):
 
 
 class RewardModel:
-    def __init__(self):
+    def __init__(self, cache_size=None):
+        """
+        cache_size : size of LRU cache of one-hot (weekday, hour, finish weekday, finish hour) blocks,
+        None disables the cache
+        """
         with open(os.path.join(cur_dir, 'src', 'model.pickle'), 'rb') as f:
             self.model = pickle.load(f)
         with open(os.path.join(cur_dir, 'src', 'features.pickle'), 'rb') as f:
@@ -28,9 +34,25 @@ class RewardModel:
                              'day_of_week',
                              'pick_up_eta'}
 
+        self.distance_column = self.features.index('distance')
+        self.duration_column = self.features.index('duration')
+        if cache_size:
+            self._dummy_block = lru_cache(maxsize=cache_size)(self._dummy_block)
+
     def predict(self, request):
-        prepared_request = self._prepare_request(request)
-        return self.model.predict(prepared_request[self.features].values.reshape(1, -1))[0][0]
+        if isinstance(request, (dict, pd.Series)):
+            return self.predict_batch([request])[0]
+        else:
+            raise RewardModelException('request must be one of dict or pd.Series types')
+
+    def predict_batch(self, requests):
+        """
+        requests : list of request dicts or mapping of request key to array (dict of arrays, pd.DataFrame)
+        """
+        prepared_requests = self._prepare_batch(requests)
+        if len(prepared_requests) == 0:
+            return np.empty(0)
+        return self.model.predict(prepared_requests).reshape(len(prepared_requests), -1)[:, 0]
 
     def partial_fit(self, X):
         raise NotImplemented
@@ -60,3 +82,49 @@ class RewardModel:
 
         return features
 
+    def _prepare_batch(self, requests):
+        if isinstance(requests, list):
+            columns = {key: [r[key] for r in requests] for key in self.request_keys
+                       if all(key in r for r in requests)}
+        else:
+            columns = requests
+        if not self.request_keys.issubset(set(columns.keys())):
+            missed_keys = self.request_keys.difference(set(columns.keys()))
+            raise RewardModelException(f'{missed_keys} are missed in request')
+
+        timestamp = np.asarray(columns['timestamp'], dtype=np.int64)
+        if len(timestamp) == 0:
+            return np.zeros((0, len(self.features)))
+        order_finish_timestamp = np.asarray(columns['order_finish_timestamp'], dtype=np.int64)
+        _, p_h = local_time_features(timestamp)
+        d_w, d_h = local_time_features(order_finish_timestamp)
+        p_w = np.asarray(columns['day_of_week'], dtype=np.int64) + 1
+
+        # every request gets the one-hot block of its (weekday, hour, finish weekday, finish hour) key
+        keys = ((p_w * 24 + p_h) * 8 + d_w) * 24 + d_h
+        unique_keys, key_idx = np.unique(keys, return_inverse=True)
+        blocks = np.stack([self._dummy_block(*self._split_key(k)) for k in unique_keys.tolist()])
+        prepared_requests = blocks[key_idx.reshape(-1)]
+
+        start = np.asarray(list(columns['order_start_location']), dtype=float).reshape(-1, 2)
+        finish = np.asarray(list(columns['order_finish_location']), dtype=float).reshape(-1, 2)
+        prepared_requests[:, self.distance_column] = get_distances(start, finish)
+        prepared_requests[:, self.duration_column] = (order_finish_timestamp - timestamp -
+                                                      np.asarray(columns['pick_up_eta'], dtype=float)) / 60
+        return prepared_requests
+
+    @staticmethod
+    def _split_key(key):
+        key, d_h = divmod(key, 24)
+        key, d_w = divmod(key, 8)
+        p_w, p_h = divmod(key, 24)
+        return p_w, p_h, d_w, d_h
+
+    def _dummy_block(self, p_w, p_h, d_w, d_h):
+        block = np.zeros(len(self.features))
+        for name in (f'p_w_{p_w}', f'p_h_{p_h}', f'd_w_{d_w}', f'd_h_{d_h}'):
+            if name in self.features:
+                block[self.features.index(name)] = 1
+        block.flags.writeable = False
+        return block
+
@@ -1,4 +1,5 @@
 import datetime
+import numpy as np
 import pandas as pd
 from geopy.distance import geodesic
 
@@ -21,3 +22,58 @@ def generate_dummy(value, values_range, prefix):
         else:
             dummies[prefix + '_' + str(i)] = 0
     return dummies
+
+
+# WGS-84 ellipsoid, the default of geopy geodesic
+WGS84_A_KM = 6378.137
+WGS84_F = 1 / 298.257223563
+
+
+def get_distances(start, finish, max_iter=200, tol=1e-12):
+    """
+    Geodesic distance in km between [lon, lat] points on the WGS-84 ellipsoid (Vincenty inverse formula),
+    vectorized over arrays of shape (..., 2). Agrees with geopy geodesic to well below a meter
+    """
+    start, finish = np.radians(np.asarray(start, dtype=float)), np.radians(np.asarray(finish, dtype=float))
+    a, f = WGS84_A_KM, WGS84_F
+    b = a * (1 - f)
+    lon = finish[..., 0] - start[..., 0]
+    u_1 = np.arctan((1 - f) * np.tan(start[..., 1]))
+    u_2 = np.arctan((1 - f) * np.tan(finish[..., 1]))
+    sin_u1, cos_u1, sin_u2, cos_u2 = np.sin(u_1), np.cos(u_1), np.sin(u_2), np.cos(u_2)
+
+    lam = lon
+    for _ in range(max_iter):
+        sin_lam, cos_lam = np.sin(lam), np.cos(lam)
+        sin_sigma = np.sqrt((cos_u2 * sin_lam) ** 2 + (cos_u1 * sin_u2 - sin_u1 * cos_u2 * cos_lam) ** 2)
+        cos_sigma = sin_u1 * sin_u2 + cos_u1 * cos_u2 * cos_lam
+        sigma = np.arctan2(sin_sigma, cos_sigma)
+        sin_alpha = np.divide(cos_u1 * cos_u2 * sin_lam, sin_sigma, out=np.zeros_like(sin_sigma),
+                              where=sin_sigma != 0)
+        cos2_alpha = 1 - sin_alpha ** 2
+        # equatorial lines have cos2_alpha = 0
+        cos_2sigma_m = np.divide(2 * sin_u1 * sin_u2, cos2_alpha, out=np.zeros_like(cos2_alpha),
+                                 where=cos2_alpha != 0)
+        cos_2sigma_m = cos_sigma - cos_2sigma_m
+        c = f / 16 * cos2_alpha * (4 + f * (4 - 3 * cos2_alpha))
+        lam_prev = lam
+        lam = lon + (1 - c) * f * sin_alpha * (
+                sigma + c * sin_sigma * (cos_2sigma_m + c * cos_sigma * (-1 + 2 * cos_2sigma_m ** 2)))
+        if np.all(np.abs(lam - lam_prev) < tol):
+            break
+
+    u2 = cos2_alpha * (a ** 2 - b ** 2) / b ** 2
+    big_a = 1 + u2 / 16384 * (4096 + u2 * (-768 + u2 * (320 - 175 * u2)))
+    big_b = u2 / 1024 * (256 + u2 * (-128 + u2 * (74 - 47 * u2)))
+    delta_sigma = big_b * sin_sigma * (cos_2sigma_m + big_b / 4 * (
+            cos_sigma * (-1 + 2 * cos_2sigma_m ** 2) -
+            big_b / 6 * cos_2sigma_m * (-3 + 4 * sin_sigma ** 2) * (-3 + 4 * cos_2sigma_m ** 2)))
+    return b * big_a * (sigma - delta_sigma)
+
+
+def local_time_features(timestamps, hours_shift=8):
+    """
+    ISO day of week and hour of unix timestamps in local (UTC+8) time, as convert_to_datetime gives
+    """
+    seconds = np.asarray(timestamps, dtype=np.int64) + hours_shift * 60 * 60
+    return (seconds // (24 * 60 * 60) + 3) % 7 + 1, (seconds // (60 * 60)) % 24
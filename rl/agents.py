@@ -4,10 +4,9 @@ import numpy as np
 import pandas as pd
 import torch.optim as optim
 
+import copy
 import os
-from datetime import datetime as dt
-from dateutil.tz import tzlocal
-from .utils import time_to_sincos, match
+from .utils import match_arrays, local_hours, state_features, dispatching_weights
 
 cur_dir = os.path.dirname(os.path.abspath(__file__))
 
@@ -70,7 +69,8 @@ class ValueAgent(BaseAgent):
                  state_dim=6,
                  hidden_dim=256,
                  criterion=nn.MSELoss(),
-                 update=10):
+                 update=10,
+                 dispatch_time_budget=None):
         self.device = device
         self.value_net = value_net_class(state_dim, hidden_dim).to(self.device)
         self.target_value_net = value_net_class(state_dim, hidden_dim).to(self.device)
@@ -85,37 +85,65 @@ class ValueAgent(BaseAgent):
         self.criterion = criterion
         self.update = update
         self.iter = 0
+        # seconds for matching of a dispatching request, see match_arrays
+        self.dispatch_time_budget = dispatch_time_budget
 
         self.hexes = pd.read_csv(os.path.join(cur_dir, 'data', 'hexes.csv'), sep=';')
+        self._hex_index = {hexagon: i for i, hexagon in enumerate(self.hexes.hex.tolist())}
+        # values of all hexes by (day_of_week, hour), cleared when the value network is updated
+        self._hex_values = dict()
 
     def dispatch(self, dispatch_observ):
-        weighted_observation = self.estimate_dispatching_request(dispatch_observ)
-        _, dispatch_action = match(weighted_observation, weight='weight')
-        return dispatch_action
+        if len(dispatch_observ) == 0:
+            return []
+        columns = self._request_columns(dispatch_observ)
+        weights = dispatching_weights(columns['reward_units'], columns['order_driver_distance'],
+                                      self._estimate_weights(columns))
+        _, pairs = match_arrays(columns['driver_id'], columns['order_id'], weights,
+                                time_budget=self.dispatch_time_budget)
+        return [{'driver_id': driver, 'order_id': order}
+                for driver, order in zip(columns['driver_id'][pairs].tolist(), columns['order_id'][pairs].tolist())]
 
     def reposition(self, repo_observ: dict):
-        hexes = self.hexes.copy()
-
-        hour = dt.fromtimestamp(repo_observ['timestamp']).hour
-        h_sin, h_cos = time_to_sincos(hour, value_type='hour')
-        d_sin, d_cos = time_to_sincos(repo_observ['day_of_week'], value_type='day_of_week')
-        hexes['hour_sin'], hexes['hour_cos'] = [h_sin, h_cos]
-        hexes['day_of_week_sin'], hexes['day_of_week_cos'] = [d_sin, d_cos]
-        raw_states = hexes[['hour_sin', 'hour_cos', 'day_of_week_sin', 'day_of_week_cos', 'lon', 'lat']].values
-
-        states = torch.FloatTensor(raw_states).to(self.device)
-        hexes['value'] = self.value_net(states).detach().numpy().flatten()
-        reposition_spots = hexes.nlargest(len(repo_observ['driver_info']), columns='value')
-
-        drivers = pd.DataFrame(repo_observ['driver_info'])
-        drivers_states = pd.merge(drivers, hexes, how='left',
-                                  left_on='grid_id', right_on='hex').drop('hex', axis=1).sort_values('value')
-
-        return [{'driver_id': driver, 'destination': grid}
-                for driver, grid in zip(drivers_states.driver_id.values, reposition_spots.hex.values)]
+        driver_info = repo_observ['driver_info']
+        if len(driver_info) == 0:
+            return []
+        # the same local hours as in dispatch
+        hour = int(local_hours([repo_observ['timestamp']])[0])
+        values = self.hex_values(repo_observ['day_of_week'], hour)
+
+        # the most valuable hexes in descending order of value
+        n_spots = min(len(driver_info), len(values))
+        spots = np.argpartition(-values, n_spots - 1)[:n_spots]
+        spots = spots[np.argsort(-values[spots], kind='stable')]
+
+        # drivers in ascending order of the value of their hexes, drivers on unknown hexes go last
+        driver_values = np.array([values[self._hex_index[driver['grid_id']]] if driver['grid_id'] in self._hex_index
+                                  else np.nan for driver in driver_info])
+        drivers = np.argsort(driver_values, kind='stable')
+
+        hex_ids = self.hexes.hex.values
+        return [{'driver_id': driver_info[driver]['driver_id'], 'destination': grid}
+                for driver, grid in zip(drivers.tolist(), hex_ids[spots].tolist())]
+
+    def hex_values(self, day_of_week: int, hour: int):
+        """
+        Values of all hexes (in the order of self.hexes) at the hour, cached until the value network is updated
+        """
+        key = (day_of_week, hour)
+        if key not in self._hex_values:
+            states = state_features(hour, day_of_week, self.hexes.lon.values, self.hexes.lat.values)
+            with torch.no_grad():
+                values = self.value_net(torch.from_numpy(states).to(self.device)).cpu().numpy().ravel()
+            self._hex_values[key] = values
+        return self._hex_values[key]
 
     def train(self):
-        state, reward, next_state, info, done = self.replay_buffer.sample(self.batch_size)
+        batch = self.replay_buffer.sample(self.batch_size)
+        if batch is None:
+            # not enough samples in the buffer yet
+            return None
+        state, reward, next_state, info, done = batch[:5]
 
         state = torch.FloatTensor(state).to(self.device)
         reward = torch.FloatTensor(reward).unsqueeze(1).to(self.device)
@@ -127,11 +155,23 @@ class ValueAgent(BaseAgent):
         #                (self.gamma ** k) * self.target_value_net(next_state)
         target_value = reward + self.gamma * self.target_value_net(next_state)
 
-        value_loss = self.criterion(value, target_value.detach())
+        if self.replay_buffer.prioritized:
+            # per-sample losses weighted by importance sampling, |TD error| goes back to the buffer
+            weights, indices = batch[5:]
+            weights = torch.FloatTensor(weights).unsqueeze(1).to(self.device)
+            # same loss with its settings (e.g. beta of SmoothL1Loss), per sample
+            elementwise_criterion = copy.copy(self.criterion)
+            elementwise_criterion.reduction = 'none'
+            value_loss = (weights * elementwise_criterion(value, target_value.detach())).mean()
+            td_error = (target_value - value).detach().abs().cpu().numpy().ravel()
+            self.replay_buffer.update_priorities(indices, td_error)
+        else:
+            value_loss = self.criterion(value, target_value.detach())
 
         self.optimizer.zero_grad()
         value_loss.backward()
         self.optimizer.step()
+        self._hex_values.clear()
 
         self.iter += 1
 
@@ -147,29 +187,33 @@ class ValueAgent(BaseAgent):
     def estimate_dispatching_request(self, request: list):
         if len(request) == 0:
             return []
-        request_df = pd.DataFrame(request)
-        needed_keys = {'timestamp', 'day_of_week', 'order_finish_timestamp',
-                       'driver_location', 'order_finish_location', 'reward_units'}
-        assert not needed_keys.difference(set(request_df.columns))
-
-        state_tensor = self._prepare_state(request_df.copy(), time_col='timestamp',
-                                           day_of_week_col='day_of_week', location_col='driver_location')
-        next_state_tensor = self._prepare_state(request_df.copy(), time_col='order_finish_timestamp',
-                                                day_of_week_col='day_of_week', location_col='order_finish_location')
-        weights_tensor = self.gamma * self.value_net(next_state_tensor).flatten() - \
-                         self.value_net(state_tensor).flatten()
-        request_df['weight'] = weights_tensor.detach().numpy()
-        return request_df.to_dict(orient='records')
-
-    def _prepare_state(self, data: pd.DataFrame, time_col: str, day_of_week_col: str, location_col: str):
-        data[['lon', 'lat']] = pd.DataFrame(data[location_col].to_list(), columns=['lon', 'lat'])
-        data['hour'] = pd.to_datetime(data[time_col], unit='s').dt.tz_localize("UTC").dt.tz_convert(tzlocal()).dt.hour
-        data['hour_sin'], data['hour_cos'] = time_to_sincos(data['hour'], value_type='hour')
-        data['day_of_week_sin'], data['day_of_week_cos'] = time_to_sincos(data[day_of_week_col],
-                                                                          value_type='day_of_week')
-        data_matrix = data[['hour_sin', 'hour_cos', 'day_of_week_sin', 'day_of_week_cos', 'lon', 'lat']].values
-        data_tensor = torch.FloatTensor(data_matrix).to(self.device)
-        return data_tensor
+        weights = self._estimate_weights(self._request_columns(request))
+        return [dict(item, weight=weight) for item, weight in zip(request, weights.tolist())]
+
+    @staticmethod
+    def _request_columns(request: list):
+        """
+        Columns of the dispatching request as arrays
+        """
+        needed_keys = {'order_id', 'driver_id', 'timestamp', 'day_of_week', 'order_finish_timestamp',
+                       'driver_location', 'order_finish_location', 'reward_units', 'order_driver_distance'}
+        assert not needed_keys.difference(request[0])
+        columns = {key: np.array([item[key] for item in request]) for key in needed_keys}
+        columns['timestamp'] = columns['timestamp'].astype(np.int64)
+        columns['order_finish_timestamp'] = columns['order_finish_timestamp'].astype(np.int64)
+        return columns
+
+    def _estimate_weights(self, columns: dict):
+        """
+        gamma * V(next_state) - V(state) of every pair, states and next states go through one forward pass
+        """
+        n = len(columns['timestamp'])
+        hours = local_hours(np.concatenate([columns['timestamp'], columns['order_finish_timestamp']]))
+        locations = np.concatenate([columns['driver_location'], columns['order_finish_location']])
+        states = state_features(hours, np.tile(columns['day_of_week'], 2), locations[:, 0], locations[:, 1])
+        with torch.no_grad():
+            values = self.value_net(torch.from_numpy(states).to(self.device)).cpu().numpy().ravel()
+        return self.gamma * values[n:] - values[:n]
 
 
 class ValueAgentDataset(ValueAgent):
@@ -183,10 +227,11 @@ class ValueAgentDataset(ValueAgent):
                  hidden_dim=256,
                  criterion=nn.MSELoss(),
                  update=10,
+                 dispatch_time_budget=None,
                  **kwargs):
         state_dim = dataset.state_dim
         super().__init__(value_net_class, None, batch_size, gamma, device, optimizer, lr, state_dim, hidden_dim,
-                         criterion, update)
+                         criterion, update, dispatch_time_budget)
         self.dataloader = torch.utils.data.DataLoader(dataset, batch_size=batch_size, **kwargs)
         self.iter_data = iter(self.dataloader)
 
@@ -211,6 +256,7 @@ class ValueAgentDataset(ValueAgent):
         self.optimizer.zero_grad()
         value_loss.backward()
         self.optimizer.step()
+        self._hex_values.clear()
 
         self.iter += 1
 
@@ -0,0 +1,82 @@
+"""
+States of the value network for batches of trajectory samples, shared by all replay buffers.
+
+featurize_trajectories turns raw trajectory columns (arrays) into state, reward, next_state, info, done arrays:
+    state = [hour sin, hour cos, day of week sin, day of week cos, lon, lat]
+with GridRanks the state is extended by pickup and dropoff ranks of the hex at the hour and minute features:
+    state = [..., pickup_rank, dropoff_rank, minute, minute // 5, minute // 10]
+"""
+import json
+
+import numpy as np
+import pandas as pd
+
+from .utils import state_features
+
+
+class GridRanks:
+    """
+    Pickup and dropoff ranks of hexes by (hex, day_of_week, hour) in a dense array, 0 for unknown ones
+        :param: ranks (dict) "<hex>_<day_of_week>_<hour>" -> {'pickup_rank': .., 'dropoff_rank': ..}
+    """
+
+    def __init__(self, ranks: dict):
+        keys = [key.rsplit('_', 2) for key in ranks]
+        hexes, days, hours = zip(*keys) if keys else ((), (), ())
+        self.hex_index = pd.Index(sorted(set(hexes)))
+        days, hours = np.array(days, dtype=np.int64), np.array(hours, dtype=np.int64)
+        # (hex, day_of_week, hour, [pickup_rank, dropoff_rank])
+        self.ranks = np.zeros((len(self.hex_index), days.max(initial=7) + 1, hours.max(initial=24) + 1, 2),
+                              dtype=np.float64)
+        if keys:
+            self.ranks[self.hex_index.get_indexer(hexes), days, hours] = [
+                (value['pickup_rank'], value['dropoff_rank']) for value in ranks.values()]
+
+    @classmethod
+    def from_json(cls, path):
+        with open(path, 'r') as f:
+            return cls(json.load(f))
+
+    def lookup(self, hexes, days_of_week, hours):
+        """
+        (n, 2) array of pickup and dropoff ranks
+        """
+        hex_idx = self.hex_index.get_indexer(np.asarray(hexes))
+        days_of_week, hours = np.broadcast_arrays(np.asarray(days_of_week, dtype=np.int64),
+                                                  np.asarray(hours, dtype=np.int64))
+        known = (hex_idx >= 0) & (days_of_week >= 0) & (days_of_week < self.ranks.shape[1]) & \
+                (hours >= 0) & (hours < self.ranks.shape[2])
+        result = np.zeros((len(hex_idx), 2), dtype=np.float64)
+        result[known] = self.ranks[hex_idx[known], days_of_week[known], hours[known]]
+        return result
+
+
+def featurize_states(t, days_of_week, lon, lat, hexes=None, grid_ranks=None):
+    """
+    State matrix (float32) of samples at seconds of day t, ranks features are added with grid_ranks
+    """
+    t = np.asarray(t, dtype=np.int64)
+    hours = t // (60 * 60)
+    states = state_features(hours, days_of_week, lon, lat)
+    if grid_ranks is None:
+        return states
+    minutes = t // 60
+    ranks = grid_ranks.lookup(hexes, days_of_week, hours)
+    return np.column_stack([states, ranks, minutes, minutes // 5, minutes // 10]).astype(np.float32)
+
+
+def featurize_trajectories(samples, day_of_week=None, grid_ranks=None):
+    """
+    state, reward, next_state, info, done of trajectory samples
+        :param: samples - columns t_start, t_end, lon_start, lat_start, lon_end, lat_end, reward, done
+                (hex_start, hex_end with grid_ranks) as a dict of arrays, structured array or DataFrame
+        :param: day_of_week - day of week of all samples, samples['day_of_week'] if None
+    """
+    if day_of_week is None:
+        day_of_week = np.asarray(samples['day_of_week'])
+    t_start, t_end = np.asarray(samples['t_start'], dtype=np.int64), np.asarray(samples['t_end'], dtype=np.int64)
+    hex_start, hex_end = (samples['hex_start'], samples['hex_end']) if grid_ranks is not None else (None, None)
+    state = featurize_states(t_start, day_of_week, samples['lon_start'], samples['lat_start'], hex_start, grid_ranks)
+    next_state = featurize_states(t_end, day_of_week, samples['lon_end'], samples['lat_end'], hex_end, grid_ranks)
+    info = t_end - t_start + 1
+    return state, np.asarray(samples['reward']), next_state, info, np.asarray(samples['done'])
@@ -1,8 +1,28 @@
 from scipy.optimize import linear_sum_assignment
-from scipy.sparse import csr_matrix
-from itertools import count
+from scipy.sparse import csr_matrix, coo_matrix
+from scipy.sparse.csgraph import connected_components
 import numpy as np
 import torch
+import time
+from datetime import datetime as dt
+from dateutil.tz import tzlocal
+
+try:
+    from scipy.sparse.csgraph import min_weight_full_bipartite_matching
+except ImportError:
+    # scipy < 1.6, big components are matched by linear_sum_assignment too
+    min_weight_full_bipartite_matching = None
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# components with at most that many drivers x orders cells are matched on a dense matrix
+DENSE_MATCHING_SIZE = 250000
+# rough worst-case seconds of the solvers per min(drivers, orders) x cells (dense) or x pairs (sparse),
+# components which are not expected to fit into the rest of a time budget are matched greedily
+DENSE_MATCHING_SECONDS = 3e-10
+SPARSE_MATCHING_SECONDS = 5e-9
 
 
 def time_to_sincos(value, value_type: str):
@@ -14,45 +34,199 @@ def time_to_sincos(value, value_type: str):
     return np.sin(value * (2. * np.pi / value_range)), np.cos(value * (2. * np.pi / value_range))
 
 
+def local_hours(timestamps):
+    """
+    Hours of unix timestamps in the local timezone (as dt.fromtimestamp(timestamp).hour gives)
+    """
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    # UTC offsets change at whole quarters of an hour, the offset is looked up once per quarter
+    quarters, inverse = np.unique(timestamps // 900, return_inverse=True)
+    offsets = np.array([dt.fromtimestamp(quarter * 900, tzlocal()).utcoffset().total_seconds()
+                        for quarter in quarters.tolist()], dtype=np.int64)
+    return (timestamps + offsets[inverse.reshape(timestamps.shape)]) % (24 * 60 * 60) // (60 * 60)
+
+
+def state_features(hours, days_of_week, lon, lat):
+    """
+    State matrix of the value network: hour sin/cos, day of week sin/cos, lon, lat (float32)
+    """
+    hour_sin, hour_cos = time_to_sincos(np.asarray(hours), value_type='hour')
+    day_sin, day_cos = time_to_sincos(np.asarray(days_of_week), value_type='day_of_week')
+    return np.column_stack(np.broadcast_arrays(hour_sin, hour_cos, day_sin, day_cos, lon, lat)).astype(np.float32)
+
+
+def dispatching_weights(reward_units, order_driver_distance, weight):
+    """
+    Weight of a driver-order pair in match
+    """
+    return reward_units / (order_driver_distance / 100 + 1) + weight
+
+
 def match(dispatch_observ, order_id='order_id', driver_id='driver_id',
-          weight="reward_units", maximize=True):
-    driver_counter = count()
-    order_counter = count()
-    driver_dict = dict()
-    order_dict = dict()
-    result_dict = dict()
-    weights = []
-    driver_inds = []
-    order_inds = []
-
-    for item in dispatch_observ:
-        _weight = item['reward_units'] / (item['order_driver_distance']/100 + 1) + item['weight']
-        weights.append(_weight) #item[_weight])
-
-        driver = item[driver_id]
-        driver_ind = driver_dict.get(driver, next(driver_counter))
-        driver_dict[driver] = driver_ind
-        driver_inds.append(driver_ind)
-
-        order = item[order_id]
-        order_ind = order_dict.get(order, next(order_counter))
-        order_dict[order] = order_ind
-        order_inds.append(order_ind)
-
-        result_dict[(driver_ind, order_ind)] = dict(driver_id=driver, order_id=order)
-
-    cost = csr_matrix((weights, (driver_inds, order_inds)), shape=(next(driver_counter), next(order_counter))).todense()
-    if cost.any():
-        if not maximize:
-            cost[cost == 0] = np.max(cost) + 1
+          weight="reward_units", maximize=True, time_budget=None):
+    if not dispatch_observ:
+        return 0., []
+    drivers = np.array([item[driver_id] for item in dispatch_observ])
+    orders = np.array([item[order_id] for item in dispatch_observ])
+    weights = np.array([dispatching_weights(item['reward_units'], item['order_driver_distance'], item['weight'])
+                        for item in dispatch_observ], dtype=np.float64)
+
+    total, pairs = match_arrays(drivers, orders, weights, maximize=maximize, time_budget=time_budget)
+    result = [dict(driver_id=driver, order_id=order) for driver, order in zip(drivers[pairs].tolist(),
+                                                                              orders[pairs].tolist())]
+    return total, result
+
+
+def match_arrays(drivers, orders, weights, maximize=True, time_budget=None):
+    """
+    Assignment of drivers to orders on the sparse graph of candidate pairs.
+        :param: drivers, orders, weights (np.ndarray) driver id, order id and weight of every candidate pair,
+                weights of repeated pairs are added up
+        :param: time_budget (float) seconds, components whose estimated matching time does not fit
+                into the rest of the budget are matched greedily
+        :return: total weight of the assignment and indices of the assigned pairs sorted by driver
+    Same assignment as linear_sum_assignment on the dense drivers x orders matrix with missing pairs
+    filled with min - 1 (max + 1 when minimizing): that is a maximum weight matching with weights shifted
+    by the fill, so every connected component of the graph is matched on its own
+    """
+    start = time.perf_counter()
+    if len(weights) == 0:
+        return 0., np.empty(0, dtype=np.int64)
+    driver_ids, driver_inds = np.unique(drivers, return_inverse=True)
+    order_ids, order_inds = np.unique(orders, return_inverse=True)
+    n_drivers, n_orders = len(driver_ids), len(order_ids)
+    keys, first, inverse = np.unique(driver_inds.astype(np.int64) * n_orders + order_inds,
+                                     return_index=True, return_inverse=True)
+    weights = np.bincount(inverse.ravel(), weights=weights, minlength=len(keys))
+    rows, cols = keys // n_orders, keys % n_orders
+
+    # zero weights are missing pairs of the dense matrix, they gain nothing over the fill
+    present = weights != 0
+    if not present.any():
+        gains = np.ones(len(weights))
+    elif maximize:
+        gains = weights - (weights[present].min() - 1)
+    else:
+        gains = (weights[present].max() + 1) - weights
+    edges = np.flatnonzero(present) if present.any() else np.arange(len(weights))
+
+    if time_budget is not None and time.perf_counter() - start >= time_budget:
+        logger.warning(f"Matching time budget of {time_budget}s has run out before components are found, "
+                       f"all pairs are matched greedily")
+        matched = _match_greedy(rows, cols, gains, edges)
+    else:
+        matched = _match_components(rows, cols, gains, edges, n_drivers, n_orders,
+                                    None if time_budget is None else start + time_budget)
+    matched = matched[np.argsort(rows[matched], kind='stable')]
+    return weights[matched].sum(), first[matched]
+
+
+def _match_components(rows, cols, gains, edges, n_drivers, n_orders, deadline=None):
+    """
+    Maximum weight matching of every connected component of the pairs graph, components which are not
+    expected to be matched before the deadline (time.perf_counter()) are matched greedily
+    """
+    graph = coo_matrix((np.ones(len(edges)), (rows[edges], n_drivers + cols[edges])),
+                       shape=(n_drivers + n_orders,) * 2)
+    n_components, labels = connected_components(graph, directed=False)
+    components = labels[rows[edges]]
+    edges = edges[np.argsort(components, kind='stable')]
+    component_labels, component_sizes = np.unique(components, return_counts=True)
+    component_edges = np.split(edges, np.cumsum(component_sizes)[:-1])
+    estimates = _matching_seconds(np.bincount(labels[:n_drivers], minlength=n_components)[component_labels],
+                                  np.bincount(labels[n_drivers:], minlength=n_components)[component_labels],
+                                  component_sizes)
+
+    matched, greedy = list(), list()
+    # small components first: with a time budget the big ones are the ones matched greedily
+    for k in np.argsort(component_sizes, kind='stable').tolist():
+        if deadline is not None and estimates[k] > deadline - time.perf_counter():
+            greedy.append(component_edges[k])
         else:
-            cost[cost == 0] = np.min(cost) - 1
+            matched.append(_match_component(rows, cols, gains, component_edges[k]))
+    if greedy:
+        logger.warning(f"Matching time budget is not enough for {len(greedy)} of {len(component_edges)} components, "
+                       f"they are matched greedily")
+        matched.append(_match_greedy(rows, cols, gains, np.concatenate(greedy)))
 
-    row_ind, col_ind = linear_sum_assignment(cost, maximize)
+    return np.concatenate(matched)
 
-    result = [result_dict[key] for key in zip(row_ind, col_ind) if key in result_dict]
 
-    return cost[row_ind, col_ind].sum(), result
+def _matching_seconds(n_rows, n_cols, n_edges):
+    """
+    Estimated seconds of _match_component for components of n_rows drivers, n_cols orders and n_edges pairs
+    """
+    n_rows, n_cols = np.minimum(n_rows, n_cols), np.maximum(n_rows, n_cols)
+    dense = (n_rows * n_cols <= DENSE_MATCHING_SIZE) | (min_weight_full_bipartite_matching is None)
+    # the sparse solver also gets a dummy pair per row
+    return np.where(dense, DENSE_MATCHING_SECONDS * n_rows * n_rows * n_cols,
+                    SPARSE_MATCHING_SECONDS * n_rows * (n_edges + n_rows))
+
+
+def _match_component(rows, cols, gains, edges):
+    """
+    Maximum weight matching of one component, edges - indices of its pairs
+    """
+    if len(edges) == 1:
+        return edges
+    component_rows, local_rows = np.unique(rows[edges], return_inverse=True)
+    component_cols, local_cols = np.unique(cols[edges], return_inverse=True)
+    n_rows, n_cols = len(component_rows), len(component_cols)
+    if n_rows > n_cols:
+        local_rows, local_cols, n_rows, n_cols = local_cols, local_rows, n_cols, n_rows
+
+    if n_rows * n_cols <= DENSE_MATCHING_SIZE or min_weight_full_bipartite_matching is None:
+        dense = np.zeros((n_rows, n_cols))
+        dense[local_rows, local_cols] = gains[edges]
+        row_ind, col_ind = linear_sum_assignment(dense, maximize=True)
+    else:
+        # every row gets a zero-gain dummy column so that a full matching exists, gains are shifted by 1
+        # as the sparse solver drops zero entries
+        dummy = np.arange(n_rows)
+        biadjacency = csr_matrix((np.concatenate([gains[edges] + 1, np.ones(n_rows)]),
+                                  (np.concatenate([local_rows, dummy]), np.concatenate([local_cols, n_cols + dummy]))),
+                                 shape=(n_rows, n_cols + n_rows))
+        row_ind, col_ind = min_weight_full_bipartite_matching(biadjacency, maximize=True)
+        row_ind, col_ind = row_ind[col_ind < n_cols], col_ind[col_ind < n_cols]
+
+    # matched cells back to pairs, cells without a pair were matched to the fill
+    local_keys = local_rows.astype(np.int64) * n_cols + local_cols
+    order = np.argsort(local_keys)
+    positions = np.searchsorted(local_keys, row_ind.astype(np.int64) * n_cols + col_ind, sorter=order)
+    positions = order[np.minimum(positions, len(order) - 1)]
+    is_pair = local_keys[positions] == row_ind.astype(np.int64) * n_cols + col_ind
+    return edges[positions[is_pair]]
+
+
+def _match_greedy(rows, cols, gains, edges):
+    """
+    Pairs taken by descending gain while both sides are free.
+    Every round takes the pairs that come first for both their row and column among the pairs left,
+    that gives the same pairs as one pass in the order of gains
+    """
+    if len(edges) == 0:
+        return np.empty(0, dtype=np.int64)
+    edge_gains = -gains[edges]
+    order = np.argsort(edge_gains)
+    if np.any(np.diff(edge_gains[order]) == 0):
+        # pairs with equal gains keep their order, a stable sort is much slower on floats
+        order = np.argsort(edge_gains, kind='stable')
+    edges = edges[order]
+    edge_rows, edge_cols = rows[edges], cols[edges]
+    row_first, col_first = np.empty(edge_rows.max() + 1, dtype=np.int64), np.empty(edge_cols.max() + 1, dtype=np.int64)
+    row_used, col_used = np.zeros(len(row_first), dtype=bool), np.zeros(len(col_first), dtype=bool)
+    matched, left = list(), np.arange(len(edges))
+    while len(left) > 0:
+        left_rows, left_cols = edge_rows[left], edge_cols[left]
+        # the first pair left of every row and column: the last assignment to a repeated index wins
+        row_first[left_rows[::-1]] = left[::-1]
+        col_first[left_cols[::-1]] = left[::-1]
+        taken = left[(row_first[left_rows] == left) & (col_first[left_cols] == left)]
+        matched.append(taken)
+        row_used[edge_rows[taken]] = True
+        col_used[edge_cols[taken]] = True
+        left = left[~(row_used[left_rows] | col_used[left_cols])]
+    return edges[np.concatenate(matched)]
 
 
 def regularize(model, p="0"):
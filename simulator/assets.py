@@ -0,0 +1,146 @@
+"""
+Static assets of the simulator compiled into one memory-mappable binary bundle.
+
+    python -m simulator.assets
+
+reads the map, path tables, order and driver generator tables, cancel probabilities and idle transitions once
+and writes them as plain arrays to data/assets_v<ASSETS_VERSION>.bin. Environment loads the bundle through
+get_assets(): the file is memory-mapped once per process and shared by all simulations of the process
+and by forked worker processes.
+
+Bundle layout: 8 bytes of header length, JSON header {name: [dtype, shape, offset]}, arrays aligned to 64 bytes.
+"""
+import argparse
+import json
+import os
+import struct
+
+import numpy as np
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+cur_dir = os.path.dirname(os.path.abspath(__file__))
+
+ASSETS_VERSION = 1
+ALIGNMENT = 64
+assets_path = os.path.join(cur_dir, 'data', f'assets_v{ASSETS_VERSION}.bin')
+
+_bundles = {}
+
+
+class AssetBundle:
+    """
+    Read-only arrays of a compiled bundle. Python objects derived from the arrays (e.g. dicts)
+    are built once and shared through get_derived
+    """
+
+    def __init__(self, arrays: dict, path=None):
+        self.arrays = arrays
+        self.path = path
+        self._derived = {}
+
+    def __getitem__(self, name):
+        return self.arrays[name]
+
+    def __contains__(self, name):
+        return name in self.arrays
+
+    def get_derived(self, name, builder):
+        if name not in self._derived:
+            self._derived[name] = builder(self)
+        return self._derived[name]
+
+    @property
+    def hex_index(self):
+        return self.get_derived('hex_index', lambda bundle: {h: i for i, h in enumerate(bundle['hexes'].tolist())})
+
+
+def save_bundle(path, arrays: dict):
+    header, offset = dict(), 0
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        if array.dtype.hasobject:
+            raise ValueError(f"Array {name} of python objects can not be saved in a bundle")
+        arrays[name] = array
+        header[name] = [array.dtype.str, list(array.shape), offset]
+        offset += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+    header_bytes = json.dumps(dict(version=ASSETS_VERSION, arrays=header)).encode('utf-8')
+    data_start = -(-(8 + len(header_bytes)) // ALIGNMENT) * ALIGNMENT
+    with open(path, 'wb') as f:
+        f.write(struct.pack('<Q', len(header_bytes)))
+        f.write(header_bytes)
+        for name, array in arrays.items():
+            f.seek(data_start + header[name][2])
+            f.write(array.tobytes())
+        f.truncate(data_start + offset)
+
+
+def load_bundle(path):
+    with open(path, 'rb') as f:
+        header_length, = struct.unpack('<Q', f.read(8))
+        header = json.loads(f.read(header_length).decode('utf-8'))
+    if header['version'] != ASSETS_VERSION:
+        raise ValueError(f"{path} has version {header['version']}, expected {ASSETS_VERSION}")
+    data_start = -(-(8 + header_length) // ALIGNMENT) * ALIGNMENT
+    buffer = np.memmap(path, dtype=np.uint8, mode='r')
+    arrays = dict()
+    for name, (dtype, shape, offset) in header['arrays'].items():
+        dtype = np.dtype(dtype)
+        n_bytes = int(np.prod(shape)) * dtype.itemsize
+        start = data_start + offset
+        arrays[name] = buffer[start:start + n_bytes].view(dtype).reshape(shape)
+    return AssetBundle(arrays, path=path)
+
+
+def get_assets(path=assets_path):
+    """
+    Process-wide cached bundle, None if it has not been compiled
+    """
+    if path not in _bundles:
+        if not os.path.exists(path):
+            logger.warning(f"{path} is not compiled, static data is parsed from source files "
+                           f"(run python -m simulator.assets)")
+            return None
+        logger.info(f"Load assets from {path}")
+        _bundles[path] = load_bundle(path)
+    return _bundles[path]
+
+
+def compile_assets(path=assets_path, processes=None):
+    from .map import Map
+    from .paths import load_hex_graph, load_path_tables, build_path_tables
+    from .models.order_generator import OrderGenerator
+    from .models.driver_generator import DriverGenerator
+    from .models.cancel_model import CancelModel
+    from .models.idle_transition import IdleTransitionModel
+
+    arrays = dict()
+    arrays.update(Map.compile_assets())
+    tables = load_path_tables(n_hexes=len(arrays['hexes']))
+    if tables is None:
+        graph, hexes = load_hex_graph()
+        tables = build_path_tables(graph, hexes, processes=processes)
+    arrays['path_distance'] = tables['distance']
+    arrays['path_predecessor'] = tables['predecessor']
+    arrays.update(OrderGenerator.compile_assets())
+    arrays.update(DriverGenerator.compile_assets())
+    arrays.update(CancelModel.compile_assets())
+    arrays.update(IdleTransitionModel.compile_assets())
+    save_bundle(path, arrays)
+    return arrays
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compile static simulator data into one binary bundle')
+    parser.add_argument('--output', default=assets_path, help=f'Output file (default: {assets_path})')
+    parser.add_argument('--processes', type=int, default=None,
+                        help='Number of processes to build path tables if they are missing')
+    args = parser.parse_args()
+    arrays = compile_assets(args.output, processes=args.processes)
+    print(f'{args.output} saved: {len(arrays)} arrays, {os.path.getsize(args.output) / 2 ** 20:.1f} MB')
+
+
+if __name__ == '__main__':
+    main()
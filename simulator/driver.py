@@ -1,3 +1,4 @@
+import heapq
 import itertools
 import random
 import numpy as np
@@ -5,9 +6,19 @@ from datetime import datetime as dt
 import hashlib
 import logging
 
+from .events import MoveSchedule
+from .fleet import FleetArrays, Column
+
 logger = logging.getLogger(__name__)
 
 
+# array columns of drivers: name -> (dtype, shape, value of a free slot)
+DRIVER_COLUMNS = dict(driver_id=(np.int64, (), -1), hex=(np.int32, (), -1), location=(np.float64, (2,), np.nan),
+                      reward=(np.float64, (), 0), born=(np.int64, (), -1), deadline=(np.float64, (), np.nan),
+                      status=(np.int8, (), -1), status_seq=(np.int64, (), -1), online=(bool, (), False),
+                      last_order_time=(np.int64, (), -1), idle_time=(np.int64, (), 0))
+
+
 class DriverException(Exception):
     pass
 
@@ -16,57 +27,141 @@ class DriversCollectionException(Exception):
     pass
 
 
-class DriversCollection(list):
+class DriversCollection:
+    """
+    Online drivers, indexed by id (dict_view), by status in the order drivers got it (status_view),
+    by hex for drivers available for dispatching (hex_view) and by deadline (min-heap).
+    Indexes are kept up to date by Driver on status and hex changes. Attributes of drivers live in fleet arrays,
+    the slot of a driver gone offline is released once its scheduled route is finished
+    """
     randomizer = random.Random()
 
     def __init__(self, env):
         logger.info(f"Start initializing driver collection")
         self.env = env
+        self.fleet = FleetArrays(env, DRIVER_COLUMNS)
         self.dict_view = {}
-        self.d_move = {}
-        super().__init__()
+        self.status_view = {status: {} for status in Driver.status_list}
+        self.hex_view = {}
+        self.d_move = MoveSchedule(queue=env.events)
+        self._deadlines = []
+        self._overdue = {}
+        self._codes = {status: code for code, status in enumerate(Driver.status_list)}
+
+    def __len__(self):
+        return len(self.dict_view)
+
+    def __iter__(self):
+        return iter(list(self.dict_view.values()))
 
     def delete_drivers(self):
         # logger.info("Start deleting drivers")
-        deleted_drivers = 0
-        for driver in self:
-            if (driver.status != 'assigned') and (driver.deadline <= self.env.t):
-                driver.update_trajectory('idle', terminal_state=True)
-                self.env.datacollector.collect_trajectory(driver)
-                del self.dict_view[driver.driver_id]
-                self.remove(driver)
-                deleted_drivers += 1
-        return deleted_drivers
+        while self._deadlines and self._deadlines[0][0] <= self.env.t:
+            _, driver_id = heapq.heappop(self._deadlines)
+            if driver_id in self.dict_view:
+                self._overdue[driver_id] = self.dict_view[driver_id]
+        # assigned drivers stay online until they finish the order
+        to_delete = [driver for driver in self._overdue.values() if driver.status != 'assigned']
+        for driver in to_delete:
+            driver.update_trajectory('idle', terminal_state=True)
+            self.env.datacollector.collect_trajectory(driver)
+            del self._overdue[driver.driver_id]
+            self._remove(driver)
+        return len(to_delete)
 
     def add_drivers(self, drivers: list):
         # logger.info("Start adding drivers")
-        for start_hex, lifetime in drivers:
-            d = Driver(env=self.env, start_hex=start_hex, lifetime=lifetime, d_move=self.d_move)
-            self.append(d)
-            self.dict_view[d.driver_id] = d
+        added = list()
+        if not drivers:
+            return added
+        start_hexes, lifetimes = zip(*drivers)
+        locations = self.env.map.get_lonlat_many(self.env.map.get_hex_idx(start_hexes)).tolist()
+        for start_hex, lifetime, location in zip(start_hexes, lifetimes, locations):
+            d = Driver(env=self.env, start_hex=start_hex, lifetime=lifetime, d_move=self.d_move, location=location,
+                       fleet=self.fleet)
+            self._add(d)
+            added.append(d)
+        return added
+
+    def _add(self, driver):
+        self.dict_view[driver.driver_id] = driver
+        self.status_view[driver.status][driver.driver_id] = driver
+        if driver.status != 'assigned':
+            self.hex_view.setdefault(driver.driver_hex, {})[driver.driver_id] = driver
+        heapq.heappush(self._deadlines, (driver.deadline, driver.driver_id))
+        self.fleet.online[driver.slot] = True
+        driver._collection = self
+
+    def _remove(self, driver):
+        del self.dict_view[driver.driver_id]
+        del self.status_view[driver.status][driver.driver_id]
+        if driver.status != 'assigned':
+            self._remove_from_hex(driver, driver.driver_hex)
+        self.fleet.online[driver.slot] = False
+        driver._collection = None
+        # moves of the rest of the route still draw random locations
+        if not driver.route:
+            self.fleet.release(driver)
+
+    def _remove_from_hex(self, driver, hexagon):
+        bucket = self.hex_view[hexagon]
+        del bucket[driver.driver_id]
+        if not bucket:
+            del self.hex_view[hexagon]
+
+    def _update_status(self, driver, status):
+        del self.status_view[driver.status][driver.driver_id]
+        self.status_view[status][driver.driver_id] = driver
+        if driver.status == 'assigned' and status != 'assigned':
+            self.hex_view.setdefault(driver.driver_hex, {})[driver.driver_id] = driver
+        elif driver.status != 'assigned' and status == 'assigned':
+            self._remove_from_hex(driver, driver.driver_hex)
+
+    def _update_hex(self, driver, hexagon):
+        if driver.status != 'assigned':
+            self._remove_from_hex(driver, driver.driver_hex)
+            self.hex_view.setdefault(hexagon, {})[driver.driver_id] = driver
 
     def move_drivers(self):
-        if self.env.t in self.d_move:
-            for driver in self.d_move[self.env.t]:
-                driver.move()
-            del self.d_move[self.env.t]
+        # released drivers are offline with a finished route, their remaining moves do nothing
+        moved = [driver for driver in self.d_move.pop(self.env.t, []) if driver.slot is not None]
+        if moved:
+            # idle drivers spend the step where they are
+            slots = self.fleet.slots_of(moved)
+            np.add.at(self.fleet.idle_time, slots[self.fleet.status[slots] == self._codes['idle']],
+                      self.env.STEP_UNIT)
+        for driver in moved:
+            # a driver may be listed twice at the second and be released by its first move
+            if driver.slot is None:
+                continue
+            driver.move()
+            if driver._collection is None and not driver.route:
+                self.fleet.release(driver)
+        return moved
 
     def get_drivers(self, status: str, n_drivers=None):
         # logger.info("Start getting drivers")
         if status not in Driver.status_list:
             raise DriversCollectionException(f'status must be one of {Driver.status_list}')
-        drivers = [i for i in self if i.status == status]
+        drivers = list(self.status_view[status].values())
         if n_drivers and isinstance(n_drivers, int):
             self.randomizer.shuffle(drivers)
             return drivers[:n_drivers]
         else:
             return drivers
 
+    def count_drivers(self, status: str):
+        if status not in Driver.status_list:
+            raise DriversCollectionException(f'status must be one of {Driver.status_list}')
+        return len(self.status_view[status])
+
     def get_reposition_drivers(self, n_drivers: int):
         # logger.info("Start getting drivers for reposition")
-        idle_drivers = self.get_drivers(status='idle')
-        for_reposition = [i for i in idle_drivers if i.env.t - i.last_order_time >= self.env.VALID_REPOSITION_TIME]
-        return for_reposition[:n_drivers]
+        idle = list(self.status_view['idle'].values())
+        slots = self.fleet.slots_of(idle)
+        for_reposition = np.flatnonzero(
+            self.env.t - self.fleet.last_order_time[slots] >= self.env.VALID_REPOSITION_TIME)
+        return [idle[k] for k in for_reposition[:n_drivers].tolist()]
 
     def reposition(self, agent_response: list):
         # logger.info("Start repositioning drivers")
@@ -75,7 +170,7 @@ class DriversCollection(list):
             driver = self.get_by_driver_id(resp['driver_id'])
             driver.route = self.env.map.calculate_path(driver.driver_hex, resp['destination'])
             for s in driver.route:
-                driver.d_move.setdefault(s, []).append(driver)
+                driver.d_move.add(s, driver)
             driver.status = 'reposition'
             driver.idle_time = 0
             resp['driver_hex'] = driver.driver_hex
@@ -86,14 +181,96 @@ class DriversCollection(list):
         # logger.info("Start moving idle drivers")
         for resp in model_response:
             driver = self.get_by_driver_id(resp['driver_id'])
-            driver.route = self.env.map.calculate_path(driver.driver_hex, resp['idle_hex'])
-            for s in driver.route:
-                driver.d_move.setdefault(s, []).append(driver)
+            if resp['idle_hex'] == driver.driver_hex:
+                # the driver stays where it is and spends the step there
+                driver.idle_time += self.env.STEP_UNIT
+            else:
+                driver.route = self.env.map.calculate_path(driver.driver_hex, resp['idle_hex'])
+                for s in driver.route:
+                    driver.d_move.add(s, driver)
             driver.update_trajectory('idle')
 
     def get_dispatching_drivers(self):
         # logger.info("Start getting dispatching drivers")
-        return [i for i in self if i.status != 'assigned']
+        return self.get_drivers('idle') + self.get_drivers('reposition')
+
+    def snapshot(self):
+        """
+        Drivers, their indexes and the move schedule as arrays (trajectories are saved by TrajectoryStore.snapshot)
+        """
+        fleet, hex_index = self.fleet, self.env.map.hex_index
+        # drivers that went offline stay in the move schedule, their moves still draw random locations
+        offline = {d.driver_id: d for move_drivers in self.d_move.values() for d in move_drivers
+                   if d.driver_id not in self.dict_view and d.slot is not None}
+        drivers = list(self.dict_view.values()) + list(offline.values())
+        slots = fleet.slots_of(drivers)
+        routes = [list(d.route.items()) for d in drivers]
+        hexes = list(self.hex_view.items())
+        moves = [(t, d.driver_id) for t, move_drivers in self.d_move.items() for d in move_drivers
+                 if d.slot is not None]
+        arrays = {f'driver_{name}': fleet[name][slots] for name in DRIVER_COLUMNS}
+        arrays.update(
+            driver_sequence=np.array(fleet.sequence, dtype=np.int64),
+            driver_order=np.array([-1 if d.order is None else d.order.order_id for d in drivers], dtype=np.int64),
+            driver_idle_wake=np.array([-1 if d._idle_wake is None else d._idle_wake for d in drivers], dtype=np.int64),
+            driver_idle_dest=np.array([-1 if d._idle_dest is None else hex_index[d._idle_dest] for d in drivers],
+                                      dtype=np.int32),
+            driver_trajectory=np.array([d._trajectory for d in drivers], dtype=np.int64),
+            route_ptr=np.cumsum([0] + [len(route) for route in routes]),
+            route_t=np.array([t for route in routes for t, _ in route], dtype=np.int64),
+            route_hex=np.array([hex_index[h] for route in routes for _, h in route], dtype=np.int32),
+            hex_view_hex=np.array([hex_index[h] for h, _ in hexes], dtype=np.int32),
+            hex_view_ptr=np.cumsum([0] + [len(bucket) for _, bucket in hexes]),
+            hex_view_ids=np.array([i for _, bucket in hexes for i in bucket], dtype=np.int64),
+            move_t=np.array([t for t, _ in moves], dtype=np.int64),
+            move_ids=np.array([i for _, i in moves], dtype=np.int64))
+        return arrays
+
+    def restore(self, arrays: dict, orders: dict):
+        """
+        Recreate drivers and indexes saved by snapshot, orders - assigned orders by id
+        """
+        hex_ids = self.env.map.hex_ids
+        route_ptr, route_t, route_hex = arrays['route_ptr'], arrays['route_t'].tolist(), arrays['route_hex']
+        self.fleet = FleetArrays(self.env, DRIVER_COLUMNS)
+        self.d_move = MoveSchedule(queue=self.env.events)
+        self.dict_view = {}
+        drivers = {}
+        for k, (driver_id, order_id, trajectory, idle_wake, idle_dest) in enumerate(zip(
+                arrays['driver_driver_id'].tolist(), arrays['driver_order'].tolist(),
+                arrays['driver_trajectory'].tolist(), arrays['driver_idle_wake'].tolist(),
+                arrays['driver_idle_dest'].tolist())):
+            start, end = route_ptr[k], route_ptr[k + 1]
+            drivers[driver_id] = Driver.restore(
+                fleet=self.fleet, d_move=self.d_move, driver_id=driver_id,
+                order=None if order_id < 0 else orders[order_id],
+                route=dict(zip(route_t[start:end], hex_ids[route_hex[start:end]].tolist())),
+                _trajectory=trajectory,
+                _idle_wake=None if idle_wake < 0 else idle_wake,
+                _idle_dest=None if idle_dest < 0 else hex_ids[idle_dest])
+        slots = self.fleet.slots_of(list(drivers.values()))
+        for name in DRIVER_COLUMNS:
+            self.fleet[name][slots] = arrays[f'driver_{name}']
+        self.fleet.sequence = arrays['driver_sequence'].item()
+        for driver in drivers.values():
+            if driver.order is not None:
+                driver.order.vehicle = driver
+            if self.fleet.online[driver.slot]:
+                driver._collection = self
+                self.dict_view[driver.driver_id] = driver
+
+        online = sorted(self.dict_view.values(), key=lambda d: self.fleet.status_seq[d.slot])
+        self.status_view = {status: {} for status in Driver.status_list}
+        for driver in online:
+            self.status_view[driver.status][driver.driver_id] = driver
+        self._deadlines = [(driver.deadline, driver.driver_id) for driver in online]
+        heapq.heapify(self._deadlines)
+        self._overdue = {}
+        self.hex_view = {h: {i: self.dict_view[i] for i in ids.tolist()}
+                         for h, ids in zip(hex_ids[arrays['hex_view_hex']].tolist(),
+                                           np.split(arrays['hex_view_ids'], arrays['hex_view_ptr'][1:-1]))}
+        for t, driver_id in zip(arrays['move_t'].tolist(), arrays['move_ids'].tolist()):
+            self.d_move.setdefault(t, []).append(drivers[driver_id])
 
     def get_by_driver_id(self, driver_id):
         # logger.info("Start get driver by id")
@@ -104,28 +281,84 @@ class DriversCollection(list):
 
 
 class Driver:
+    """
+    View of a driver slot in DriversCollection.fleet
+    """
+    __slots__ = ('_fleet', 'slot', 'driver_id', 'd_move', 'order', 'route', '_collection', '_trajectory',
+                 '_idle_wake', '_idle_dest')
     newid = itertools.count()
     status_list = ['idle', 'assigned', 'reposition']
 
-    def __init__(self, env, start_hex, d_move, lifetime=None):
+    driver_location = Column('location')
+    driver_reward = Column('reward')
+    born = Column('born')
+    deadline = Column('deadline')
+    last_order_time = Column('last_order_time')
+    idle_time = Column('idle_time')
+
+    def __init__(self, env, start_hex, d_move, lifetime=None, location=None, fleet=None):
         # logger.info(f"Start initializing driver")
-        self.env = env
+        self._collection = None
+        self._fleet = env.drivers_collection.fleet if fleet is None else fleet
+        self._fleet.allocate(self)
         self.d_move = d_move
         self.driver_id = next(self.newid)
+        self._fleet.driver_id[self.slot] = self.driver_id
         self.driver_hex = start_hex
-        self.driver_location = self.env.map.get_lonlat(start_hex)
+        self.driver_location = env.map.get_lonlat(start_hex) if location is None else location
         self.driver_reward = 0
-        self.born = self.env.t
-        self.deadline = lifetime + self.env.t
+        self.born = env.t
+        self.deadline = lifetime + env.t
         self.status = 'idle'
         self.order = None
-        self.last_order_time = self.env.t
+        self.last_order_time = env.t
         self.route = {}
         self.idle_time = abs(int(np.random.normal(300, 200)))
-        self._sample_start = None
-        self._sample_end = None
-        self.trajectory = []
-        self._trajectory_id = self._generate_trajectory_id()
+        # index of the driver in env.trajectory_store
+        self._trajectory = env.trajectory_store.add_driver(self._generate_trajectory_id())
+        # next idle movement decision in event-driven simulation
+        self._idle_wake = None
+        self._idle_dest = None
+
+    @classmethod
+    def restore(cls, fleet, d_move, **state):
+        """
+        View of a new slot with the given state, array attributes are filled by DriversCollection.restore
+        (no new id and idle time are drawn)
+        """
+        driver = cls.__new__(cls)
+        driver._collection = None
+        driver._fleet = fleet
+        fleet.allocate(driver)
+        driver.d_move = d_move
+        for name, value in state.items():
+            setattr(driver, name, value)
+        return driver
+
+    @property
+    def env(self):
+        return self._fleet.env
+
+    @property
+    def status(self):
+        return self.status_list[self._fleet.status[self.slot]]
+
+    @status.setter
+    def status(self, status):
+        if self._collection is not None:
+            self._collection._update_status(self, status)
+        self._fleet.status[self.slot] = self.status_list.index(status)
+        self._fleet.status_seq[self.slot] = self._fleet.next_sequence()
+
+    @property
+    def driver_hex(self):
+        return self._fleet.env.map.hex_ids[self._fleet.hex[self.slot]]
+
+    @driver_hex.setter
+    def driver_hex(self, hexagon):
+        if self._collection is not None:
+            self._collection._update_hex(self, hexagon)
+        self._fleet.hex[self.slot] = self._fleet.env.map.hex_index[hexagon]
 
     def take_order(self, order_object, reward: float, pick_up_eta: float,
                    order_finish_timestamp: int, order_driver_distance: float):
@@ -141,14 +374,13 @@ class Driver:
             self.idle_time = 0
             self.last_order_time = self.order.order_finish_timestamp - self.env.start_timestamp
             self.update_trajectory('assigned')
-            self.d_move.setdefault(self.order.order_finish_timestamp - self.env.start_timestamp, []).append(self)
+            self.d_move.add(self.order.order_finish_timestamp - self.env.start_timestamp, self)
 
     def move(self):
         # logger.info(f"Start moving driver {self.driver_id}")
+        # idle time of idle drivers is increased by DriversCollection.move_drivers
         if self.status != 'assigned':
             self._move()
-            if self.status == 'idle':
-                self.idle_time += self.env.STEP_UNIT
             if self.status == 'reposition' and not self.route:
                 self.status = 'idle'
         else:
@@ -157,7 +389,7 @@ class Driver:
                 self.env.total_reward += self.order.reward
                 self.driver_location = self.order.order_finish_location
                 self.driver_hex = self.order.finish_hex
-                self.env.orders_collection.cancel_orders([self.order], finish=True)
+                self.env.orders_collection.cancel_many([self.order], finish=True)
 
     def _move(self):
         next_location = self.route.get(self.env.t)
@@ -169,67 +401,38 @@ class Driver:
             del self.route[self.env.t]
 
     def update_trajectory(self, task_type: str, terminal_state=False):
-        done = int(terminal_state)
+        store, k = self.env.trajectory_store, self._trajectory
+        state = store.state(self.env.t, self.status, self.driver_hex, self.driver_location)
         if task_type == 'idle':
             # if first sample or sample after order completion
-            if not self._sample_start:
-                self._sample_start = dict(traj_id_start=self._trajectory_id, t_start=self.env.t,
-                                          day_of_week_start=self.env.day_of_week, status_start=self.status,
-                                          hex_start=self.driver_hex, loc_start=self.driver_location,
-                                          route_length_start=self.route, reward_start=0, done_start=done)
+            if not store.is_open(k):
                 # if first point is terminal (e.g. short life or death after order completion)
+                if terminal_state and store.has_samples(k):
+                    store.reopen(k)
+                else:
+                    store.open(k, state)
                 if terminal_state:
-                    self._sample_end = {k.replace('start', 'end'): v for k, v in self._sample_start.items()}
-                    if len(self.trajectory) == 0:
-                        self.trajectory.append({**self._sample_start, **self._sample_end})
-                    else:
-                        last_sample_end = [i for i in self.trajectory
-                                           if i['t_end'] == max([i['t_end'] for i in self.trajectory])][0]
-                        self._sample_start = {k.replace('end', 'start'): v for k, v in last_sample_end.items()
-                                              if 'start' not in k}
-                        self.trajectory.append({**self._sample_start, **self._sample_end})
+                    store.append(k, state, done=1)
             # is idle movement is doing nothing - don't collect it
-            elif self._sample_start['status_start'] == 'idle' and \
-                    self._sample_start['hex_start'] == self.driver_hex and done == 0:
+            elif not terminal_state and store.is_idle_at(k, self.driver_hex):
                 return
             else:
-                self._sample_end = dict(traj_id_end=self._trajectory_id, t_end=self.env.t,
-                                        day_of_week_end=self.env.day_of_week, status_end=self.status,
-                                        hex_end=self.driver_hex, loc_end=self.driver_location,
-                                        route_length_end=self.route, reward_end=0, done_end=done)
-                self.trajectory.append({**self._sample_start, **self._sample_end})
-                self._sample_start = {key.replace('end', 'start'): value for key, value in self._sample_end.items()}
+                store.append(k, state, done=int(terminal_state))
 
         if task_type == 'assigned':
-            status = self.status + '_' + str(self.order.order_id)
             finish_dt = dt.fromtimestamp(self.order.order_finish_timestamp)
             finish_seconds = finish_dt.hour * 60 * 60 + finish_dt.minute * 60 + finish_dt.second
-
-            # Collect assignment
-            self._sample_end = dict(traj_id_end=self._trajectory_id, t_end=self.env.t,
-                                    day_of_week_end=self.env.day_of_week, status_end=status, hex_end=self.driver_hex,
-                                    loc_end=self.driver_location, reward_end=0, done_end=done)
-            self.trajectory.append({**self._sample_start, **self._sample_end})
-
-            # Collect order completion
-            self._sample_start = {key.replace('end', 'start'): value for key, value in self._sample_end.items()}
-            self._sample_end = dict(traj_id_end=self._trajectory_id, t_end=finish_seconds,
-                                    day_of_week_end=self.env.day_of_week, status_end=status,
-                                    hex_end=self.order.finish_hex, loc_end=self.order.order_finish_location,
-                                    reward_end=self.order.reward, done_end=done)
-            self.trajectory.append({**self._sample_start, **self._sample_end})
-            self._sample_start = None
+            # Collect assignment and order completion
+            store.append(k, state)
+            store.append(k, store.state(finish_seconds, self.status, self.order.finish_hex,
+                                        self.order.order_finish_location), reward=self.order.reward)
+            store.close(k)
 
     def cancel_order(self, finish=False):
         # logger.info(f"Start cancelling order assigned to driver {self.driver_id}")
         if self.status == 'assigned':
             if not finish:
-                traj_status = self.status + '_' + str(self.order.order_id)
-                self.trajectory = [i for i in self.trajectory if
-                                   not (i['status_start'] == traj_status and i['status_end'] == traj_status)]
-                old_start = [i for i in self.trajectory if i['status_end'] == traj_status][0]
-                self._sample_start = {k: v for k, v in old_start.items() if 'end' not in k}
-                self.trajectory = [i for i in self.trajectory if i['status_end'] != traj_status]
+                self.env.trajectory_store.rollback(self._trajectory)
             self.order = None
             self.status = 'idle'
             self.route = {}
@@ -1,9 +1,14 @@
 import datetime as dt
 import itertools
+import math
+import random
 import numpy as np
 
-from .driver import DriversCollection
-from .order import OrdersCollection
+from .driver import Driver, DriversCollection
+from .assets import get_assets
+from .events import EventQueue
+from .order import Order, OrdersCollection
+from .trajectory import TrajectoryStore
 from .map import Map
 from .utils import DataCollector, prepare_dispatching_request, handle_dispatching_response
 from .models.order_generator import OrderGenerator
@@ -16,6 +21,30 @@ import logging
 logger = logging.getLogger(__name__)
 
 
+class EnvironmentException(Exception):
+    pass
+
+
+class Snapshot:
+    """
+    Simulation state saved by Environment.snapshot: arrays and records shared with the simulation
+    """
+
+    def __init__(self, arrays: dict, records: dict):
+        self.arrays = arrays
+        self.records = records
+
+    @property
+    def t(self):
+        return int(self.arrays['clock'][1])
+
+
+def _peek_counter(cls):
+    value = next(cls.newid)
+    cls.newid = itertools.count(value)
+    return value
+
+
 class Environment:
     VALID_REPOSITION_TIME = 300
     MAX_PICKUP_DISTANCE = 2000
@@ -23,9 +52,37 @@ class Environment:
     REPO_SPEED_M_PER_S = 3
     PICKUP_SPEED_M_PER_S = 8
     STEP_UNIT = 1
+    DISPATCH_EACH = 2
+    REPOSITION_EACH = 100
 
-    def __init__(self, day_of_week: int, agent, db_client, random_seed=None):
+    def __init__(self, day_of_week: int, agent, db_client, random_seed=None, event_driven=False, sink=None,
+                 replay_buffer=None):
         logger.info("Create environment")
+        # event-driven mode visits only the seconds where something happens, steps of the skipped seconds
+        # are carried forward (see TaxiSimulator)
+        self.event_driven = event_driven
+
+        # static data shared by all environments of the process, None if the bundle is not compiled
+        self.assets = get_assets()
+        self.map = Map(env=self, random_seed=random_seed, assets=self.assets)
+        self.idle_trans_model = IdleTransitionModel(random_seed=random_seed, assets=self.assets)
+
+        self.agent = agent
+        self.db_client = db_client
+        # where simulation steps are written, see DataCollector
+        self.sink = sink
+        # gets trajectory samples of every step, see DataCollector
+        self.replay_buffer = replay_buffer
+
+        # reset/step loop: generator of Environment.run, current decision, end of the simulation and training period
+        self._loop = None
+        self._decision = None
+        self._end_second = None
+        self._training_each = None
+
+        self._init_day(day_of_week, random_seed)
+
+    def _init_day(self, day_of_week: int, random_seed=None):
         self.day_of_week = day_of_week
         self.t = 0
         self.hours = 0
@@ -33,20 +90,24 @@ class Environment:
         self.minutes = 0
         self.start_timestamp = self.timestamp
 
+        self.events = EventQueue() if self.event_driven else None
+        self.d_idle = {}
+        self._touched_drivers = []
+
+        self.trajectory_store = TrajectoryStore(self.map.hex_ids, statuses=Driver.status_list,
+                                                hex_index=self.map.hex_index)
         self.drivers_collection = DriversCollection(env=self)
         self.orders_collection = OrdersCollection(env=self)
-        self.map = Map(env=self, random_seed=random_seed)
 
-        self.agent = agent
         self.total_reward = 0
 
         self.d_orders = None
         self.d_drivers = None
 
-        self.cancel_model = CancelModel(weekday=day_of_week, random_seed=random_seed)
+        self.cancel_model = CancelModel(weekday=day_of_week, random_seed=random_seed, assets=self.assets)
 
-        self.datacollector = DataCollector(env=self, db_client=db_client)
-        self.idle_trans_model = IdleTransitionModel(random_seed=random_seed)
+        self.datacollector = DataCollector(env=self, db_client=self.db_client, sink=self.sink,
+                                           replay_buffer=self.replay_buffer)
 
         self.random_seed = random_seed
         if random_seed:
@@ -69,32 +130,204 @@ class Environment:
             return int(dt.datetime.combine(dt.date.today(),
                                            dt.time(self.hours, self.minutes, self.seconds)).timestamp())
 
+    def run(self, start_second: int, end_second: int, training_each=None, resume=None):
+        """
+        Simulation loop over [start_second, end_second] as a generator of agent decisions.
+        Yields ('reposition', request) and ('dispatch', request), the agent response has to be sent back;
+        yields ('train', second) each training_each seconds after the step is written.
+        Empty dispatching requests are handled without the agent.
+        resume - decision of the current second to continue from (the state is restored from a snapshot)
+        """
+        if self.event_driven:
+            seconds = self.event_seconds(start_second, end_second, ticks=(training_each,) if training_each else (),
+                                         resume=resume is not None)
+        else:
+            seconds = range(start_second, end_second + 1)
+        # last second with a written step
+        written = start_second - 1
+        for sec in seconds:
+            if resume is None:
+                if self.event_driven:
+                    self.datacollector.write_skipped_steps(range(written + 1, sec))
+                self.update_current_time(current_seconds=sec)
+            if resume != 'dispatch':
+                if sec % self.REPOSITION_EACH == 0:
+                    request = self.repositioning_request()
+                    if request is not None:
+                        self._decision = 'reposition'
+                        self.apply_repositioning((yield 'reposition', request))
+                self.get_orders_for_second()
+                self.balancing_drivers()
+                self.idle_movement()
+            resume = None
+            if sec % self.DISPATCH_EACH == 0:
+                request = self.dispatching_request()
+                self._decision = 'dispatch'
+                response = (yield 'dispatch', request) if request else []
+                self.apply_dispatching(request, response)
+            self.move_drivers()
+            self.datacollector.write_simulation_step()
+            written = sec
+            if training_each and sec % training_each == 0:
+                self._decision = 'train'
+                yield 'train', sec
+        if self.event_driven:
+            self.datacollector.write_skipped_steps(range(written + 1, end_second + 1))
+
+    def reset(self, day_of_week: int = None, random_seed=None, start_hour: int = 0, end_hour: int = 24):
+        """
+        Start a new day simulated through step, returns the first decision (decision, request)
+        """
+        assert 0 <= start_hour < end_hour <= 24
+        if self._loop is not None:
+            self._loop.close()
+        self._init_day(day_of_week or self.day_of_week, random_seed)
+        if random_seed:
+            random.seed(random_seed)
+            self.idle_trans_model.seed(random_seed)
+        self.generate_orders()
+        self.generate_drivers()
+        self._end_second, self._training_each = end_hour * 3600, None
+        self._loop = self.run(start_hour * 3600 + 1, self._end_second)
+        return self._next_decision(None)
+
+    def step(self, action):
+        """
+        Apply the agent response to the current decision and simulate till the next one.
+        Returns (observation, reward, done, info): observation is the next decision (decision, request)
+        with decision 'reposition' or 'dispatch' (None at the end of the day),
+        reward is the reward of orders finished in between
+        """
+        if self._loop is None:
+            raise EnvironmentException("Call reset before step")
+        total_reward = self.total_reward
+        observation = self._next_decision(action)
+        return observation, self.total_reward - total_reward, observation is None, dict(t=self.t)
+
+    def _next_decision(self, action):
+        try:
+            observation = self._loop.send(action)
+        except StopIteration:
+            self._loop, self._decision = None, None
+            return None
+        return observation
+
+    def snapshot(self):
+        """
+        State at the current decision of the reset/step loop: drivers, orders, move schedule, event queue,
+        random states, id counters and trajectory samples as arrays. Records that are never modified in place
+        (generated orders and drivers of the day) are shared with the simulation
+        """
+        if self._loop is None or self._decision not in ('reposition', 'dispatch'):
+            raise EnvironmentException("Snapshot can be taken only at a decision of the reset/step loop")
+        drivers = self.drivers_collection.snapshot()
+        np_state = np.random.get_state()
+        py_state = random.getstate()
+        randomizer_state = DriversCollection.randomizer.getstate()
+        arrays = dict(clock=np.array([self.day_of_week, self.t, self.hours, self.minutes, self.seconds,
+                                      self.start_timestamp, self._end_second], dtype=np.int64),
+                      total_reward=np.array(self.total_reward, dtype=np.float64),
+                      id_counters=np.array([_peek_counter(Driver), _peek_counter(Order)], dtype=np.int64),
+                      np_random=np_state[1].copy(),
+                      np_random_tail=np.array(np_state[2:], dtype=np.float64),
+                      py_random=np.array(py_state[1], dtype=np.uint32),
+                      randomizer=np.array(randomizer_state[1], dtype=np.uint32),
+                      idle_key=np.array(self.idle_trans_model.key, dtype=np.uint64),
+                      **drivers, **self.orders_collection.snapshot(), **self.trajectory_store.snapshot())
+        if self.event_driven:
+            arrays.update(self.events.snapshot())
+            idle = [(t, driver_id) for t, drivers in self.d_idle.items() for driver_id in drivers
+                    if driver_id in self.drivers_collection.dict_view]
+            arrays['idle_t'] = np.array([t for t, _ in idle], dtype=np.int64)
+            arrays['idle_ids'] = np.array([i for _, i in idle], dtype=np.int64)
+        n_steps, step_data = self.datacollector.snapshot()
+        records = dict(decision=self._decision, random_seed=self.random_seed,
+                       gauss_next=(py_state[2], randomizer_state[2]),
+                       d_orders=self.d_orders, d_drivers=self.d_drivers,
+                       n_steps=n_steps, step_data=step_data)
+        return Snapshot(arrays, records)
+
+    def restore(self, snapshot):
+        """
+        Continue the reset/step loop from the snapshot, returns its decision (decision, request)
+        """
+        arrays, records = snapshot.arrays, snapshot.records
+        if self._loop is not None:
+            self._loop.close()
+        day_of_week, t, self.hours, self.minutes, self.seconds, self.start_timestamp, self._end_second = \
+            arrays['clock'].tolist()
+        if day_of_week != self.day_of_week:
+            self.cancel_model = CancelModel(weekday=day_of_week, assets=self.assets)
+        self.day_of_week, self.t, self.random_seed = day_of_week, t, records['random_seed']
+        self.total_reward = arrays['total_reward'].item()
+        self.d_orders, self.d_drivers = records['d_orders'], records['d_drivers']
+        self._touched_drivers = []
+
+        if self.event_driven:
+            self.events = EventQueue()
+            self.events.restore(arrays)
+        self.orders_collection.restore(arrays)
+        self.trajectory_store.restore(arrays)
+        self.drivers_collection = DriversCollection(env=self)
+        self.drivers_collection.restore(arrays, orders=self.orders_collection.dict_view)
+        if self.event_driven:
+            self.d_idle = {}
+            for idle_t, driver_id in zip(arrays['idle_t'].tolist(), arrays['idle_ids'].tolist()):
+                self.d_idle.setdefault(idle_t, {})[driver_id] = self.drivers_collection.dict_view[driver_id]
+        self.datacollector.restore(records['n_steps'], records['step_data'])
+
+        pos, has_gauss, cached_gaussian = arrays['np_random_tail'].tolist()
+        np.random.set_state(('MT19937', arrays['np_random'].copy(), int(pos), int(has_gauss), cached_gaussian))
+        random.setstate((3, tuple(arrays['py_random'].tolist()), records['gauss_next'][0]))
+        DriversCollection.randomizer.setstate((3, tuple(arrays['randomizer'].tolist()), records['gauss_next'][1]))
+        self.idle_trans_model.key = int(arrays['idle_key'])
+        Driver.newid, Order.newid = [itertools.count(i) for i in arrays['id_counters'].tolist()]
+
+        self._training_each = None
+        self._loop = self.run(self.t, self._end_second, resume=records['decision'])
+        return self._next_decision(None)
+
     def reposition_actions(self):
         logger.debug("Start reposition action")
-        all_idle_drivers = self.drivers_collection.get_drivers('idle')
+        request = self.repositioning_request()
+        if request is not None:
+            self.apply_repositioning(self.agent.reposition(request))
 
+    def repositioning_request(self):
+        """
+        Reposition request for the agent or None if there are no drivers to reposition
+        """
         # Valid for Repositioning & Agent Repositioning Selection models
         repositioning_drivers = self.drivers_collection.get_reposition_drivers(n_drivers=5)
-        idle_drivers = [i for i in all_idle_drivers if i not in repositioning_drivers and not i.route]
+        if len(repositioning_drivers) == 0:
+            return None
+        return dict(driver_info=[{'driver_id': d.driver_id,
+                                  'grid_id': d.driver_hex} for d in repositioning_drivers],
+                    day_of_week=self.day_of_week,
+                    timestamp=self.timestamp)
 
+    def apply_repositioning(self, agent_response: list):
         # Driver repositioning Model
-        if len(repositioning_drivers) > 0:
-            self._repositioning(repositioning_drivers)
+        self.drivers_collection.reposition(agent_response)
 
     def idle_movement(self):
         logger.debug("Idle movement")
+        if self.event_driven:
+            self._event_idle_movement(self._get_woken_drivers())
+            return None
         all_idle_drivers = self.drivers_collection.get_drivers('idle')
-        idle_drivers = [i for i in all_idle_drivers if not i.route]
+        # in the order of ids as woken drivers of the event-driven loop, moves draw random locations in this order
+        idle_drivers = sorted((i for i in all_idle_drivers if not i.route), key=lambda d: d.driver_id)
         self._idle_movement(idle_drivers)
 
     def generate_orders(self):
         logger.debug("Start generating orders for day")
-        order_gen = OrderGenerator(random_seed=self.random_seed)
+        order_gen = OrderGenerator(random_seed=self.random_seed, assets=self.assets)
         self.d_orders = order_gen.generate_orders(weekday=self.day_of_week)
 
     def generate_drivers(self):
         logger.debug("Start generating drivers for day")
-        driver_gen = DriverGenerator(random_seed=self.random_seed)
+        driver_gen = DriverGenerator(random_seed=self.random_seed, assets=self.assets)
         self.d_drivers = driver_gen.generate_drivers(weekday=self.day_of_week)
 
     def get_orders_for_second(self):
@@ -102,70 +335,144 @@ class Environment:
         orders = self.d_orders.get(self.t, [])
         self.datacollector._step_data['total']['income_orders'] = len(orders)
         self.orders_collection.add_orders(orders)
+        if self.event_driven and orders:
+            # new orders are dispatched at the closest dispatching tick
+            self.events.push(math.ceil(self.t / self.DISPATCH_EACH) * self.DISPATCH_EACH)
 
     def balancing_drivers(self):
         logger.debug("Start making drivers online/offline")
         # generating new drivers
         drivers = self.d_drivers.get(self.t, [])
         self.datacollector._step_data['total']['income_drivers'] = len(drivers)
-        self.drivers_collection.add_drivers(drivers)
+        new_drivers = self.drivers_collection.add_drivers(drivers)
+        if self.event_driven:
+            for driver in new_drivers:
+                self.events.push(math.ceil(driver.deadline))
+                self._wake_idle(driver, self.t)
         # deleting old drivers
         deleted_amt = self.drivers_collection.delete_drivers()
         self.datacollector._step_data['total']['outcome_drivers'] = deleted_amt
 
     def dispatching_actions(self):
         logger.debug("Start dispatch action")
-        all_idle_drivers = self.drivers_collection.get_dispatching_drivers()
+        request = self.dispatching_request()
+        logger.debug("Start agent dispatch")
+        self.apply_dispatching(request, self.agent.dispatch(dispatch_observ=request))
+
+    def dispatching_request(self):
         orders = self.orders_collection.get_orders(status="unassigned")
+        # All idle drivers all eligible for dispatching, candidates are taken from drivers_collection.hex_view
+        return prepare_dispatching_request(env=self, orders=orders)
 
-        # All idle drivers all eligible for dispatching
+    def apply_dispatching(self, agent_request: list, agent_response: list):
         # Order-Driver Matching Model
-        assigned_orders = self._dispatching(orders=orders, drivers=all_idle_drivers)
-
-        self.cancel_orders(assigned_orders)
+        orders = handle_dispatching_response(env=self, agent_request=agent_request, agent_response=agent_response)
+        self.datacollector.collect_dispatching(agent_request, agent_response, orders=orders)
+        self.orders_collection.delete_unassigned_orders()
+        self.cancel_orders(agent_response)
 
     def cancel_orders(self, assigned_orders: list):
         logger.debug("Start cancelling orders")
-        orders = self.orders_collection.get_orders(status="assigned")
-        orders = [order for order in orders if order.order_id in [d['order_id'] for d in assigned_orders]]
+        # assigned orders of the round in the order of their ids
+        order_ids = sorted({d['order_id'] for d in assigned_orders} & self.orders_collection.status_view['assigned'])
+        orders = [self.orders_collection.dict_view[order_id] for order_id in order_ids]
         if not orders:
             return None
         all_probs = self.cancel_model.sample_probs(len(orders))
         idx = [int(order.order_driver_distance // 200) for order in orders]  # NOTE: 0 <= order_driver_distance < 2000
         order_probs = np.choose(idx, all_probs)
         orders_to_cancel = list(itertools.compress(orders, np.random.binomial(1, order_probs)))
+        if self.event_driven:
+            self._touched_drivers.extend(order.vehicle for order in orders_to_cancel)
         self.datacollector.collect_cancelled(orders_to_cancel)
-        self.orders_collection.cancel_orders(orders_to_cancel)
+        self.orders_collection.cancel_many(orders_to_cancel)
 
     def move_drivers(self):
         logger.debug("Start moving drivers")
-        self.drivers_collection.move_drivers()
+        moved = self.drivers_collection.move_drivers()
+        if self.event_driven:
+            self._touched_drivers.extend(moved)
 
-    def _repositioning(self, drivers_for_reposition: list):
-        prepared_request = dict(driver_info=[{'driver_id': d.driver_id,
-                                              'grid_id': d.driver_hex} for d in drivers_for_reposition],
-                                day_of_week=self.day_of_week,
-                                timestamp=self.timestamp)
-        agent_response = self.agent.reposition(prepared_request)
-        self.drivers_collection.reposition(agent_response)
+    def event_seconds(self, start_second: int, end_second: int, ticks=(), resume=False):
+        """
+        Iterate over the seconds of [start_second, end_second] where the simulation state can change:
+        order and driver appearance, driver deadlines, route hops and order completions,
+        idle drivers leaving their hex, dispatching after new orders and reposition ticks.
+        ticks - additional periods (in seconds) to visit, e.g. agent training
+        resume - the queue is restored from a snapshot taken at start_second
+        """
+        assert self.event_driven, "Environment should be created with event_driven=True"
+        self.events.now = start_second - 1
+        if resume:
+            self.events.push(start_second)
+        else:
+            self.events.push_many(t for t in self.d_orders if start_second <= t <= end_second)
+            self.events.push_many(t for t in self.d_drivers if start_second <= t <= end_second)
+            for period in (self.REPOSITION_EACH,) + tuple(ticks):
+                self.events.push_many(range(math.ceil(start_second / period) * period, end_second + 1, period))
+        while len(self.events) > 0 and self.events.peek() <= end_second:
+            sec = self.events.pop()
+            self._touched_drivers = []
+            yield sec
+            self._schedule_touched_drivers()
+
+    def _schedule_touched_drivers(self):
+        # drivers which have finished route, order or got cancellation become idle from the next second
+        for driver in self._touched_drivers:
+            if driver.driver_id not in self.drivers_collection.dict_view or driver.status == 'assigned':
+                continue
+            if driver.deadline <= self.t:
+                self.events.push(self.t + 1)
+            elif driver.status == 'idle' and not driver.route:
+                self._wake_idle(driver, self.t + 1)
+
+    def _wake_idle(self, driver, t, destination=None):
+        driver._idle_wake, driver._idle_dest = t, destination
+        self.d_idle.setdefault(t, {})[driver.driver_id] = driver
+        self.events.push(t)
+
+    def _get_woken_drivers(self):
+        drivers = self.d_idle.pop(self.t, {}).values()
+        # drivers gone offline may have released their slots
+        return sorted((d for d in drivers if d.driver_id in self.drivers_collection.dict_view
+                       and d._idle_wake == self.t and d.status == 'idle' and not d.route), key=lambda d: d.driver_id)
+
+    def _event_idle_movement(self, idle_drivers: list):
+        # the stay-or-move draws of the coming seconds are checked at once, the driver is woken when it leaves
+        model_response = list()
+        next_hour = (self.hours + 1) * 3600
+        for driver in idle_drivers:
+            if driver._idle_dest is not None:
+                model_response.append({'driver_id': driver.driver_id, 'idle_hex': driver._idle_dest})
+                continue
+            dwell, idle_hex = self.idle_trans_model.sample_idle_dwell(driver.driver_hex, driver.driver_id, self.t)
+            if dwell == 0:
+                model_response.append({'driver_id': driver.driver_id, 'idle_hex': idle_hex})
+                continue
+            driver.update_trajectory('idle')
+            if dwell is None or self.t + dwell >= next_hour:
+                # transition probabilities change with the hour
+                wake, idle_hex = next_hour, None
+            else:
+                wake = self.t + dwell
+            driver.idle_time += wake - self.t
+            self._wake_idle(driver, wake, destination=idle_hex)
+        self.drivers_collection.idle_movement(model_response)
+        for resp in model_response:
+            driver = self.drivers_collection.dict_view[resp['driver_id']]
+            if not driver.route:
+                # the transition hex is the hex of the driver, it draws again the next second
+                self._wake_idle(driver, self.t + 1)
 
     def _idle_movement(self, idle_drivers: list):
         prepared_request = dict(idle_drivers=[{'driver_id': d.driver_id,
                                                'driver_location': d.driver_hex} for d in idle_drivers],
                                 day_of_week=self.day_of_week,
-                                hour=self.hours)
+                                hour=self.hours,
+                                second=self.t)
         model_response = self.idle_trans_model.get_driver_idle_transition(prepared_request)
         self.drivers_collection.idle_movement(model_response)
 
-    def _dispatching(self, orders, drivers):
-        prepared_request = prepare_dispatching_request(env=self, drivers=drivers, orders=orders)
-        logger.debug("Start agent dispatch")
-        agent_response = self.agent.dispatch(dispatch_observ=prepared_request)
-        handle_dispatching_response(env=self, agent_request=prepared_request, agent_response=agent_response)
-        self.datacollector.collect_dispatching(prepared_request, agent_response)
-        self.orders_collection.delete_unassigned_orders()
-        return agent_response
-
 # if __name__ == '__main__':
 #     a = Agent()
 #     env = Environment(3, a)
@@ -0,0 +1,67 @@
+import heapq
+
+import numpy as np
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class EventQueue:
+    """
+    Min-heap of simulation seconds at which something has to be processed.
+    Every second is stored once; seconds that are not later than the one being processed are ignored,
+    because the current second is handled by the running step itself.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._seconds = set()
+        self.now = -1
+
+    def push(self, t):
+        t = int(t)
+        if t <= self.now or t in self._seconds:
+            return
+        self._seconds.add(t)
+        heapq.heappush(self._heap, t)
+
+    def push_many(self, seconds):
+        for t in seconds:
+            self.push(t)
+
+    def pop(self):
+        t = heapq.heappop(self._heap)
+        self._seconds.discard(t)
+        self.now = t
+        return t
+
+    def peek(self):
+        return self._heap[0]
+
+    def snapshot(self):
+        return dict(event_heap=np.array(self._heap, dtype=np.int64), event_now=np.array(self.now, dtype=np.int64))
+
+    def restore(self, arrays: dict):
+        self._heap = arrays['event_heap'].tolist()
+        self._seconds = set(self._heap)
+        self.now = int(arrays['event_now'])
+
+    def __len__(self):
+        return len(self._heap)
+
+
+class MoveSchedule(dict):
+    """
+    Mapping second -> drivers to be moved at this second (`d_move`).
+    Adding a driver also registers the second in the event queue when the simulation is event-driven.
+    """
+
+    def __init__(self, queue=None):
+        super().__init__()
+        self.queue = queue
+
+    def add(self, t, driver):
+        self.setdefault(t, []).append(driver)
+        if self.queue is not None:
+            self.queue.push(t)
@@ -0,0 +1,129 @@
+"""
+Structure-of-arrays state of drivers and orders.
+
+FleetArrays keeps one NumPy array per attribute, indexed by slot. Driver and Order are thin views
+(__slots__) over one slot: array-backed attributes are properties that read and write the arrays,
+so filters over the whole fleet (statuses, deadlines) and bulk updates run as vectorized operations.
+"""
+import numpy as np
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class FleetArraysException(Exception):
+    pass
+
+
+class FleetArrays:
+    def __init__(self, env, columns: dict, capacity=1024):
+        """
+        columns : name -> (dtype, shape of one value, value of a free slot)
+        """
+        self.env = env
+        self.columns = columns
+        self.n_slots = 0
+        self._free = []
+        # number of ordered updates of the views so far (e.g. status changes of drivers)
+        self.sequence = 0
+        # view object of every slot, None for free slots
+        self.views = [None] * capacity
+        for name, (dtype, shape, fill) in columns.items():
+            setattr(self, name, np.full((capacity,) + shape, fill, dtype=dtype))
+
+    def __getitem__(self, name):
+        return getattr(self, name)
+
+    def __len__(self):
+        return self.n_slots - len(self._free)
+
+    @property
+    def capacity(self):
+        return len(self.views)
+
+    def allocate(self, view):
+        """
+        Slot for the view, released slots are reused first
+        """
+        if self._free:
+            slot = self._free.pop()
+        else:
+            if self.n_slots == self.capacity:
+                self._grow(2 * self.capacity)
+            slot = self.n_slots
+            self.n_slots += 1
+        self.views[slot] = view
+        view.slot = slot
+        return slot
+
+    def release(self, view):
+        """
+        Free the slot of the view, the view can not be used afterwards
+        """
+        slot = view.slot
+        if slot is None or self.views[slot] is not view:
+            raise FleetArraysException(f"{view} does not own a slot")
+        for name, (_, _, fill) in self.columns.items():
+            getattr(self, name)[slot] = fill
+        self.views[slot] = None
+        self._free.append(slot)
+        view.slot = None
+
+    def next_sequence(self):
+        self.sequence += 1
+        return self.sequence
+
+    def slots_of(self, views):
+        return np.fromiter((view.slot for view in views), dtype=np.int64, count=len(views))
+
+    def views_of(self, slots):
+        return [self.views[slot] for slot in slots.tolist()]
+
+    def _grow(self, capacity):
+        logger.debug(f"Grow fleet arrays to {capacity} slots")
+        for name, (dtype, shape, fill) in self.columns.items():
+            array = getattr(self, name)
+            grown = np.full((capacity,) + shape, fill, dtype=dtype)
+            grown[:len(array)] = array
+            setattr(self, name, grown)
+        self.views.extend([None] * (capacity - len(self.views)))
+
+
+class Column:
+    """
+    Attribute of a view stored in a column of its FleetArrays, None is stored as the missing value
+    """
+
+    def __init__(self, name, missing=None):
+        self.name = name
+        self.missing = missing
+
+    def __get__(self, view, owner=None):
+        if view is None:
+            return self
+        return self.decode(view, getattr(view._fleet, self.name)[view.slot])
+
+    def __set__(self, view, value):
+        getattr(view._fleet, self.name)[view.slot] = self.missing if value is None else self.encode(view, value)
+
+    def decode(self, view, value):
+        if self.missing is not None and (value == self.missing or value != value):
+            return None
+        return value.tolist()
+
+    def encode(self, view, value):
+        return value
+
+
+class HexColumn(Column):
+    """
+    Hex stored as its index in the map
+    """
+
+    def decode(self, view, value):
+        return view._fleet.env.map.hex_ids[value]
+
+    def encode(self, view, value):
+        return view._fleet.env.map.hex_index[value]
+
@@ -3,7 +3,7 @@ import os
 import pylab as plt
 
 from .environment import Environment
-from .utils import DataManager
+from .utils import DataManager, MemorySink, MongoSink
 
 import logging
 from logging import config
@@ -16,40 +16,59 @@ logger = logging.getLogger(__name__)
 
 
 class TaxiSimulator:
-    def __init__(self, write_simulations_to_db=True, random_seed=None, start_hour: int = 0, end_hour: int = 24):
+    def __init__(self, write_simulations_to_db=True, random_seed=None, start_hour: int = 0, end_hour: int = 24,
+                 event_driven=False, sink=None, replay_buffer=None):
+        """
+        sink : where simulation steps are written (simulator.utils.sinks), e.g. ColumnarSink(directory);
+               MongoDB if write_simulations_to_db, steps are returned by simulate otherwise
+        replay_buffer : gets trajectory samples of every step (e.g. rl.buffers.RingReplayBuffer of the agent)
+        event_driven : visit only the seconds where something happens instead of every second. Skipped seconds
+                       write steps with the totals of the state carried forward, idle drivers are woken only
+                       when they leave their hex (stay-or-move draws depend on the seed, driver and second).
+                       Steps and their totals are the same as in the per-second loop
+        """
         assert 0 <= start_hour < end_hour <= 24
-        if write_simulations_to_db:
+        if write_simulations_to_db and sink is None:
             self.db_client = DataManager()
+            sink = MongoSink(self.db_client)
         else:
             self.db_client = None
+        self.sink = sink
+        self.replay_buffer = replay_buffer
 
         self.start_second = start_hour * 3600 + 1
         self.end_second = end_hour * 3600
 
         self.random_seed = random_seed
+        # jump between seconds with events instead of walking through every second of the day
+        self.event_driven = event_driven
 
     def simulate(self, day_of_week: int, agent, training_each=60, simulation_name=None, plot_dir=cur_dir):
+        sink = self.sink if self.sink is not None else MemorySink()
+        sink.open(simulation_name)
         if self.db_client:
-            self.db_client(simulation_name)
             self.db_client.truncate_training_collection()
-        env = Environment(day_of_week=day_of_week, agent=agent, db_client=self.db_client, random_seed=self.random_seed)
+        env = Environment(day_of_week=day_of_week, agent=agent, db_client=self.db_client, random_seed=self.random_seed,
+                          event_driven=self.event_driven, sink=sink, replay_buffer=self.replay_buffer)
         env.generate_orders()
         env.generate_drivers()
         losses = list()
         v_mean = list()
         v_std = list()
-        for sec in range(self.start_second, self.end_second + 1):
-            env.update_current_time(current_seconds=sec)
-            if sec % 100 == 0:
-                env.reposition_actions()
-            env.get_orders_for_second()
-            env.balancing_drivers()
-            env.idle_movement()
-            if sec % 2 == 0:
-                env.dispatching_actions()
-            env.move_drivers()
-            env.datacollector.write_simulation_step()
-            if sec % training_each == 0:
+        loop = env.run(self.start_second, self.end_second, training_each=training_each)
+        response = None
+        while True:
+            try:
+                decision, request = loop.send(response)
+            except StopIteration:
+                break
+            if decision == 'reposition':
+                response = env.agent.reposition(request)
+            elif decision == 'dispatch':
+                response = env.agent.dispatch(dispatch_observ=request)
+            else:
+                response = None
+                sec = request
                 loss = env.agent.train()
                 if loss:
                     losses.append(loss[0])
@@ -57,12 +76,13 @@ class TaxiSimulator:
                     v_std.append(loss[2])
                     if sec % (training_each*10) == 0:
                         self.plot_losses(losses, v_mean, v_std, sec, plot_dir)
-        if not self.db_client:
+        sink.close()
+        if self.sink is None:
             return env.datacollector.data
         return env.agent
 
-    def get_simulation(self, name: str):
-        return self.db_client.read_simulation(name)
+    def get_simulation(self, name: str, **kwargs):
+        return self.sink.read_simulation(name, **kwargs)
 
     @staticmethod
     def plot_losses(losses: list, v_mean: list, v_std: list, sec: int, plot_dir):
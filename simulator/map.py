@@ -4,6 +4,8 @@ import os
 import pickle
 import networkx as nx
 
+from .paths import load_path_tables, restore_path
+
 import logging
 
 logger = logging.getLogger(__name__)
@@ -12,65 +14,143 @@ cur_dir = os.path.dirname(os.path.abspath(__file__))
 
 
 class Map:
-    def __init__(self, env, random_seed=None):
+    def __init__(self, env, random_seed=None, assets=None):
+        """
+        assets : compiled AssetBundle (simulator.assets), static data is read from data/ if None
+        """
         self.env = env
         if random_seed:
             np.random.seed(random_seed)
 
-        with open(os.path.join(cur_dir, 'data', 'hex_graph.pickle'), 'rb') as f:
-            self.graph = pickle.load(f)
-        with open(os.path.join(cur_dir, 'data', 'd_paths.pickle'), 'rb') as f:
-            self.d_paths = pickle.load(f)
+        if assets is None:
+            self.graph = self.load_graph()
+            arrays = self.compile_assets(self.graph)
+            # precomputed all-pairs shortest paths (python -m simulator.paths), networkx is a fallback
+            path_tables = load_path_tables(n_hexes=len(arrays['hexes']))
+            if path_tables is None:
+                logger.warning("Path tables are not built, paths are calculated with networkx")
+                with open(os.path.join(cur_dir, 'data', 'd_paths.pickle'), 'rb') as f:
+                    self.d_paths = pickle.load(f)
+                self.path_distance, self.path_predecessor = None, None
+            else:
+                self.path_distance, self.path_predecessor = path_tables['distance'], path_tables['predecessor']
+            self.d_neighbors = self._neighbors_dict(arrays)
+        else:
+            self.graph = None
+            arrays = assets
+            self.path_distance, self.path_predecessor = assets['path_distance'], assets['path_predecessor']
+            self.d_neighbors = assets.get_derived('d_neighbors', self._neighbors_dict)
+
+        # dense integer index of hexes and their bounding boxes as arrays
+        # a plain array: indexing a memory-mapped one goes through np.memmap.__getitem__
+        self.hex_ids = np.array(arrays['hexes'], dtype=object)
+        self.hex_index = {h: i for i, h in enumerate(self.hex_ids)} if assets is None else assets.hex_index
+        self.lon_min = arrays['lon_min']
+        self.lon_max = arrays['lon_max']
+        self.lat_min = arrays['lat_min']
+        self.lat_max = arrays['lat_max']
 
-        self.coords_df = pd.read_csv(os.path.join(cur_dir, 'data', 'coords_hex.csv'), sep=';')
+    @staticmethod
+    def load_graph():
+        with open(os.path.join(cur_dir, 'data', 'hex_graph.pickle'), 'rb') as f:
+            graph = pickle.load(f)
+        hexes = pd.read_csv(os.path.join(cur_dir, 'data', 'hexes.csv'), sep=';')
+        return graph.subgraph(hexes["hex"])
 
-        # filter nodes
+    @staticmethod
+    def compile_assets(graph=None):
+        """
+        Hexes (in hexes.csv order), their bounding boxes and neighbors of neighbors as arrays
+        """
+        if graph is None:
+            graph = Map.load_graph()
+        coords_df = pd.read_csv(os.path.join(cur_dir, 'data', 'coords_hex.csv'), sep=';')
         hexes = pd.read_csv(os.path.join(cur_dir, 'data', 'hexes.csv'), sep=';')
-        self.graph = self.graph.subgraph(hexes["hex"])
-        self.coords_df = self.coords_df.loc[self.coords_df["hex"].isin(hexes["hex"])]
+        coords_df = coords_df.set_index("hex").loc[hexes["hex"]].reset_index()
+        hex_index = {h: i for i, h in enumerate(coords_df["hex"])}
+
+        # get neighbors of neighbors, CSR-like: neighbors of hex i are neighbors[neighbors_ptr[i]:neighbors_ptr[i+1]]
+        neighbors, neighbors_ptr = list(), [0]
+        for n in coords_df["hex"]:
+            neighbors.extend(sorted(hex_index[neigh_neigh_node]
+                                    for neigh_neigh_node in set(neigh_neigh_node
+                                                                for neigh_node in graph.neighbors(n)
+                                                                for neigh_neigh_node in graph.neighbors(neigh_node))))
+            neighbors_ptr.append(len(neighbors))
+
+        return dict(hexes=coords_df["hex"].to_numpy(dtype=str),
+                    lon_min=coords_df["lon_min"].values.astype(np.float64),
+                    lon_max=coords_df["lon_max"].values.astype(np.float64),
+                    lat_min=coords_df["lat_min"].values.astype(np.float64),
+                    lat_max=coords_df["lat_max"].values.astype(np.float64),
+                    neighbors=np.array(neighbors, dtype=np.int32),
+                    neighbors_ptr=np.array(neighbors_ptr, dtype=np.int64))
 
-        # create dict from df for faster access
-        self.d_coords = {}
-        for _, row in self.coords_df.iterrows():
-            self.d_coords[row["hex"]] = row[["lon_min", "lon_max", "lat_min", "lat_max"]]
+    @staticmethod
+    def _neighbors_dict(arrays):
+        # lists in the order of hex indices: iteration over them does not depend on string hashing
+        hexes, neighbors, neighbors_ptr = arrays['hexes'].tolist(), arrays['neighbors'], arrays['neighbors_ptr']
+        return {h: [hexes[j] for j in neighbors[neighbors_ptr[i]:neighbors_ptr[i + 1]].tolist()]
+                for i, h in enumerate(hexes)}
 
-        # get neighbors of neighbors
-        self.d_neighbors = {}
-        for n in self.graph:
-            self.d_neighbors[n] = set(neigh_neigh_node
-                                      for neigh_node in self.graph.neighbors(n)
-                                      for neigh_neigh_node in self.graph.neighbors(neigh_node))
+    def get_hex_idx(self, hexagons):
+        return np.array([self.hex_index[h] for h in hexagons], dtype=np.int32)
 
     def get_lonlat(self, hexagon):
-        hex_row = self.d_coords[hexagon]
-        return self._generate_coord(hex_row)
+        return self._generate_coord(self.hex_index[hexagon])
+
+    def get_lonlat_many(self, hex_idx):
+        """
+        Random points inside each of hex_idx hexagons, array of [lon, lat] rows
+        """
+        hex_idx = np.asarray(hex_idx, dtype=np.int32)
+        lon = np.random.uniform(self.lon_min[hex_idx], self.lon_max[hex_idx])
+        lat = np.random.uniform(self.lat_min[hex_idx], self.lat_max[hex_idx])
+        return np.column_stack([lon, lat])
 
     def generate_order_endpoints(self, start_hex, end_hex):
-        start_row = self.d_coords[start_hex]
-        end_row = self.d_coords[end_hex]
-        start_location = self._generate_coord(start_row)
-        end_location = self._generate_coord(end_row)
+        start_location = self._generate_coord(self.hex_index[start_hex])
+        end_location = self._generate_coord(self.hex_index[end_hex])
         return start_location, end_location
 
+    def generate_order_endpoints_many(self, start_idx, end_idx):
+        return self.get_lonlat_many(start_idx), self.get_lonlat_many(end_idx)
+
     def calculate_path(self, start_hex, destination_hex):
-        try:
-            distance, path = self.d_paths[(start_hex, destination_hex)]
-        except KeyError:
-            distance, path = nx.single_source_dijkstra(self.graph, start_hex, destination_hex)
+        if self.path_distance is not None:
+            start, destination = self.hex_index[start_hex], self.hex_index[destination_hex]
+            distance = float(self.path_distance[start, destination])
+            path = self.hex_ids[restore_path(self.path_predecessor[start], start, destination)]
+        else:
+            try:
+                distance, path = self.d_paths[(start_hex, destination_hex)]
+            except KeyError:
+                distance, path = nx.single_source_dijkstra(self.graph, start_hex, destination_hex)
         distributed_distance = np.linspace(0, distance, len(path)) * 1000 / self.env.IDLE_SPEED_M_PER_S + self.env.t
         return {i: j for i, j in zip(distributed_distance.astype(int), path)}
 
     def calculate_distance(self, start_hex, finish_hex):
+        if self.path_distance is not None:
+            return float(self.path_distance[self.hex_index[start_hex], self.hex_index[finish_hex]])
         try:
             distance, _ = self.d_paths[(start_hex, finish_hex)]
         except KeyError:
             distance, _ = nx.single_source_dijkstra(self.graph, start_hex, finish_hex)
         return distance
 
-    @staticmethod
-    def _generate_coord(row):
-        return [np.random.uniform(row.lon_min, row.lon_max),
-                np.random.uniform(row.lat_min, row.lat_max)]
+    def calculate_distances(self, start_idx, finish_idx):
+        """
+        Shortest path distances between arrays of hex indices, looked up per pair without path tables
+        """
+        if self.path_distance is None:
+            return np.array([self.calculate_distance(self.hex_ids[i], self.hex_ids[j])
+                             for i, j in zip(np.asarray(start_idx).tolist(), np.asarray(finish_idx).tolist())],
+                            dtype=np.float64)
+        return self.path_distance[start_idx, finish_idx].astype(np.float64)
+
+    def _generate_coord(self, i):
+        return [np.random.uniform(self.lon_min[i], self.lon_max[i]),
+                np.random.uniform(self.lat_min[i], self.lat_max[i])]
 
 # if __name__=='__main__':
 #     t = Map()
@@ -12,16 +12,25 @@ data_dir = os.path.join(cur_dir, "src")
 
 
 class CancelModel:
-    def __init__(self, data_dir=data_dir, weekday=1, random_seed=None):
+    def __init__(self, data_dir=data_dir, weekday=1, random_seed=None, assets=None):
         """
         data_path : path to DataFrame - Should contain only prob_cols!!!
+        assets : compiled AssetBundle (simulator.assets), probabilities are read from data_dir if None
         """
         logger.info("Initialize cancellation model")
         if random_seed:
             np.random.seed(random_seed)
-        data_path = os.path.join(data_dir, f"cancel_probs_day{weekday}.csv.gz")
-        df = pd.read_csv(data_path, compression="gzip")
-        self.data = df.values.T
+        if assets is None:
+            data_path = os.path.join(data_dir, f"cancel_probs_day{weekday}.csv.gz")
+            self.data = pd.read_csv(data_path, compression="gzip").values.T
+        else:
+            self.data = assets[f"cancel_probs_{weekday}"].T
+
+    @staticmethod
+    def compile_assets(data_dir=data_dir):
+        return {f"cancel_probs_{weekday}": pd.read_csv(os.path.join(data_dir, f"cancel_probs_day{weekday}.csv.gz"),
+                                                       compression="gzip").values
+                for weekday in range(1, 8)}
 
     def sample_probs(self, size=1):
         return self.data[:, np.random.randint(self.data.shape[0], size=size)]
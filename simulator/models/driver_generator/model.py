@@ -15,26 +15,58 @@ path_hexes = os.path.join(cur_dir, "..", "..", "data", "hexes.csv")
 
 class DriverGenerator:
     def __init__(self, path_df_lambda=path_df_lambda, path_df_probs=path_df_grid, path_hexes=path_hexes,
-                 random_seed=None):
+                 random_seed=None, assets=None):
+        """
+        assets : compiled AssetBundle (simulator.assets), tables are read from csv files if None
+        """
         logger.info("Initialize driver generator")
-        self.df_lambda = pd.read_csv(path_df_lambda, sep=";").dropna()
-        self.df_probs = pd.read_csv(path_df_probs, sep=";").dropna()
-        hexes = pd.read_csv(path_hexes)
-        self.df_probs = self.df_probs.loc[self.df_probs["first_grid"].isin(hexes["hex"])]
+        if assets is None:
+            assets = self.compile_assets(path_df_lambda, path_df_probs, path_hexes)
+        self.hexes = assets['hexes'].astype(object)
+        self.lambdas = assets['driver_lambdas']
+        self.grids = assets['driver_grids']
+        self.grids_cnt = assets['driver_grids_cnt']
+        self.grids_ptr = assets['driver_grids_ptr']
         if random_seed:
             np.random.seed(random_seed)
 
+    @staticmethod
+    def compile_assets(path_df_lambda=path_df_lambda, path_df_probs=path_df_grid, path_hexes=path_hexes):
+        """
+        Average drivers amount and lifetime per (weekday, hour) and first hexes with their counts,
+        rows of (weekday, hour) are driver_grids[ptr[k]:ptr[k+1]], k = (weekday - 1) * 24 + hour
+        """
+        df_lambda = pd.read_csv(path_df_lambda, sep=";").dropna()
+        df_probs = pd.read_csv(path_df_probs, sep=";").dropna()
+        hexes = pd.read_csv(path_hexes)
+        hex_index = {h: i for i, h in enumerate(hexes["hex"])}
+        df_probs = df_probs.loc[df_probs["first_grid"].isin(hexes["hex"])]
+
+        lambdas = np.full((7, 24, 2), np.nan)
+        for weekday, hour, cnt, lifetime in df_lambda[["pickup_weekday", "appearance",
+                                                       "driver_cnt_avg", "lifetime_avg"]].values[::-1]:
+            lambdas[int(weekday) - 1, int(hour)] = cnt, lifetime
+
+        # stable sort keeps csv order inside every (weekday, hour)
+        keys = (df_probs["pickup_weekday"].values.astype(int) - 1) * 24 + df_probs["appearance"].values.astype(int)
+        order = np.argsort(keys, kind="stable")
+        return dict(hexes=hexes["hex"].to_numpy(dtype=str),
+                    driver_lambdas=lambdas,
+                    driver_grids=df_probs["first_grid"].map(hex_index).values.astype(np.int32)[order],
+                    driver_grids_cnt=df_probs["grid_cnt"].values.astype(np.float64)[order],
+                    driver_grids_ptr=np.searchsorted(keys[order], np.arange(7 * 24 + 1)))
+
     def determine_lambdas(self, weekday, hour):
-        res = self.df_lambda.loc[(self.df_lambda["pickup_weekday"] == weekday)
-                                 & (self.df_lambda["appearance"] == hour),
-                                 ["driver_cnt_avg", "lifetime_avg"]]
-        return res.values[0]
+        res = self.lambdas[weekday - 1, hour]
+        if np.isnan(res).any():
+            raise IndexError(f"No driver lambdas for weekday {weekday} and hour {hour}")
+        return res
 
     def determine_grid_probs(self, weekday, hour):
-        res = self.df_probs.loc[(self.df_probs["pickup_weekday"] == weekday)
-                                & (self.df_probs["appearance"] == hour),
-                                ["first_grid", "grid_cnt"]]
-        return res["first_grid"].values, res["grid_cnt"].values / res["grid_cnt"].values.sum()
+        k = (weekday - 1) * 24 + hour
+        start, end = self.grids_ptr[k], self.grids_ptr[k + 1]
+        cnt = self.grids_cnt[start:end]
+        return self.hexes[self.grids[start:end]], cnt / cnt.sum()
 
     def generate_drivers(self, weekday: int):
         assert (weekday >= 1) and (weekday <= 7)
@@ -1,56 +1,143 @@
 import os
 import pickle
 import random
+import numpy as np
 import pandas as pd
 
 cur_dir = os.path.dirname(os.path.abspath(__file__))
 data_file = os.path.join(cur_dir, "data", "idle_trans_data.pickle")
 path_hexes = os.path.join(cur_dir, "..", "..", "data", "hexes.csv")
 
+# splitmix64 constants
+GOLDEN_GAMMA = np.uint64(0x9E3779B97F4A7C15)
+MIX_1 = np.uint64(0xBF58476D1CE4E5B9)
+MIX_2 = np.uint64(0x94D049BB133111EB)
+
 
 class IdleTransitionModel:
 
-    def __init__(self, data_file=data_file, random_seed=2020):
+    def __init__(self, data_file=data_file, random_seed=2020, assets=None):
+        """
+        assets : compiled AssetBundle (simulator.assets), transitions are read from data_file if None
+        """
         random.seed(random_seed)
+        self.seed(random_seed)
+        if assets is None:
+            arrays = self.compile_assets(data_file)
+            self.hex_index = {h: i for i, h in enumerate(arrays['hexes'].tolist())}
+        else:
+            arrays = assets
+            self.hex_index = assets.hex_index
+        self.hex_ids = arrays['hexes'].tolist()
+        # destination hex index (-1 if there is no data) and self transition probability per (hex, hour)
+        self.idle_dest = arrays['idle_dest']
+        self.idle_sp = arrays['idle_sp']
+
+    def seed(self, random_seed=None):
+        """
+        Stay-or-move draws are a function of (seed, driver_id, second), so the per-second and the event-driven
+        simulation loops move the same drivers at the same seconds
+        """
+        self.key = random.getrandbits(63) if random_seed is None else int(random_seed) % 2 ** 64
+
+    def _uniform(self, driver_ids, seconds):
+        """
+        Draws in [0, 1) of (driver_id, second) pairs, driver_ids and seconds are broadcast
+        """
+        driver_ids = np.array(driver_ids, dtype=np.uint64, ndmin=1)
+        seconds = np.array(seconds, dtype=np.uint64, ndmin=1)
+        # uint64 arrays wrap around on overflow
+        driver_keys = _mix(np.uint64(self.key) + driver_ids * GOLDEN_GAMMA)
+        return (_mix(driver_keys + seconds * GOLDEN_GAMMA) >> np.uint64(11)).astype(np.float64) * 2. ** -53
+
+    @staticmethod
+    def compile_assets(data_file=data_file):
         try:
             with open(data_file, 'rb') as f:
-                self.idle_trans_data = pickle.load(f)
+                idle_trans_data = pickle.load(f)
         except pickle.PickleError:
             raise RuntimeError("Can't load data with idle transitions")
         hexes = pd.read_csv(path_hexes)
-        hex_set = set(hexes["hex"])
-        self.idle_trans_data = {k: v for k, v in self.idle_trans_data.items() if
-                                (k.split("_")[0] in hex_set) and (v["h"] in hex_set)}
+        hex_index = {h: i for i, h in enumerate(hexes["hex"])}
+        idle_dest = np.full((len(hexes), 24), -1, dtype=np.int32)
+        idle_sp = np.ones((len(hexes), 24))
+        for k, v in idle_trans_data.items():
+            hex_id, hour = k.split("_")[0], int(k.split("_")[1])
+            if (hex_id in hex_index) and (v["h"] in hex_index) and 0 <= hour < 24:
+                idle_dest[hex_index[hex_id], hour] = hex_index[v["h"]]
+                idle_sp[hex_index[hex_id], hour] = v["sp"]
+        return dict(hexes=hexes["hex"].to_numpy(dtype=str), idle_dest=idle_dest, idle_sp=idle_sp)
+
+    def _lookup(self, hex_id, hour):
+        """
+        (destination hex, self transition probability) or None if there is no such hex-hour pair in data
+        """
+        hour = int(hour)
+        idx = self.hex_index.get(hex_id)
+        if idx is None or not 0 <= hour < 24:
+            return None
+        dest = self.idle_dest[idx, hour]
+        if dest < 0:
+            return None
+        return self.hex_ids[dest], self.idle_sp[idx, hour]
 
     def get_driver_idle_transition(self, driver_data):
         driver_transitions = []
         try:
-            for driver in driver_data['idle_drivers']:
+            draws = self._uniform([driver['driver_id'] for driver in driver_data['idle_drivers']],
+                                  driver_data['second']).tolist()
+            for driver, draw in zip(driver_data['idle_drivers'], draws):
                 driver_transitions.append({'driver_id': driver['driver_id'],
                                            'idle_hex': self._get_transition(driver['driver_location'],
-                                                                            driver_data['hour'])})
+                                                                            driver_data['hour'], draw)})
         except KeyError:
             raise KeyError('Wrong data structure for driver_data')
 
         return driver_transitions
 
-    def _get_transition(self, hex_id, hour):
-        key = hex_id + '_' + str(int(hour))
-        try:
-            idle_trans = self.idle_trans_data[key]
-            dest_hex_id = idle_trans['h']
-            self_transition_prob = idle_trans['sp']
-
-            # with self_trans_prob driver is laying on the same hex
-            if random.random() <= self_transition_prob:
-                return hex_id
-            # else - move to dest_hex
-            return dest_hex_id
-
+    def _get_transition(self, hex_id, hour, draw):
+        idle_trans = self._lookup(hex_id, hour)
         # no such hex-hour pair in data --> laying on the same hex
         # REALLY exceptional case
-        except KeyError:
+        if idle_trans is None:
+            return hex_id
+        dest_hex_id, self_transition_prob = idle_trans
+
+        # with self_trans_prob driver is laying on the same hex
+        if draw <= self_transition_prob:
             return hex_id
+        # else - move to dest_hex
+        return dest_hex_id
+
+    def sample_idle_dwell(self, hex_id, driver_id, second):
+        """
+        How many seconds the driver keeps laying on hex_id from second on before moving to the transition hex.
+        Same draws as calling get_driver_idle_transition once per second within the hour.
+        Returns (None, hex_id) if the driver does not leave the hex during this hour
+        """
+        idle_trans = self._lookup(hex_id, second // 3600)
+        if idle_trans is None or idle_trans[1] >= 1:
+            return None, hex_id
+        dest_hex_id, self_transition_prob = idle_trans
+        next_hour = (second // 3600 + 1) * 3600
+        # the dwell is geometric with p = 1 - sp, draws are checked in growing chunks of seconds
+        start, chunk = second, max(16, int(1. / max(1. - self_transition_prob, 1e-6)))
+        while start < next_hour:
+            seconds = np.arange(start, min(start + chunk, next_hour))
+            moves = np.flatnonzero(self._uniform(driver_id, seconds) > self_transition_prob)
+            if len(moves) > 0:
+                return int(seconds[moves[0]]) - second, dest_hex_id
+            start, chunk = start + chunk, chunk * 2
+        return None, hex_id
+
+
+def _mix(x):
+    # splitmix64 finalizer of uint64 arrays
+    x = x ^ (x >> np.uint64(30))
+    x = x * MIX_1
+    x = x ^ (x >> np.uint64(27))
+    x = x * MIX_2
+    return x ^ (x >> np.uint64(31))
 
 
 if __name__ == '__main__':
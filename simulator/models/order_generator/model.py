@@ -16,30 +16,57 @@ path_hexes = os.path.join(cur_dir, "..", "..", "data", "hexes.csv")
 
 class OrderGenerator:
     def __init__(self, path_df_lambda=path_df_lambda, path_df_probs=path_df_destination, path_hexes=path_hexes,
-                 random_seed=None):
+                 random_seed=None, assets=None):
+        """
+        assets : compiled AssetBundle (simulator.assets), tables are read from csv files if None
+        """
         logger.info("Initialize order generator")
-        self.df_lambda = pd.read_csv(path_df_lambda, sep=";").dropna()
-        self.df_probs = pd.read_csv(path_df_probs, compression="gzip").dropna()
-        hexes = pd.read_csv(path_hexes)
-        self.df_probs = self.df_probs.loc[(self.df_probs["pickup_grid"].isin(hexes["hex"]))
-                                          & (self.df_probs["dropoff_grid"].isin(hexes["hex"]))]
+        if assets is None:
+            assets = self.compile_assets(path_df_lambda, path_df_probs, path_hexes)
+        self.hexes = assets['hexes'].astype(object)
+        self.lambdas = assets['order_lambdas']
+        self.correspondences = assets['order_correspondences']
+        self.correspondences_cnt = assets['order_correspondences_cnt']
+        self.correspondences_ptr = assets['order_correspondences_ptr']
         if random_seed:
             np.random.seed(random_seed)
 
+    @staticmethod
+    def compile_assets(path_df_lambda=path_df_lambda, path_df_probs=path_df_destination, path_hexes=path_hexes):
+        """
+        Average orders per (weekday, hour) and pickup-dropoff hex pairs with their counts,
+        rows of (weekday, hour) are order_correspondences[ptr[k]:ptr[k+1]], k = (weekday - 1) * 24 + hour
+        """
+        df_lambda = pd.read_csv(path_df_lambda, sep=";").dropna()
+        df_probs = pd.read_csv(path_df_probs, compression="gzip").dropna()
+        hexes = pd.read_csv(path_hexes)
+        hex_index = {h: i for i, h in enumerate(hexes["hex"])}
+        df_probs = df_probs.loc[(df_probs["pickup_grid"].isin(hexes["hex"]))
+                                & (df_probs["dropoff_grid"].isin(hexes["hex"]))]
+
+        lambdas = np.zeros((7, 24))
+        for weekday, hour, cnt in df_lambda[["pickup_weekday", "pickup_hour", "pickup_cnt_avg"]].values[::-1]:
+            lambdas[int(weekday) - 1, int(hour)] = cnt
+
+        # stable sort keeps csv order inside every (weekday, hour)
+        keys = (df_probs["pickup_weekday"].values.astype(int) - 1) * 24 + df_probs["pickup_hour"].values.astype(int)
+        order = np.argsort(keys, kind="stable")
+        correspondences = np.column_stack([df_probs["pickup_grid"].map(hex_index).values,
+                                           df_probs["dropoff_grid"].map(hex_index).values])[order]
+        return dict(hexes=hexes["hex"].to_numpy(dtype=str),
+                    order_lambdas=lambdas,
+                    order_correspondences=correspondences.astype(np.int32),
+                    order_correspondences_cnt=df_probs["pickup_cnt"].values.astype(np.float64)[order],
+                    order_correspondences_ptr=np.searchsorted(keys[order], np.arange(7 * 24 + 1)))
+
     def determine_lambda(self, weekday, hour):
-        res = self.df_lambda.loc[(self.df_lambda["pickup_weekday"] == weekday)
-                                 & (self.df_lambda["pickup_hour"] == hour),
-                                 "pickup_cnt_avg"]
-        if res.empty:
-            return 0
-        else:
-            return res.values[0]
+        return self.lambdas[weekday - 1, hour]
 
     def determine_correspondence_probs(self, weekday, hour):
-        res = self.df_probs.loc[(self.df_probs["pickup_weekday"] == weekday)
-                                & (self.df_probs["pickup_hour"] == hour),
-                                ["pickup_grid", "dropoff_grid", "pickup_cnt"]]
-        return res[["pickup_grid", "dropoff_grid"]].values, res["pickup_cnt"].values / res["pickup_cnt"].values.sum()
+        k = (weekday - 1) * 24 + hour
+        start, end = self.correspondences_ptr[k], self.correspondences_ptr[k + 1]
+        cnt = self.correspondences_cnt[start:end]
+        return self.hexes[self.correspondences[start:end]], cnt / cnt.sum()
 
     def generate_orders(self, weekday: int):
         assert (weekday >= 1) and (weekday <= 7)
@@ -1,9 +1,10 @@
 import pickle
 import os
 from joblib import load
+import numpy as np
 import pandas as pd
 
-from .utils import convert_to_datetime, get_distance, prepare_batch, generate_dummy
+from .utils import convert_to_datetime, get_distance, generate_dummy, dummy_columns, time_features
 
 import logging
 
@@ -33,9 +34,45 @@ class RewardModel:
                              'day_of_week',
                              'pick_up_eta'}
 
+        # positions of the features in the model input
+        self.distance_column = self.features.index('distance')
+        self.duration_column = self.features.index('duration')
+        self.dummy_columns = dict(p_w=dummy_columns(self.features, 'p_w', range(1, 8)),
+                                  p_h=dummy_columns(self.features, 'p_h', range(0, 24)),
+                                  d_w=dummy_columns(self.features, 'd_w', range(1, 8)),
+                                  d_h=dummy_columns(self.features, 'd_h', range(0, 24)))
+
     def predict_batch(self, request_list: list):
-        prepared_request = prepare_batch(request_list)
-        return self.model.predict(prepared_request[self.features].values).flatten()
+        return self.predict_arrays(distance=[r['distance'] for r in request_list],
+                                   timestamp=[r['timestamp'] for r in request_list],
+                                   order_finish_timestamp=[r['order_finish_timestamp'] for r in request_list],
+                                   pick_up_eta=[r['pick_up_eta'] for r in request_list])
+
+    def predict_arrays(self, distance, timestamp, order_finish_timestamp, pick_up_eta):
+        if len(distance) == 0:
+            return np.zeros(0)
+        prepared_request = self.prepare_arrays(distance, timestamp, order_finish_timestamp, pick_up_eta)
+        return self.model.predict(prepared_request).flatten()
+
+    def prepare_arrays(self, distance, timestamp, order_finish_timestamp, pick_up_eta):
+        """
+        Model input matrix with columns in self.features order, same values as prepare_batch gives
+        """
+        timestamp = np.asarray(timestamp, dtype=np.int64)
+        order_finish_timestamp = np.asarray(order_finish_timestamp, dtype=np.int64)
+        n_rows = len(timestamp)
+        prepared_request = np.zeros((n_rows, len(self.features)))
+        prepared_request[:, self.distance_column] = distance
+        prepared_request[:, self.duration_column] = (order_finish_timestamp - timestamp - np.asarray(pick_up_eta)) / 60
+
+        rows = np.arange(n_rows)
+        p_w, p_h = time_features(timestamp)
+        d_w, d_h = time_features(order_finish_timestamp)
+        for prefix, values in (('p_w', p_w), ('p_h', p_h), ('d_w', d_w), ('d_h', d_h)):
+            columns = self.dummy_columns[prefix][values]
+            has_column = columns >= 0
+            prepared_request[rows[has_column], columns[has_column]] = 1
+        return prepared_request
 
     def predict(self, request: dict):
         prepared_request = self._prepare_request(request)
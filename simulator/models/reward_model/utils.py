@@ -1,4 +1,5 @@
 import datetime
+import numpy as np
 import pandas as pd
 from geopy.distance import geodesic
 
@@ -39,3 +40,23 @@ def prepare_batch(requests_list: list):
     request_df['start_dttm'] = pd.to_datetime(request_df['timestamp'], unit='s') + pd.to_timedelta(3, 'h')
     request_df['end_dttm'] = pd.to_datetime(request_df['order_finish_timestamp'], unit='s') + pd.to_timedelta(3, 'h')
     return pd.merge(request_df, generate_dummies(request_df), how='left', left_index=True, right_index=True)
+
+
+def dummy_columns(features: list, prefix: str, values_range):
+    """
+    Position of prefix_<value> dummy in features for every value in values_range, -1 for dropped dummies
+    """
+    columns = np.full(max(values_range) + 1, -1, dtype=int)
+    for i in values_range:
+        name = prefix + '_' + str(i)
+        if name in features:
+            columns[i] = features.index(name)
+    return columns
+
+
+def time_features(timestamps, hours_shift=3):
+    """
+    Day of week (Monday=0) and hour of unix timestamps shifted by hours_shift, as in prepare_batch
+    """
+    seconds = np.asarray(timestamps, dtype=np.int64) + hours_shift * 60 * 60
+    return (seconds // (24 * 60 * 60) + 3) % 7, (seconds // (60 * 60)) % 24
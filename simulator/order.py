@@ -1,11 +1,21 @@
 import itertools
+import numpy as np
 import pandas as pd
 
+from .fleet import FleetArrays, Column, HexColumn
+
 import logging
 
 logger = logging.getLogger(__name__)
 
 
+# array columns of orders: name -> (dtype, shape, value of a free slot)
+ORDER_COLUMNS = dict(order_id=(np.int64, (), -1), start_hex=(np.int32, (), -1), finish_hex=(np.int32, (), -1),
+                     start_location=(np.float64, (2,), np.nan), finish_location=(np.float64, (2,), np.nan),
+                     status=(np.int8, (), -1), reward=(np.float64, (), np.nan), pick_up_eta=(np.float64, (), np.nan),
+                     finish_timestamp=(np.int64, (), -1), driver_distance=(np.float64, (), np.nan))
+
+
 class OrderException(Exception):
     pass
 
@@ -15,24 +25,62 @@ class OrdersCollectionException(Exception):
 
 
 class Order:
+    """
+    View of an order slot in OrdersCollection.fleet
+    """
+    __slots__ = ('_fleet', 'slot', 'order_id', 'vehicle', '_collection')
     newid = itertools.count()
     status_list = ['assigned', 'unassigned']
 
-    def __init__(self, env, start_hex, end_hex):
+    start_hex = HexColumn('start_hex')
+    finish_hex = HexColumn('finish_hex')
+    order_start_location = Column('start_location')
+    order_finish_location = Column('finish_location')
+    reward = Column('reward', missing=np.nan)
+    pick_up_eta = Column('pick_up_eta', missing=np.nan)
+    order_finish_timestamp = Column('finish_timestamp', missing=-1)
+    order_driver_distance = Column('driver_distance', missing=np.nan)
+
+    def __init__(self, env, start_hex, end_hex, start_location=None, finish_location=None, fleet=None):
         # logger.info(f"Start initializing order")
-        self.env = env
+        self._collection = None
+        self._fleet = env.orders_collection.fleet if fleet is None else fleet
+        self._fleet.allocate(self)
         self.order_id = next(self.newid)
+        self._fleet.order_id[self.slot] = self.order_id
         self.start_hex, self.finish_hex = start_hex, end_hex
-        # logger.info(f"Start generate order endpoints")
-        self.order_start_location, self.order_finish_location = self.env.map.generate_order_endpoints(start_hex,
-                                                                                                      end_hex)
-        # logger.info(f"Stop generate order endpoints")
+        if start_location is None or finish_location is None:
+            start_location, finish_location = env.map.generate_order_endpoints(start_hex, end_hex)
+        self.order_start_location, self.order_finish_location = start_location, finish_location
         self.status = 'unassigned'
         self.vehicle = None
-        self.reward = None
-        self.pick_up_eta = None
-        self.order_finish_timestamp = None
-        self.order_driver_distance = None
+
+    @classmethod
+    def restore(cls, fleet, order_id):
+        """
+        View of a new slot, no new id is drawn (see OrdersCollection.restore)
+        """
+        order = cls.__new__(cls)
+        order._collection = None
+        order._fleet = fleet
+        fleet.allocate(order)
+        order.order_id = order_id
+        order.vehicle = None
+        return order
+
+    @property
+    def env(self):
+        return self._fleet.env
+
+    @property
+    def status(self):
+        return self.status_list[self._fleet.status[self.slot]]
+
+    @status.setter
+    def status(self, status):
+        if self._collection is not None:
+            self._collection._update_status(self, status)
+        self._fleet.status[self.slot] = self.status_list.index(status)
 
     def assigning(self, vehicle, reward: float, pick_up_eta: float,
                   order_finish_timestamp: int, order_driver_distance: float):
@@ -49,31 +97,91 @@ class Order:
         self.vehicle.cancel_order(finish)
 
 
-class OrdersCollection(list):
+class OrdersCollection:
+    """
+    Orders in the simulation indexed by id (dict_view, in the order of ids) and ids of orders by status
+    (status_view). Indexes are kept up to date by Order on status changes, slots of removed orders are reused
+    """
+
     def __init__(self, env):
         logger.info(f"Start initializing order collection")
         self.env = env
-        super().__init__()
+        self.fleet = FleetArrays(env, ORDER_COLUMNS)
+        self.dict_view = {}
+        self.status_view = {status: set() for status in Order.status_list}
+
+    def __len__(self):
+        return len(self.dict_view)
+
+    def __iter__(self):
+        return iter(list(self.dict_view.values()))
 
     def add_orders(self, orders: list):
-        for start_hex, end_hex in orders:
-            self.append(Order(env=self.env, start_hex=start_hex, end_hex=end_hex))
+        if not orders:
+            return None
+        start_hexes, end_hexes = zip(*orders)
+        start_locations, finish_locations = self.env.map.generate_order_endpoints_many(
+            self.env.map.get_hex_idx(start_hexes), self.env.map.get_hex_idx(end_hexes))
+        for start_hex, end_hex, start_location, finish_location in zip(start_hexes, end_hexes,
+                                                                       start_locations.tolist(),
+                                                                       finish_locations.tolist()):
+            self._add(Order(env=self.env, start_hex=start_hex, end_hex=end_hex,
+                            start_location=start_location, finish_location=finish_location, fleet=self.fleet))
+
+    def _add(self, order):
+        self.dict_view[order.order_id] = order
+        self.status_view[order.status].add(order.order_id)
+        order._collection = self
+
+    def _update_status(self, order, status):
+        self.status_view[order.status].discard(order.order_id)
+        self.status_view[status].add(order.order_id)
+
+    def snapshot(self):
+        slots = self.fleet.slots_of(list(self.dict_view.values()))
+        return {f'order_{name}': self.fleet[name][slots] for name in ORDER_COLUMNS}
+
+    def restore(self, arrays: dict):
+        """
+        Recreate orders saved by snapshot, vehicles are linked back by DriversCollection.restore
+        """
+        self.fleet = FleetArrays(self.env, ORDER_COLUMNS)
+        orders = [Order.restore(self.fleet, order_id) for order_id in arrays['order_order_id'].tolist()]
+        slots = self.fleet.slots_of(orders)
+        for name in ORDER_COLUMNS:
+            self.fleet[name][slots] = arrays[f'order_{name}']
+        self.dict_view = {}
+        self.status_view = {status: set() for status in Order.status_list}
+        for order in orders:
+            self._add(order)
 
     def get_order_by_id(self, order_id: int):
-        return next(order for order in self if order.order_id == order_id)
+        if order_id not in self.dict_view:
+            raise OrdersCollectionException(f'Order_id={order_id} does not exists')
+        return self.dict_view[order_id]
 
     def get_orders(self, status: str):
         if status not in Order.status_list:
             raise OrdersCollectionException(f'status must be one of {Order.status_list}')
-        return [i for i in self if i.status == status]
+        return [self.dict_view[order_id] for order_id in sorted(self.status_view[status])]
+
+    def remove_many(self, orders: list):
+        """
+        Remove orders from the collection, their slots are released
+        """
+        for order in orders:
+            del self.dict_view[order.order_id]
+            self.status_view[order.status].discard(order.order_id)
+            order._collection = None
+            self.fleet.release(order)
+
+    def cancel_many(self, orders: list, finish=False):
+        """
+        Cancel assigned orders (finish=True - orders are completed) and remove them from the collection
+        """
+        for order in orders:
+            order.cancel(finish)
+        self.remove_many(orders)
 
     def delete_unassigned_orders(self):
-        unassigned = self.get_orders('unassigned')
-        for order in unassigned:
-            if order.status == 'unassigned':
-                self.remove(order)
-
-    def cancel_orders(self, orders_list: list, finish=False):
-        for order in orders_list:
-            order.cancel(finish)
-            self.remove(order)
+        self.remove_many([self.dict_view[order_id] for order_id in self.status_view['unassigned']])
@@ -0,0 +1,98 @@
+"""
+Offline builder of all-pairs shortest path tables of the hex graph.
+
+    python -m simulator.paths --processes 8
+
+writes data/hex_paths_v<PATHS_VERSION>.npy: N x N structured array with the shortest path distance (km, float32)
+and the predecessor of the destination on this path (int32, -1 for the source itself) for every pair of hexes.
+Rows and columns follow the order of data/hexes.csv, Map memory-maps the file at startup.
+"""
+import argparse
+import os
+import pickle
+from multiprocessing import Pool
+
+import networkx as nx
+import numpy as np
+import pandas as pd
+from scipy.sparse.csgraph import dijkstra
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+cur_dir = os.path.dirname(os.path.abspath(__file__))
+
+PATHS_VERSION = 1
+PATHS_DTYPE = np.dtype([('distance', np.float32), ('predecessor', np.int32)])
+path_tables = os.path.join(cur_dir, 'data', f'hex_paths_v{PATHS_VERSION}.npy')
+
+
+def load_hex_graph(data_dir=os.path.join(cur_dir, 'data')):
+    with open(os.path.join(data_dir, 'hex_graph.pickle'), 'rb') as f:
+        graph = pickle.load(f)
+    hexes = pd.read_csv(os.path.join(data_dir, 'hexes.csv'), sep=';')
+    return graph.subgraph(hexes["hex"]), hexes["hex"].tolist()
+
+
+def _dijkstra_chunk(args):
+    adjacency, sources = args
+    distances, predecessors = dijkstra(adjacency, directed=False, indices=sources, return_predecessors=True)
+    return sources, distances, predecessors
+
+
+def build_path_tables(graph, hexes: list, processes=None, chunk_size=64):
+    """
+    Shortest path distance and predecessor for all pairs of hexes, sources are split between processes
+    """
+    adjacency = nx.to_scipy_sparse_array(graph, nodelist=hexes, weight='weight', format='csr')
+    chunks = [(adjacency, np.arange(i, min(i + chunk_size, len(hexes)))) for i in range(0, len(hexes), chunk_size)]
+    tables = np.zeros((len(hexes), len(hexes)), dtype=PATHS_DTYPE)
+    with Pool(processes=processes) as pool:
+        for sources, distances, predecessors in pool.imap_unordered(_dijkstra_chunk, chunks):
+            logger.info(f"Paths from {sources[-1] + 1} of {len(hexes)} hexes are ready")
+            tables['distance'][sources] = distances
+            tables['predecessor'][sources] = np.where(predecessors < 0, -1, predecessors)
+    return tables
+
+
+def load_path_tables(path=path_tables, n_hexes=None):
+    """
+    Memory-mapped path tables or None if they have not been built (or built for another set of hexes)
+    """
+    if not os.path.exists(path):
+        return None
+    tables = np.load(path, mmap_mode='r')
+    if tables.dtype != PATHS_DTYPE or (n_hexes is not None and tables.shape != (n_hexes, n_hexes)):
+        logger.warning(f"{path} does not match hexes.csv, rebuild it with python -m simulator.paths")
+        return None
+    return tables
+
+
+def restore_path(predecessors, source: int, destination: int):
+    """
+    Hex indices of the shortest path from source to destination given the predecessor row of source
+    """
+    path = [destination]
+    while path[-1] != source:
+        previous = int(predecessors[path[-1]])
+        if previous < 0:
+            raise ValueError(f"No path between hexes {source} and {destination}")
+        path.append(previous)
+    return path[::-1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build all-pairs shortest path tables of the hex graph')
+    parser.add_argument('--processes', type=int, default=None, help='Number of worker processes (default: all CPUs)')
+    parser.add_argument('--output', default=path_tables, help=f'Output file (default: {path_tables})')
+    args = parser.parse_args()
+
+    graph, hexes = load_hex_graph()
+    tables = build_path_tables(graph, hexes, processes=args.processes)
+    np.save(args.output, tables)
+    print(f'{args.output} saved: {len(hexes)} hexes, {tables.nbytes / 2 ** 20:.1f} MB')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+"""
+Runs simulations for a grid of days of week x random seeds x agents in a process pool.
+
+    python -m simulator.runner --agents simulator.agent:Agent --days 1 2 3 4 5 6 7 --seeds 1 2 --output week.csv
+
+Every simulation runs in its own worker process. Static assets (simulator.assets) are memory-mapped in the parent
+before the pool starts, so forked workers share them instead of loading them once per simulation.
+Every worker returns aggregated totals of the day (and optionally DataCollector.data), results are combined
+into one table with a row per (agent, day_of_week, seed).
+"""
+import argparse
+import importlib
+import itertools
+import logging
+import time
+from multiprocessing import Pool
+
+import numpy as np
+import pandas as pd
+
+from .assets import get_assets
+from .main import TaxiSimulator
+
+logger = logging.getLogger(__name__)
+
+# per step totals that are summed over the day, others (total_drivers, ...) are averaged
+SUM_COLUMNS = ['income_orders', 'income_drivers', 'outcome_drivers', 'assigned_orders', 'cancelled_orders',
+               'reward_earned', 'reward_cancelled']
+MEAN_COLUMNS = ['total_drivers', 'total_orders', 'total_idle_drivers', 'total_assigned']
+
+
+class RunnerException(Exception):
+    pass
+
+
+def load_agent(agent):
+    """
+    Agent instance from a "module:Class" spec or from a picklable factory (class or top-level function)
+    """
+    if isinstance(agent, str):
+        try:
+            module_name, class_name = agent.split(':')
+        except ValueError:
+            raise RunnerException(f"Agent spec should look like module:Class, got {agent}")
+        return getattr(importlib.import_module(module_name), class_name)()
+    return agent()
+
+
+def agent_name(agent):
+    return agent if isinstance(agent, str) else getattr(agent, '__qualname__', repr(agent))
+
+
+def summarize(data: list):
+    """
+    Totals of one simulated day from DataCollector.data, averages are weighted by the seconds till the next step
+    """
+    totals = pd.DataFrame([step['total'] for step in data])
+    summary = dict(steps=len(totals), trajectories=sum(len(step['trajectories']) for step in data))
+    summary.update(totals.reindex(columns=SUM_COLUMNS).sum().to_dict())
+    # the state of a step holds till the next one, steps of the event-driven loop are not evenly spaced
+    seconds = np.array([step['step'] for step in data], dtype=np.float64)
+    weights = np.diff(seconds, append=seconds[-1] + 1) if len(seconds) else seconds
+    if len(weights):
+        # the first step is the state before start_hour, it stands for one step as in the per-second loop
+        weights[0] = 1
+    means = totals.reindex(columns=MEAN_COLUMNS).astype(np.float64)
+    summary.update({f'avg_{column}': np.average(means[column], weights=weights) if weights.sum() > 0 else np.nan
+                    for column in MEAN_COLUMNS})
+    return summary
+
+
+def _init_worker(log_level):
+    logging.getLogger().setLevel(log_level)
+
+
+def _run_simulation(task):
+    agent, day_of_week, seed, simulator_kwargs, simulate_kwargs, keep_data = task
+    start = time.time()
+    simulator = TaxiSimulator(write_simulations_to_db=False, random_seed=seed, **simulator_kwargs)
+    data = simulator.simulate(day_of_week=day_of_week, agent=load_agent(agent), **simulate_kwargs)
+    result = dict(agent=agent_name(agent), day_of_week=day_of_week, seed=seed)
+    result.update(summarize(data))
+    result['elapsed'] = time.time() - start
+    return result, data if keep_data else None
+
+
+def run_grid(agents, days=range(1, 8), seeds=(None,), processes=None, start_hour=0, end_hour=24,
+             event_driven=False, training_each=60, keep_data=False, output=None, log_level=logging.WARNING):
+    """
+    Simulate every (agent, day_of_week, seed) combination in a process pool
+
+    agents : "module:Class" specs or picklable agent factories, every simulation gets its own agent instance
+    keep_data : also return DataCollector.data of every simulation, keyed by (agent, day_of_week, seed)
+    output : path of csv file to write the combined results table to
+    :return: results DataFrame (and dict of simulation data if keep_data)
+    """
+    if not all(1 <= day <= 7 for day in days):
+        raise RunnerException(f"Days of week should be in 1..7, got {list(days)}")
+    simulator_kwargs = dict(start_hour=start_hour, end_hour=end_hour, event_driven=event_driven)
+    simulate_kwargs = dict(training_each=training_each)
+    tasks = [(agent, day, seed, simulator_kwargs, simulate_kwargs, keep_data)
+             for agent, day, seed in itertools.product(agents, days, seeds)]
+
+    # map the bundle before forking, workers inherit it
+    get_assets()
+
+    results, data = list(), dict()
+    # one process per simulation: id counters and global random states start fresh for every run
+    with Pool(processes=processes, initializer=_init_worker, initargs=(log_level,), maxtasksperchild=1) as pool:
+        for result, simulation_data in pool.imap_unordered(_run_simulation, tasks):
+            logger.info(f"{result['agent']} day {result['day_of_week']} seed {result['seed']} "
+                        f"done in {result['elapsed']:.1f}s")
+            results.append(result)
+            if keep_data:
+                data[(result['agent'], result['day_of_week'], result['seed'])] = simulation_data
+
+    results = pd.DataFrame(results).sort_values(['agent', 'day_of_week', 'seed'],
+                                                key=lambda column: column.astype(str)).reset_index(drop=True)
+    if output:
+        results.to_csv(output, index=False, sep=';')
+    if keep_data:
+        return results, data
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run simulations for days of week x seeds x agents in parallel')
+    parser.add_argument('--agents', nargs='+', default=['simulator.agent:Agent'],
+                        help='Agents as module:Class (default: simulator.agent:Agent)')
+    parser.add_argument('--days', nargs='+', type=int, default=list(range(1, 8)), help='Days of week (default: 1..7)')
+    parser.add_argument('--seeds', nargs='+', type=int, default=[None], help='Random seeds (default: no seed)')
+    parser.add_argument('--processes', type=int, default=None, help='Number of worker processes (default: all CPUs)')
+    parser.add_argument('--start-hour', type=int, default=0)
+    parser.add_argument('--end-hour', type=int, default=24)
+    parser.add_argument('--event-driven', action='store_true',
+                        help='Visit only the seconds where something happens instead of every second')
+    parser.add_argument('--training-each', type=int, default=60, help='Train the agent each N seconds')
+    parser.add_argument('--log-level', default='WARNING', help='Log level of worker processes')
+    parser.add_argument('--output', default='results.csv', help='Combined results table (default: results.csv)')
+    args = parser.parse_args()
+
+    results = run_grid(args.agents, days=args.days, seeds=args.seeds, processes=args.processes,
+                       start_hour=args.start_hour, end_hour=args.end_hour, event_driven=args.event_driven,
+                       training_each=args.training_each, output=args.output, log_level=args.log_level)
+    print(results.to_string(index=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,177 @@
+"""
+Trajectory samples of all drivers of one simulation in preallocated arrays.
+
+A sample is a transition of a driver from a start state to an end state (second, status, hex, location)
+with the reward earned at the end state and the terminal flag. Samples of all drivers are appended
+to one table, every sample keeps the previous sample of its driver: the last assignment of a driver
+is rolled back in O(1) when the order is cancelled, samples of a driver are gathered when it goes offline.
+The table grows by doubling, samples are never modified after they are appended.
+"""
+import numpy as np
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+STATE_DTYPE = np.dtype([('t', np.int64), ('status', np.int8), ('hex', np.int32),
+                        ('lon', np.float64), ('lat', np.float64)])
+SAMPLE_DTYPE = np.dtype([('driver', np.int32), ('start', STATE_DTYPE), ('end', STATE_DTYPE),
+                         ('reward', np.float64), ('done', np.int8)])
+
+
+class TrajectoryStore:
+    def __init__(self, hex_ids, statuses: list, hex_index=None, capacity=4096):
+        """
+        hex_ids : hexes of the map in the order of their indices, hex_index - their indices by hex
+        statuses : driver statuses, the first one is idle. Action of a sample is the status of its start
+                   if the end has the same status, idle otherwise
+        """
+        self.statuses = list(statuses)
+        self._status_codes = {status: code for code, status in enumerate(self.statuses)}
+        self.hex_ids = np.asarray(hex_ids).astype(str)
+        self._hex_index = hex_index if hex_index is not None else {h: i for i, h in enumerate(self.hex_ids.tolist())}
+        # dtype of the samples returned by take
+        self.sample_dtype = np.dtype([('trajectory_id', 'U32'),
+                                      ('t_start', np.int64), ('hex_start', self.hex_ids.dtype),
+                                      ('lon_start', np.float64), ('lat_start', np.float64),
+                                      ('t_end', np.int64), ('hex_end', self.hex_ids.dtype),
+                                      ('lon_end', np.float64), ('lat_end', np.float64),
+                                      ('action', f'U{max(len(status) for status in self.statuses)}'),
+                                      ('reward', np.float64), ('done', np.int8)])
+        self._empty = np.empty(0, dtype=self.sample_dtype)
+
+        self.n_samples, self.n_drivers = 0, 0
+        self.samples = np.empty(capacity, dtype=SAMPLE_DTYPE)
+        self._prev = np.empty(capacity, dtype=np.int64)
+        # per driver: trajectory id, last sample, start state of the next sample and whether it is set
+        self.trajectory_ids = np.empty(capacity, dtype='U32')
+        self._last = np.empty(capacity, dtype=np.int64)
+        self._starts = np.empty(capacity, dtype=STATE_DTYPE)
+        self._open = np.empty(capacity, dtype=bool)
+
+    def __len__(self):
+        return self.n_samples
+
+    def add_driver(self, trajectory_id: str):
+        """
+        Register a driver, returns its index in the store
+        """
+        if self.n_drivers == len(self._last):
+            self.trajectory_ids, self._last, self._starts, self._open = [
+                self._grow(array) for array in (self.trajectory_ids, self._last, self._starts, self._open)]
+        k = self.n_drivers
+        self.trajectory_ids[k] = trajectory_id
+        self._last[k] = -1
+        self._open[k] = False
+        self.n_drivers += 1
+        return k
+
+    def state(self, t, status, hexagon, location):
+        return t, self._status_codes[status], self._hex_index[hexagon], location[0], location[1]
+
+    def is_open(self, k):
+        return self._open[k]
+
+    def has_samples(self, k):
+        return self._last[k] >= 0
+
+    def is_idle_at(self, k, hexagon):
+        """
+        The next sample of driver k starts idle on the hexagon
+        """
+        start = self._starts[k]
+        return start['status'] == 0 and start['hex'] == self._hex_index[hexagon]
+
+    def open(self, k, state: tuple):
+        self._starts[k] = state
+        self._open[k] = True
+
+    def reopen(self, k):
+        """
+        Start the next sample of driver k from the end of its last sample
+        """
+        self._starts[k] = self.samples['end'][self._last[k]]
+        self._open[k] = True
+
+    def close(self, k):
+        self._open[k] = False
+
+    def append(self, k, state: tuple, reward=0., done=0):
+        """
+        Sample of driver k from its start state to state, the next sample starts from state
+        """
+        if self.n_samples == len(self.samples):
+            self.samples, self._prev = self._grow(self.samples), self._grow(self._prev)
+        i = self.n_samples
+        self.samples[i] = (k, self._starts[k], state, reward, done)
+        self._prev[i] = self._last[k]
+        self._last[k] = i
+        self._starts[k] = state
+        self.n_samples += 1
+
+    def rollback(self, k):
+        """
+        Drop the last assignment of driver k (assignment and order completion samples),
+        the next sample starts from the start of the assignment
+        """
+        assignment = self._prev[self._last[k]]
+        self._starts[k] = self.samples['start'][assignment]
+        self._open[k] = True
+        self._last[k] = self._prev[assignment]
+
+    def collect(self, k):
+        """
+        Indices of samples of driver k in the order they were appended
+        """
+        indices, i = [], self._last[k]
+        while i >= 0:
+            indices.append(i)
+            i = self._prev[i]
+        return indices[::-1]
+
+    def take(self, indices: list):
+        """
+        Samples with trajectory ids, hexes and actions as a structured array of sample_dtype
+        """
+        if not indices:
+            return self._empty
+        samples = self.samples[indices]
+        start, end = samples['start'], samples['end']
+        result = np.empty(len(samples), dtype=self.sample_dtype)
+        result['trajectory_id'] = self.trajectory_ids[samples['driver']]
+        for suffix, state in (('start', start), ('end', end)):
+            result[f't_{suffix}'] = state['t']
+            result[f'hex_{suffix}'] = self.hex_ids[state['hex']]
+            result[f'lon_{suffix}'] = state['lon']
+            result[f'lat_{suffix}'] = state['lat']
+        actions = np.where(start['status'] == end['status'], start['status'], 0)
+        result['action'] = np.asarray(self.statuses)[actions]
+        result['reward'] = samples['reward']
+        result['done'] = samples['done']
+        return result
+
+    def snapshot(self):
+        n, m = self.n_samples, self.n_drivers
+        return dict(trajectory_samples=self.samples[:n].copy(), trajectory_prev=self._prev[:n].copy(),
+                    trajectory_ids=self.trajectory_ids[:m].copy(), trajectory_last=self._last[:m].copy(),
+                    trajectory_starts=self._starts[:m].copy(), trajectory_open=self._open[:m].copy())
+
+    def restore(self, arrays: dict):
+        self.n_samples, self.n_drivers = len(arrays['trajectory_samples']), len(arrays['trajectory_ids'])
+        samples_capacity, drivers_capacity = len(self.samples), len(self._last)
+        self.samples = self._grow(arrays['trajectory_samples'], samples_capacity)
+        self._prev = self._grow(arrays['trajectory_prev'], samples_capacity)
+        self.trajectory_ids = self._grow(arrays['trajectory_ids'], drivers_capacity)
+        self._last = self._grow(arrays['trajectory_last'], drivers_capacity)
+        self._starts = self._grow(arrays['trajectory_starts'], drivers_capacity)
+        self._open = self._grow(arrays['trajectory_open'], drivers_capacity)
+
+    @staticmethod
+    def _grow(array, capacity=None):
+        """
+        Copy of array with at least the capacity and twice its length, the tail is not initialized
+        """
+        capacity = max(capacity or 0, 2 * len(array), 1)
+        grown = np.empty(capacity, dtype=array.dtype)
+        grown[:len(array)] = array
+        return grown
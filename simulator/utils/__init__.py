@@ -1,3 +1,4 @@
 from .utils import *
 from .dbclient import DataManager
 from .datacollector import DataCollector
+from .sinks import MemorySink, MongoSink, ColumnarSink, read_simulation
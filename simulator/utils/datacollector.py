@@ -1,31 +1,45 @@
 import numpy as np
 import logging
 
+from .sinks import MemorySink, MongoSink
+
 logger = logging.getLogger(__name__)
 
 
 class DataCollector:
-    def __init__(self, env, db_client=None):
+    def __init__(self, env, db_client=None, sink=None, replay_buffer=None):
+        """
+        sink : where steps are written (simulator.utils.sinks), MongoSink(db_client) if db_client is given,
+               MemorySink otherwise
+        replay_buffer : object with push_trajectories(samples, day_of_week) (e.g. rl.buffers.RingReplayBuffer),
+                        gets trajectory samples of every written step
+        """
         self.env = env
         self.db_client = db_client
-        self.data = list()
+        if sink is None:
+            sink = MongoSink(db_client) if db_client else MemorySink()
+        self.sink = sink
+        self.replay_buffer = replay_buffer
 
         self._step_data = dict()
         self.init_step_data()
+        self._write_step()
 
-        if not self.db_client:
-            self.data.append(self._step_data)
-        else:
-            self.db_client.write_simulation_step(self._step_data)
-            self._step_data = dict()
+    @property
+    def data(self):
+        """
+        Steps kept in memory (MemorySink), empty for other sinks
+        """
+        return self.sink.data
 
     def init_step_data(self):
+        self._step_data = dict()
         self._step_data['step'] = self.env.t
         self._step_data['day_of_week'] = self.env.day_of_week
         self._step_data['total'] = dict(total_drivers=len(self.env.drivers_collection),
                                         total_orders=len(self.env.orders_collection),
-                                        total_idle_drivers=len(self.env.drivers_collection.get_drivers(status='idle')),
-                                        total_assigned=len(self.env.drivers_collection.get_drivers(status='assigned')),
+                                        total_idle_drivers=self.env.drivers_collection.count_drivers('idle'),
+                                        total_assigned=self.env.drivers_collection.count_drivers('assigned'),
                                         income_orders=0,
                                         income_drivers=0,
                                         outcome_drivers=0,
@@ -37,29 +51,65 @@ class DataCollector:
                                               assigned=list(),
                                               cancelled=list())
         self._step_data['repositioning'] = list()
+        # indices of trajectory samples in env.trajectory_store till the step is written
         self._step_data['trajectories'] = list()
 
+    def snapshot(self):
+        return len(self.data), self._copy_step(self._step_data)
+
+    def restore(self, n_steps: int, step_data: dict):
+        """
+        Drop steps collected after the snapshot, steps already written to a database or files are kept
+        """
+        self.sink.truncate(n_steps)
+        self._step_data = self._copy_step(step_data)
+
+    @staticmethod
+    def _copy_step(step_data: dict):
+        return dict(step_data, total=dict(step_data['total']),
+                    dispatching={k: list(v) for k, v in step_data['dispatching'].items()},
+                    repositioning=list(step_data['repositioning']), trajectories=list(step_data['trajectories']))
+
     def write_simulation_step(self):
         logger.debug("Write simulation step")
         self._step_data['total']['total_drivers'] = len(self.env.drivers_collection)
         self._step_data['total']['total_orders'] = len(self.env.orders_collection)
-        self._step_data['total']['total_idle_drivers'] = len(self.env.drivers_collection.get_drivers(status='idle'))
-        self._step_data['total']['total_assigned'] = len(self.env.drivers_collection.get_drivers(status='assigned'))
-        if not self.db_client:
-            self.data.append(self._step_data)
-        else:
-            self.db_client.write_simulation_step(self._step_data)
+        self._step_data['total']['total_idle_drivers'] = self.env.drivers_collection.count_drivers('idle')
+        self._step_data['total']['total_assigned'] = self.env.drivers_collection.count_drivers('assigned')
+        self._write_step()
+
+    def write_skipped_steps(self, seconds):
+        """
+        Steps of the seconds skipped by the event-driven loop, nothing happens in them and totals of the state
+        are carried forward as the per-second loop would write them
+        """
+        for second in seconds:
+            self.init_step_data()
+            self._step_data['step'] = second
+            self._write_step()
+
+    def _write_step(self):
+        # samples are written as a structured array, see TrajectoryStore.take
+        self._step_data['trajectories'] = self.env.trajectory_store.take(self._step_data['trajectories'])
+        if self.replay_buffer is not None and len(self._step_data['trajectories']) > 0:
+            self.replay_buffer.push_trajectories(self._step_data['trajectories'], self._step_data['day_of_week'])
+        self.sink.write_step(self._step_data)
 
     def collect_metric(self, key: str, value):
         self._step_data['total'][key] = value
 
-    def collect_dispatching(self, request: list, assigned: list):
+    def collect_dispatching(self, request: list, assigned: list, orders=None):
+        """
+        orders : assigned orders, they are looked up by ids of assigned if not given
+        """
         # self._step_data['dispatching']['request'] = request
         # self._step_data['dispatching']['assigned'] = assigned
-        assigned_ids = [i['order_id'] for i in assigned]
-        self._step_data['total']['reward_earned'] = np.sum([i.reward for i in self.env.orders_collection
-                                                            if i.order_id in assigned_ids])
-        self._step_data['total']['assigned_orders'] = len(assigned_ids)
+        orders_collection = self.env.orders_collection
+        if orders is None:
+            orders = [orders_collection.get_order_by_id(i['order_id']) for i in assigned]
+        fleet = orders_collection.fleet
+        self._step_data['total']['reward_earned'] = np.sum(fleet.reward[fleet.slots_of(orders)])
+        self._step_data['total']['assigned_orders'] = len(assigned)
 
     def collect_cancelled(self, cancelled_list: list):
         # self._step_data['dispatching']['cancelled'] = [i.order_id for i in cancelled_list]
@@ -71,8 +121,4 @@ class DataCollector:
         self._step_data['repositioning'] = repositioning_list
 
     def collect_trajectory(self, driver):
-        self._step_data['trajectories'].extend(driver.trajectory)
-        # {'driver_id': driver.driver_id,
-        # 'born': driver.born,
-        # 'died': driver.deadline,
-        # 'trajectory': driver.trajectory})
+        self._step_data['trajectories'].extend(self.env.trajectory_store.collect(driver._trajectory))
@@ -1,11 +1,18 @@
 from pymongo import MongoClient
-from pymongo.errors import DuplicateKeyError
+from pymongo.errors import BulkWriteError, DuplicateKeyError
 import pymongo
 import hashlib
 import pickle
+import numpy as np
 import os
+import queue
+import threading
 from datetime import datetime
 
+import logging
+
+logger = logging.getLogger(__name__)
+
 mongohost = os.environ.get('MONGOHOST', 'localhost')
 config = dict(host=mongohost,
               port=3002,
@@ -18,7 +25,19 @@ class DataManagerException(Exception):
 
 
 class DataManager:
-    def __init__(self):
+    def __init__(self, async_writes=True, batch_size=256, max_pending=1024):
+        """
+        async_writes : simulation steps are written by a background thread in bulk batches of up to batch_size steps,
+                       write_simulation_step blocks when max_pending steps wait for writing. Call flush to wait
+                       until everything is written (reads and truncation flush automatically)
+        """
+        self.simulations_name = None
+        self.async_writes = async_writes
+        self.batch_size = batch_size
+        self._simulations = set()
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._writer = None
+        self._writer_error = None
         try:
             self.client = MongoClient(**config)
             self.simulations_db = self.client.simulations
@@ -36,6 +55,7 @@ class DataManager:
         self.create_simulation(simulation_name)
 
     def truncate_training_collection(self):
+        self.flush()
         self.training_collection.drop()
         self.trajectories_db.create_collection('training')
         self.training_collection = self.trajectories_db['training']
@@ -54,23 +74,75 @@ class DataManager:
         else:
             simulation = self.simulations_db[simulation_name]
             simulation.create_index([('step', pymongo.ASCENDING)], unique=True)
+            self._simulations.add(simulation_name)
             print('{} created successfully'.format(simulation_name))
 
     def write_simulation_step(self, step_data: dict, simulation_name=None):
         if self.simulations_name:
             simulation_name = self.simulations_name
-        if not self.simulation_exists(simulation_name):
-            raise DataManagerException(f"{simulation_name} does not exist. Please, use create_simulation method first")
+        # existence is checked once per simulation instead of every step
+        if simulation_name not in self._simulations:
+            if not self.simulation_exists(simulation_name):
+                raise DataManagerException(f"{simulation_name} does not exist. "
+                                           f"Please, use create_simulation method first")
+            self._simulations.add(simulation_name)
         if 'step' not in step_data.keys():
             raise DataManagerException("Step data should contain 'step' key")
-        trajectories, stats = self._prepare_for_writing(step_data)
-        try:
-            self.simulations_db[simulation_name].insert_one(stats)
-        except DuplicateKeyError:
-            raise DataManagerException(f"Step {step_data['step']} has been already written in {simulation_name}")
-        if len(trajectories) == 0:
-            pass
-        else:
+        if not self.async_writes:
+            self._write_steps([(simulation_name, step_data)])
+            return None
+        self._raise_writer_error()
+        if self._writer is None or not self._writer.is_alive():
+            self._writer = threading.Thread(target=self._write_pending_steps, name='DataManagerWriter', daemon=True)
+            self._writer.start()
+        # blocks while the queue is full, so the simulation can not run away from the database
+        self._queue.put((simulation_name, step_data))
+
+    def flush(self):
+        """
+        Wait until all steps passed to write_simulation_step are written
+        """
+        if self._writer is not None:
+            self._queue.join()
+        self._raise_writer_error()
+
+    def _raise_writer_error(self):
+        if self._writer_error is not None:
+            error, self._writer_error = self._writer_error, None
+            raise DataManagerException(f"Background writing of simulation steps failed - {error}") from error
+
+    def _write_pending_steps(self):
+        while True:
+            batch = [self._queue.get()]
+            # everything that has been queued meanwhile goes to the same bulk insert
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                if self._writer_error is None:
+                    self._write_steps(batch)
+            except Exception as e:
+                logger.error(f"Unsuccessful writing of {len(batch)} simulation steps - {e}")
+                self._writer_error = e
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _write_steps(self, steps: list):
+        stats, trajectories = dict(), list()
+        for simulation_name, step_data in steps:
+            step_trajectories, step_stats = self._prepare_for_writing(step_data)
+            stats.setdefault(simulation_name, []).append(step_stats)
+            trajectories.extend(step_trajectories)
+        for simulation_name, documents in stats.items():
+            try:
+                self.simulations_db[simulation_name].insert_many(documents)
+            except (BulkWriteError, DuplicateKeyError):
+                step_ids = ', '.join(str(document['step']) for document in documents)
+                raise DataManagerException(f"Some of steps {step_ids} have been already written in {simulation_name}")
+        if len(trajectories) > 0:
             self.trajectories_collection.insert_many(trajectories)
             self.training_collection.insert_many(trajectories)
 
@@ -80,6 +152,7 @@ class DataManager:
         self.simulations_db[simulation_name].insert_many(simulation_data)
 
     def read_simulation_step(self, simulation_name, n_step):
+        self.flush()
         if not self.simulation_exists(simulation_name):
             raise DataManagerException("{} simulation does not exist".format(simulation_name))
         result = self.simulations_db[simulation_name].find_one({'step': n_step})
@@ -89,35 +162,37 @@ class DataManager:
             return self._prepare_document(result)
 
     def read_simulation(self, simulation_name):
+        self.flush()
         if not self.simulation_exists(simulation_name):
             raise DataManagerException("{} simulation does not exist".format(simulation_name))
         all_steps = self.simulations_db[simulation_name].find()
         return [self._prepare_document(step) for step in all_steps]
 
     def drop_simulation(self, simulation_name):
+        self.flush()
         if not self.simulation_exists(simulation_name):
             raise DataManagerException("{} simulation does not exist".format(simulation_name))
         self.simulations_db[simulation_name].drop()
+        self._simulations.discard(simulation_name)
 
     def _prepare_for_writing(self, step_data: dict):
         stats = self._prepare_document(dict(step=step_data['step'], total=step_data['total']), read_mode=False)
         if len(step_data['trajectories']) == 0:
             return [], stats
         else:
-            trajectories = [self._prepare_trajectory(i) for i in step_data['trajectories']]
+            trajectories = self._prepare_trajectories(step_data['trajectories'], step_data['day_of_week'])
             return trajectories, stats
 
     @staticmethod
-    def _prepare_trajectory(traj):
-        start, end = traj['status_start'].split('_')[0], traj['status_end'].split('_')[0]
-        if start == end:
-            action = start
-        else:
-            action = 'idle'
-        return dict(trajectory_id=traj['traj_id_start'], day_of_week=traj['day_of_week_start'], t_start=traj['t_start'],
-                    hex_start=traj['hex_start'], lonlat_start=traj['loc_start'], t_end=traj['t_end'],
-                    hex_end=traj['hex_end'], lonlat_end=traj['loc_end'], action=action, reward=traj['reward_end'],
-                    done=traj['done_end'])
+    def _prepare_trajectories(samples, day_of_week: int):
+        """
+        Documents of trajectory samples given as a structured array (see TrajectoryStore.take)
+        """
+        keys = ('trajectory_id', 't_start', 'hex_start', 't_end', 'hex_end', 'action', 'reward', 'done')
+        lonlat_start = np.stack([samples['lon_start'], samples['lat_start']], axis=1).tolist()
+        lonlat_end = np.stack([samples['lon_end'], samples['lat_end']], axis=1).tolist()
+        return [dict(zip(keys, values), day_of_week=day_of_week, lonlat_start=start, lonlat_end=end)
+                for values, start, end in zip(zip(*[samples[key].tolist() for key in keys]), lonlat_start, lonlat_end)]
 
     @staticmethod
     def _prepare_document(document, read_mode=True):
@@ -0,0 +1,214 @@
+"""
+Sinks of DataCollector: where simulation steps go.
+
+    MemorySink   - list of step dicts in memory (default without a database)
+    MongoSink    - DataManager, steps are written to MongoDB
+    ColumnarSink - per-step totals and trajectory rows streamed to Parquet files (pyarrow) or .npz chunks
+
+Every sink is opened with the simulation name, gets step dicts through write_step and is closed at the end
+of the simulation. read_simulation of a sink reads the simulation back.
+"""
+import glob
+import os
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa, pq = None, None
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+TRAJECTORY_COLUMNS = dict(step=np.int64, trajectory_id=str, day_of_week=np.int64,
+                          t_start=np.int64, hex_start=str, lon_start=np.float64, lat_start=np.float64,
+                          t_end=np.int64, hex_end=str, lon_end=np.float64, lat_end=np.float64,
+                          action=str, reward=np.float64, done=np.int64)
+
+
+class SinkException(Exception):
+    pass
+
+
+class BaseSink:
+
+    def open(self, simulation_name):
+        pass
+
+    def write_step(self, step_data: dict):
+        pass
+
+    def truncate(self, n_steps: int):
+        """
+        Drop steps written after the first n_steps if the sink supports it
+        """
+        pass
+
+    def close(self):
+        pass
+
+    def read_simulation(self, simulation_name):
+        pass
+
+    @property
+    def data(self):
+        return []
+
+
+class MemorySink(BaseSink):
+    """
+    Keeps step dicts in memory, a local stand-in for MongoSink: read_simulation returns steps
+    in the same format as DataManager.read_simulation
+    """
+
+    def __init__(self):
+        self.simulations = {None: []}
+        self.simulation_name = None
+
+    def open(self, simulation_name):
+        self.simulation_name = simulation_name
+        self.simulations[simulation_name] = []
+
+    def write_step(self, step_data: dict):
+        self.data.append(step_data)
+
+    def truncate(self, n_steps: int):
+        del self.data[n_steps:]
+
+    def read_simulation(self, simulation_name):
+        if simulation_name not in self.simulations:
+            raise SinkException(f"{simulation_name} simulation does not exist")
+        return [dict(step=step['step'], total=step['total']) for step in self.simulations[simulation_name]]
+
+    @property
+    def data(self):
+        return self.simulations[self.simulation_name]
+
+
+class MongoSink(BaseSink):
+
+    def __init__(self, db_client):
+        self.db_client = db_client
+
+    def open(self, simulation_name):
+        self.db_client(simulation_name)
+
+    def write_step(self, step_data: dict):
+        self.db_client.write_simulation_step(step_data)
+
+    def close(self):
+        self.db_client.flush()
+
+    def read_simulation(self, simulation_name):
+        return self.db_client.read_simulation(simulation_name)
+
+
+class ColumnarSink(BaseSink):
+    """
+    Streams per-step totals and trajectory rows to <directory>/<simulation_name>/{total,trajectories}.parquet,
+    a row group is written each row_group_size steps. Without pyarrow (or with file_format='npz')
+    every row group is saved as a numbered .npz chunk instead.
+    Totals are float64 columns next to step and day_of_week, trajectory columns are TRAJECTORY_COLUMNS
+    """
+
+    def __init__(self, directory, row_group_size=3600, file_format=None):
+        if file_format is None:
+            file_format = 'parquet' if pa is not None else 'npz'
+        if file_format not in ('parquet', 'npz'):
+            raise SinkException(f"file_format must be parquet or npz, got {file_format}")
+        if file_format == 'parquet' and pa is None:
+            raise SinkException("pyarrow is required to write parquet files, install it or use file_format='npz'")
+        self.directory = directory
+        self.row_group_size = row_group_size
+        self.file_format = file_format
+        self.path = None
+        self._total, self._trajectories = [], []
+        self._n_steps, self._n_groups = 0, 0
+        self._writers = {}
+
+    def open(self, simulation_name):
+        self.close()
+        self.path = os.path.join(self.directory, str(simulation_name))
+        if os.path.exists(self.path) and os.listdir(self.path):
+            raise SinkException(f"{self.path} already exists")
+        os.makedirs(self.path, exist_ok=True)
+        self._total, self._trajectories = [], []
+        self._n_steps, self._n_groups = 0, 0
+
+    def write_step(self, step_data: dict):
+        if self.path is None:
+            self.open('simulation')
+        self._total.append(dict(step=step_data['step'], day_of_week=step_data['day_of_week'], **step_data['total']))
+        if len(step_data['trajectories']) > 0:
+            self._trajectories.append((step_data['step'], step_data['day_of_week'], step_data['trajectories']))
+        self._n_steps += 1
+        if self._n_steps % self.row_group_size == 0:
+            self._write_row_group()
+
+    def close(self):
+        if self.path is None:
+            return None
+        if self._total or self._n_groups == 0:
+            self._write_row_group()
+        for writer in self._writers.values():
+            writer.close()
+        self._writers = {}
+        self.path = None
+
+    def read_simulation(self, simulation_name, table='total', columns=None):
+        return read_simulation(self.directory, simulation_name, table=table, columns=columns)
+
+    def _trajectories_frame(self):
+        # samples of steps are structured arrays (see TrajectoryStore.take), they are concatenated column-wise
+        if not self._trajectories:
+            return pd.DataFrame({column: pd.Series(dtype=dtype) for column, dtype in TRAJECTORY_COLUMNS.items()})
+        steps, days, samples = zip(*self._trajectories)
+        lengths = [len(step_samples) for step_samples in samples]
+        samples = np.concatenate(samples)
+        columns = dict(step=np.repeat(steps, lengths), day_of_week=np.repeat(days, lengths))
+        columns.update({column: samples[column] for column in TRAJECTORY_COLUMNS if column not in columns})
+        # row groups must share the column order of the writer schema
+        return pd.DataFrame(columns)[list(TRAJECTORY_COLUMNS)].astype(TRAJECTORY_COLUMNS)
+
+    def _write_row_group(self):
+        total = pd.DataFrame(self._total)
+        total = total.astype({column: np.float64 for column in total.columns if column not in ('step', 'day_of_week')})
+        trajectories = self._trajectories_frame()
+        for table, df in (('total', total), ('trajectories', trajectories)):
+            if self.file_format == 'parquet':
+                arrow_table = pa.Table.from_pandas(df, preserve_index=False)
+                if table not in self._writers:
+                    self._writers[table] = pq.ParquetWriter(os.path.join(self.path, f'{table}.parquet'),
+                                                            arrow_table.schema)
+                self._writers[table].write_table(arrow_table.cast(self._writers[table].schema))
+            else:
+                np.savez(os.path.join(self.path, f'{table}_{self._n_groups:05d}.npz'),
+                         **{column: df[column].to_numpy(dtype=TRAJECTORY_COLUMNS.get(column, df[column].dtype))
+                            for column in df.columns})
+        self._total, self._trajectories = [], []
+        self._n_groups += 1
+
+
+def read_simulation(directory, simulation_name, table='total', columns=None):
+    """
+    DataFrame of per-step totals (table='total') or trajectory rows (table='trajectories')
+    written by ColumnarSink, only the given columns are read
+    """
+    path = os.path.join(directory, str(simulation_name))
+    if os.path.exists(os.path.join(path, f'{table}.parquet')):
+        if pq is None:
+            raise SinkException("pyarrow is required to read parquet files")
+        return pq.read_table(os.path.join(path, f'{table}.parquet'), columns=columns).to_pandas()
+    chunks = sorted(glob.glob(os.path.join(path, f'{table}_*.npz')))
+    if not chunks:
+        raise SinkException(f"{simulation_name} simulation does not exist in {directory}")
+    data = dict()
+    for chunk in chunks:
+        with np.load(chunk) as npz:
+            for column in columns or npz.files:
+                data.setdefault(column, []).append(npz[column])
+    return pd.DataFrame({column: np.concatenate(values) for column, values in data.items()})
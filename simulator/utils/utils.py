@@ -1,60 +1,126 @@
+import numpy as np
 from ..models import RewardModel
-from geopy.distance import great_circle
 import logging
 
 logger = logging.getLogger(__name__)
 
 RMODEL = RewardModel()
 
-
-def _create_order_driver_pair(env, o, d):
-    pair = dict(order_id=o.order_id, driver_id=d.driver_id, order_start_location=o.order_start_location,
-                order_finish_location=o.order_finish_location, driver_location=d.driver_location,
-                timestamp=env.timestamp, day_of_week=env.day_of_week)
-    pair['order_driver_distance'] = get_distance(d.driver_location, o.order_start_location) * 1000
-    pair['pick_up_eta'] = pair['order_driver_distance'] / env.PICKUP_SPEED_M_PER_S
-    pair['distance'] = env.map.calculate_distance(o.start_hex, o.finish_hex)
-    order_duration = pair['distance'] * 1000 / env.PICKUP_SPEED_M_PER_S
-    pair['order_finish_timestamp'] = env.timestamp + int(pair['pick_up_eta']) + int(order_duration)
-    return pair
-
-
-def _pairs_for_order(o, env, drivers):
-    close_hexes = env.map.d_neighbors[o.start_hex]
-    return [_create_order_driver_pair(env, o, d) for d in drivers if d.driver_hex in close_hexes]
+# the same earth radius as in geopy.distance.great_circle
+EARTH_RADIUS_KM = 6371.009
+
+
+def _candidate_pairs(env, orders):
+    """
+    Order-driver candidates found through the hex index of dispatching drivers:
+    each order visits only the drivers located in the neighbourhood of its start hex.
+    Returns columns with order position in orders and driver object of every pair
+    """
+    hex_view = env.drivers_collection.hex_view
+    order_col, driver_col = list(), list()
+    for i, o in enumerate(orders):
+        for h in env.map.d_neighbors[o.start_hex]:
+            bucket = hex_view.get(h)
+            if bucket:
+                driver_col.extend(bucket.values())
+                order_col.extend([i] * len(bucket))
+    return np.array(order_col, dtype=int), driver_col
+
+
+def _pair_columns(env, orders, order_col, driver_col):
+    """
+    Distances, pick up ETA and order finish timestamps of all candidate pairs of a dispatching round.
+    Pairs farther than MAX_PICKUP_DISTANCE are dropped before anything is computed per pair
+    """
+    # locations are gathered from the fleet arrays of drivers and orders
+    drivers_fleet, orders_fleet = env.drivers_collection.fleet, env.orders_collection.fleet
+    order_slots = orders_fleet.slots_of(orders)
+    driver_location = drivers_fleet.location[drivers_fleet.slots_of(driver_col)]
+    order_start_location = orders_fleet.start_location[order_slots]
+    order_driver_distance = get_distance(driver_location, order_start_location[order_col]) * 1000
+
+    close = order_driver_distance < env.MAX_PICKUP_DISTANCE
+    order_col, order_driver_distance = order_col[close], order_driver_distance[close]
+    driver_col = [d for d, c in zip(driver_col, close) if c]
+    driver_location = driver_location[close]
+    order_finish_location = orders_fleet.finish_location[order_slots]
+
+    # route distance depends only on the order
+    with_pairs = np.unique(order_col)
+    order_distance = np.zeros(len(orders))
+    order_distance[with_pairs] = env.map.calculate_distances(orders_fleet.start_hex[order_slots[with_pairs]],
+                                                             orders_fleet.finish_hex[order_slots[with_pairs]])
+    distance = order_distance[order_col]
+
+    pick_up_eta = order_driver_distance / env.PICKUP_SPEED_M_PER_S
+    order_duration = distance * 1000 / env.PICKUP_SPEED_M_PER_S
+    order_finish_timestamp = env.timestamp + pick_up_eta.astype(int) + order_duration.astype(int)
+    return dict(order=order_col, driver=driver_col, order_driver_distance=order_driver_distance,
+                pick_up_eta=pick_up_eta, distance=distance, order_finish_timestamp=order_finish_timestamp,
+                driver_location=driver_location, order_start_location=order_start_location[order_col],
+                order_finish_location=order_finish_location[order_col])
 
 
 def get_distance(start, finish):
-    latlon_start = (start[1], start[0])
-    latlon_finish = (finish[1], finish[0])
-    return great_circle(latlon_start, latlon_finish).km
-
-
-def prepare_dispatching_request(env, drivers, orders):
+    """
+    Great-circle distance in km between [lon, lat] points, vectorized over arrays of shape (..., 2).
+    Same formula as geopy.distance.great_circle
+    """
+    start, finish = np.radians(np.asarray(start, dtype=float)), np.radians(np.asarray(finish, dtype=float))
+    lon_1, lat_1, lon_2, lat_2 = start[..., 0], start[..., 1], finish[..., 0], finish[..., 1]
+    sin_lat_1, cos_lat_1 = np.sin(lat_1), np.cos(lat_1)
+    sin_lat_2, cos_lat_2 = np.sin(lat_2), np.cos(lat_2)
+    delta_lon = lon_2 - lon_1
+    cos_delta_lon, sin_delta_lon = np.cos(delta_lon), np.sin(delta_lon)
+    d = np.arctan2(np.sqrt((cos_lat_2 * sin_delta_lon) ** 2 +
+                           (cos_lat_1 * sin_lat_2 - sin_lat_1 * cos_lat_2 * cos_delta_lon) ** 2),
+                   sin_lat_1 * sin_lat_2 + cos_lat_1 * cos_lat_2 * cos_delta_lon)
+    return EARTH_RADIUS_KM * d
+
+
+def prepare_dispatching_request(env, orders):
     logger.debug("Prepare dispatching request")
-    pairs = list()
     logger.debug("Prepare all pairs")
-    for order in orders:
-        order_pairs = _pairs_for_order(order, env, drivers)
-        pairs += [o for o in order_pairs if o['order_driver_distance'] < env.MAX_PICKUP_DISTANCE]
+    order_col, driver_col = _candidate_pairs(env, orders)
+    columns = _pair_columns(env, orders, order_col, driver_col)
+    timestamp = env.timestamp
+    pairs = [dict(order_id=orders[i].order_id, driver_id=d.driver_id,
+                  order_start_location=start_location, order_finish_location=finish_location,
+                  driver_location=driver_location, timestamp=timestamp, day_of_week=env.day_of_week,
+                  order_driver_distance=dist, pick_up_eta=eta, distance=order_dist, order_finish_timestamp=finish)
+             for i, d, start_location, finish_location, driver_location, dist, eta, order_dist, finish in zip(
+                 columns['order'].tolist(), columns['driver'], columns['order_start_location'].tolist(),
+                 columns['order_finish_location'].tolist(), columns['driver_location'].tolist(),
+                 columns['order_driver_distance'].tolist(), columns['pick_up_eta'].tolist(),
+                 columns['distance'].tolist(), columns['order_finish_timestamp'].tolist())]
     logger.debug("Prepare reward")
     if len(pairs) == 0:
         return pairs
     else:
-        pairs_rewards = list(RMODEL.predict_batch(pairs))
+        pairs_rewards = RMODEL.predict_arrays(distance=columns['distance'],
+                                              timestamp=np.full(len(pairs), timestamp),
+                                              order_finish_timestamp=columns['order_finish_timestamp'],
+                                              pick_up_eta=columns['pick_up_eta']).tolist()
         return [dict(reward_units=rew, **request) for rew, request in zip(pairs_rewards, pairs)]
 
 
 def handle_dispatching_response(env, agent_request, agent_response):
+    """
+    Assign orders of the agent response, returns the assigned orders
+    """
     logger.debug("Handle dispatching response")
+    # row of every candidate pair in the request
+    rows = {(pair['driver_id'], pair['order_id']): k for k, pair in enumerate(agent_request)}
+    assigned = list()
     for r in agent_response:
-        order_info = [i for i in agent_request if i['driver_id'] == r['driver_id']
-                      and i['order_id'] == r['order_id']][0]
+        order_info = agent_request[rows[r['driver_id'], r['order_id']]]
         order = env.orders_collection.get_order_by_id(r["order_id"])
         driver = env.drivers_collection.get_by_driver_id(r["driver_id"])
         driver.take_order(order, reward=order_info['reward_units'], pick_up_eta=order_info['pick_up_eta'],
                           order_finish_timestamp=order_info['order_finish_timestamp'],
                           order_driver_distance=order_info['order_driver_distance'])
+        assigned.append(order)
+    return assigned
 
 
 class TimeFilter(logging.Filter):
@@ -0,0 +1,189 @@
+"""
+N independent environments advanced in lockstep by one agent.
+
+Every environment runs its Environment.run loop, decisions of all environments are grouped by
+(second, decision): dispatching requests of the group are concatenated into one agent.dispatch call,
+reposition requests are answered one by one and agent.train is called once per group.
+Order and driver ids of the batched request are remapped to id * N + k (k - index of the environment),
+so the agent sees unique ids and responses are split back by id % N.
+
+Environments live in the current process (processes=False) or one per worker process (processes=True).
+In-process environments share the global random state and id counters of the process,
+worker processes give every environment its own ones (runs are reproducible by seed).
+"""
+import multiprocessing as mp
+
+from .assets import get_assets
+from .environment import Environment
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# order of decisions inside one simulation second
+DECISIONS = {'reposition': 0, 'dispatch': 1, 'train': 2}
+
+
+class VectorEnvironmentException(Exception):
+    pass
+
+
+def _make_environment(day_of_week, random_seed, event_driven):
+    env = Environment(day_of_week=day_of_week, agent=None, db_client=None, random_seed=random_seed,
+                      event_driven=event_driven)
+    env.generate_orders()
+    env.generate_drivers()
+    return env
+
+
+class _LocalSlot:
+
+    def __init__(self, env, start_second, end_second, training_each):
+        self.env = env
+        self.loop = env.run(start_second, end_second, training_each=training_each)
+        self._response = None
+
+    def submit(self, response):
+        self._response = response
+
+    def receive(self):
+        try:
+            decision, request = self.loop.send(self._response)
+        except StopIteration:
+            return self.env.t, 'done', self.env.datacollector.data
+        return self.env.t, decision, request
+
+    def close(self):
+        self.loop.close()
+
+
+def _worker(conn, day_of_week, random_seed, event_driven, start_second, end_second, training_each):
+    slot = _LocalSlot(_make_environment(day_of_week, random_seed, event_driven),
+                      start_second, end_second, training_each)
+    while True:
+        response = conn.recv()
+        slot.submit(response)
+        message = slot.receive()
+        conn.send(message)
+        if message[1] == 'done':
+            break
+    conn.close()
+
+
+class _ProcessSlot:
+
+    def __init__(self, context, *args):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_worker, args=(child_conn,) + args, daemon=True)
+        self.process.start()
+        child_conn.close()
+
+    def submit(self, response):
+        self.conn.send(response)
+
+    def receive(self):
+        return self.conn.recv()
+
+    def close(self):
+        self.conn.close()
+        self.process.join(timeout=1)
+        if self.process.is_alive():
+            self.process.terminate()
+
+
+class VectorEnvironment:
+    def __init__(self, agent, days_of_week: list, random_seeds=None, start_hour: int = 0, end_hour: int = 24,
+                 event_driven=True, processes=False):
+        """
+        days_of_week : day of week of every environment, N = len(days_of_week)
+        random_seeds : random seed of every environment
+        processes : run every environment in its own worker process
+        """
+        assert 0 <= start_hour < end_hour <= 24
+        self.agent = agent
+        self.days_of_week = list(days_of_week)
+        self.random_seeds = list(random_seeds) if random_seeds is not None else [None] * len(self.days_of_week)
+        if len(self.random_seeds) != len(self.days_of_week):
+            raise VectorEnvironmentException("There should be one random seed per environment")
+        self.start_second = start_hour * 3600 + 1
+        self.end_second = end_hour * 3600
+        self.event_driven = event_driven
+        self.processes = processes
+
+        self.envs = list()
+        self.losses = list()
+
+    def __len__(self):
+        return len(self.days_of_week)
+
+    def run(self, training_each=60):
+        """
+        Simulate all environments till the end, returns DataCollector.data of every environment
+        """
+        slots = self._make_slots(training_each)
+        results = [None] * len(slots)
+        try:
+            decisions = dict()
+            for k, slot in enumerate(slots):
+                slot.submit(None)
+            for k, slot in enumerate(slots):
+                self._receive(k, slot, decisions, results)
+
+            while decisions:
+                # the earliest decision of all environments and all environments waiting for the same one
+                t, order = min((t, DECISIONS[decision]) for t, decision, _ in decisions.values())
+                group = [k for k, (t_k, decision, _) in decisions.items() if t_k == t and DECISIONS[decision] == order]
+                responses = self._decide(decisions[group[0]][1], group, [decisions[k][2] for k in group])
+                for k in group:
+                    slots[k].submit(responses[k])
+                for k in group:
+                    self._receive(k, slots[k], decisions, results)
+        finally:
+            for slot in slots:
+                slot.close()
+        return results
+
+    def _make_slots(self, training_each):
+        if self.processes:
+            # workers inherit the memory-mapped bundle when forked
+            get_assets()
+            context = mp.get_context()
+            return [_ProcessSlot(context, day_of_week, random_seed, self.event_driven,
+                                 self.start_second, self.end_second, training_each)
+                    for day_of_week, random_seed in zip(self.days_of_week, self.random_seeds)]
+        self.envs = [_make_environment(day_of_week, random_seed, self.event_driven)
+                     for day_of_week, random_seed in zip(self.days_of_week, self.random_seeds)]
+        return [_LocalSlot(env, self.start_second, self.end_second, training_each) for env in self.envs]
+
+    @staticmethod
+    def _receive(k, slot, decisions, results):
+        t, decision, payload = slot.receive()
+        if decision == 'done':
+            decisions.pop(k, None)
+            results[k] = payload
+        else:
+            decisions[k] = (t, decision, payload)
+
+    def _decide(self, decision, group: list, requests: list):
+        if decision == 'dispatch':
+            return self._dispatch(group, requests)
+        if decision == 'reposition':
+            return {k: self.agent.reposition(request) for k, request in zip(group, requests)}
+        loss = self.agent.train()
+        if loss:
+            self.losses.append(loss)
+        return {k: None for k in group}
+
+    def _dispatch(self, group: list, requests: list):
+        n = len(self)
+        batch = [dict(pair, order_id=pair['order_id'] * n + k, driver_id=pair['driver_id'] * n + k)
+                 for k, request in zip(group, requests) for pair in request]
+        logger.debug(f"Dispatch {len(batch)} pairs of {len(group)} environments")
+        responses = {k: list() for k in group}
+        for pair in self.agent.dispatch(dispatch_observ=batch):
+            k = pair['order_id'] % n
+            if pair['driver_id'] % n != k or k not in responses:
+                raise VectorEnvironmentException(f"Agent has assigned order {pair['order_id']} "
+                                                 f"to driver {pair['driver_id']} of another environment")
+            responses[k].append(dict(pair, order_id=pair['order_id'] // n, driver_id=pair['driver_id'] // n))
+        return responses
@@ -0,0 +1,106 @@
+import sqlite3
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+pytest.importorskip('torch')
+pytest.importorskip('sqlalchemy')
+from sqlalchemy import text
+
+from rl.buffers import PostgreSQLReplayBuffer, ReplayBufferException
+
+N_ROWS = 2000
+QUERY = "select ride_start_time, pickup_hour, pickup_weekday, pickup_lon, pickup_lat, reward, ride_stop_time, " \
+        "dropoff_hour, dropoff_weekday, dropoff_lon, dropoff_lat from rides"
+
+
+@pytest.fixture
+def con_str(tmp_path):
+    path = tmp_path / 'rides.sqlite'
+    con = sqlite3.connect(str(path))
+    con.execute('create table rides (ride_start_time timestamp, pickup_hour int, pickup_weekday int, pickup_lon real, '
+                'pickup_lat real, reward real, ride_stop_time timestamp, dropoff_hour int, dropoff_weekday int, '
+                'dropoff_lon real, dropoff_lat real)')
+    start = datetime(2016, 11, 1)
+    # the reward is the rowid and the ride takes rowid seconds
+    rows = [(start.isoformat(' '), 8, 2, 104.05, 30.65, float(i), (start + timedelta(seconds=i)).isoformat(' '),
+             9, 2, 104.06, 30.66) for i in range(1, N_ROWS + 1)]
+    con.executemany('insert into rides values (?,?,?,?,?,?,?,?,?,?,?)', rows)
+    con.commit()
+    con.close()
+    return f'sqlite:///{path}'
+
+
+def _buffer(con_str, **kwargs):
+    params = dict(query=QUERY, sampling='keyset', key='rowid', pool_size=500, block_size=100, random_seed=1)
+    params.update(kwargs)
+    return PostgreSQLReplayBuffer(con_str=con_str, **params)
+
+
+def test_keyset_sample(con_str):
+    buffer = _buffer(con_str)
+    try:
+        state, reward, next_state, info, done = buffer.sample(64)
+    finally:
+        buffer.close()
+    assert state.shape == next_state.shape == (64, 6)
+    assert reward.shape == info.shape == done.shape == (64,)
+    assert np.isin(reward, np.arange(1, N_ROWS + 1)).all()
+    np.testing.assert_array_equal(info, reward)
+    assert buffer._fetcher is None
+
+
+def test_keyset_block_has_several_runs(con_str):
+    buffer = _buffer(con_str, keyset_runs=10)
+    with buffer.con.connect() as connection:
+        block_query = buffer._block_query(connection)
+        rewards = np.sort([row[5] for row in connection.execute(text(block_query())).fetchall()])
+    assert len(rewards) == 100
+    # rows are contiguous within a run, not across the whole block
+    assert np.count_nonzero(np.diff(rewards) > 1) >= 5
+
+
+def test_tablesample_without_row_estimate_orders_by_random(con_str):
+    class Result:
+        @staticmethod
+        def scalar():
+            # reltuples of a table which has never been analyzed
+            return -1.
+
+    class Connection:
+        @staticmethod
+        def execute(query):
+            return Result()
+
+    buffer = _buffer(con_str, sampling='tablesample')
+    query = buffer._block_query(Connection())()
+    assert 'tablesample' not in query
+    assert query.endswith('order by random() limit 100')
+
+
+def test_fetcher_error_is_raised_once(con_str):
+    buffer = _buffer(con_str)
+    buffer.sample(64)
+    prepare_samples = buffer._prepare_samples
+
+    def failing(rows):
+        raise RuntimeError('boom')
+
+    buffer._prepare_samples = failing
+    while buffer._fetcher.is_alive():
+        time.sleep(0.01)
+    buffer._prepare_samples = prepare_samples
+    try:
+        with pytest.raises(ReplayBufferException, match='boom'):
+            buffer.sample(64)
+        # the next call restarts the fetcher
+        assert buffer.sample(64)[0].shape == (64, 6)
+    finally:
+        buffer.close()
+
+
+def test_missing_key(con_str):
+    with pytest.raises(ReplayBufferException):
+        _buffer(con_str, key=None)
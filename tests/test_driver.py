@@ -0,0 +1,84 @@
+import pytest
+
+from simulator.environment import Environment
+
+
+@pytest.fixture
+def env():
+    env = Environment(day_of_week=2, agent=None, db_client=None, random_seed=7)
+    env.update_current_time(8 * 3600)
+    return env
+
+
+def hexes(env, n):
+    return env.map.hex_ids[:n].tolist()
+
+
+def test_slots_are_reused_after_drivers_go_offline(env):
+    collection = env.drivers_collection
+    start_hex, = hexes(env, 1)
+    short, long = collection.add_drivers([(start_hex, 10), (start_hex, 100)])
+    released = short.slot
+
+    env.update_current_time(env.t + 10)
+    assert collection.delete_drivers() == 1
+    assert short.slot is None
+    assert len(collection.fleet) == 1
+
+    # a driver coming online takes the released slot
+    new, = collection.add_drivers([(start_hex, 100)])
+    assert new.slot == released
+    assert collection.fleet.driver_id[released] == new.driver_id
+    assert collection.fleet.online[released]
+    assert list(collection.dict_view) == [long.driver_id, new.driver_id]
+    assert list(collection.status_view['idle']) == [long.driver_id, new.driver_id]
+    assert list(collection.hex_view[start_hex]) == [long.driver_id, new.driver_id]
+    assert new.driver_hex == start_hex and new.status == 'idle'
+
+
+def test_slot_of_offline_driver_is_released_after_its_route(env):
+    collection = env.drivers_collection
+    start_hex, destination = hexes(env, 2)
+    driver, = collection.add_drivers([(start_hex, 1)])
+    collection.idle_movement([{'driver_id': driver.driver_id, 'idle_hex': destination}])
+    route = sorted(driver.route)
+    assert len(route) > 1
+
+    env.update_current_time(route[0])
+    collection.move_drivers()
+    env.update_current_time(route[0] + 1)
+    assert collection.delete_drivers() == 1
+    assert driver.driver_id not in collection.dict_view
+    # the driver is offline but its moves still use the slot
+    slot = driver.slot
+    assert slot is not None and not collection.fleet.online[slot]
+    for t in route[1:]:
+        env.update_current_time(t)
+        collection.move_drivers()
+    assert driver.slot is None
+    assert collection.fleet.views[slot] is None
+    assert len(collection.fleet) == 0
+
+
+def test_assigned_driver_stays_online_past_its_deadline(env):
+    collection = env.drivers_collection
+    start_hex, finish_hex = hexes(env, 2)
+    assigned, idle = collection.add_drivers([(start_hex, 10), (start_hex, 20)])
+    env.orders_collection.add_orders([(start_hex, finish_hex)])
+    order, = env.orders_collection.get_orders('unassigned')
+    assigned.take_order(order, reward=1., pick_up_eta=0., order_finish_timestamp=env.start_timestamp + env.t + 600,
+                        order_driver_distance=0.)
+
+    env.update_current_time(env.t + 20)
+    assert collection.delete_drivers() == 1
+    assert idle.driver_id not in collection.dict_view
+    # the deadline has been popped from the heap, the driver waits for the end of its order
+    assert list(collection._overdue) == [assigned.driver_id]
+    assert collection._deadlines == []
+    assert collection.delete_drivers() == 0
+
+    env.orders_collection.cancel_many([order])
+    assert assigned.status == 'idle'
+    assert collection.delete_drivers() == 1
+    assert collection._overdue == {}
+    assert len(collection) == 0
@@ -0,0 +1,72 @@
+import itertools
+
+import pytest
+
+from simulator.agent import Agent
+from simulator.driver import Driver
+from simulator.environment import Environment
+from simulator.order import Order
+
+START_SECOND, END_SECOND = 8 * 3600 + 1, 8 * 3600 + 600
+
+
+def make_environment(event_driven, random_seed=7, thin=10):
+    # ids are drawn from class counters, every environment of the test starts them afresh
+    Driver.newid, Order.newid = itertools.count(), itertools.count()
+    env = Environment(day_of_week=2, agent=Agent(), db_client=None, random_seed=random_seed,
+                      event_driven=event_driven)
+    env.generate_orders()
+    env.generate_drivers()
+    # every thin-th order and driver keeps the test short
+    env.d_orders = {t: orders[::thin] for t, orders in env.d_orders.items()}
+    env.d_drivers = {t: drivers[::thin] for t, drivers in env.d_drivers.items()}
+    return env
+
+
+def simulate(env, start_second=START_SECOND, end_second=END_SECOND):
+    loop = env.run(start_second, end_second)
+    response = None
+    while True:
+        try:
+            decision, request = loop.send(response)
+        except StopIteration:
+            return env.datacollector.data
+        if decision == 'reposition':
+            response = env.agent.reposition(request)
+        else:
+            response = env.agent.dispatch(request)
+
+
+def test_event_driven_steps_match_every_second():
+    every_second = simulate(make_environment(event_driven=False))
+    event_driven = simulate(make_environment(event_driven=True))
+    assert [step['step'] for step in event_driven] == [step['step'] for step in every_second]
+    assert [step['step'] for step in every_second[1:]] == list(range(START_SECOND, END_SECOND + 1))
+    for expected, step in zip(every_second, event_driven):
+        assert step['total'] == pytest.approx(expected['total']), step['step']
+    assert sum(step['total']['assigned_orders'] for step in every_second) > 0
+
+
+@pytest.mark.parametrize('event_driven', [False, True])
+def test_restore_repeats_steps_after_snapshot(event_driven):
+    agent = Agent()
+
+    def act(observation):
+        decision, request = observation
+        return agent.reposition(request) if decision == 'reposition' else agent.dispatch(request)
+
+    def play(observation, n_decisions=40):
+        outcome = list()
+        for _ in range(n_decisions):
+            observation, reward, done, info = env.step(act(observation))
+            outcome.append((info['t'], reward, observation[0]))
+        return outcome, [dict(step['total'], step=step['step']) for step in env.datacollector.data]
+
+    env = Environment(day_of_week=2, agent=None, db_client=None, event_driven=event_driven)
+    observation = env.reset(2, random_seed=7, start_hour=8, end_hour=9)
+    for _ in range(20):
+        observation, _, _, _ = env.step(act(observation))
+    snapshot = env.snapshot()
+    expected = play(observation)
+    assert play(env.restore(snapshot)) == expected
+    assert sum(step['assigned_orders'] for step in expected[1]) > 0
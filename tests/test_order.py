@@ -0,0 +1,41 @@
+import pytest
+
+from simulator.environment import Environment
+from simulator.order import OrdersCollectionException
+
+
+@pytest.fixture
+def env():
+    env = Environment(day_of_week=2, agent=None, db_client=None, random_seed=7)
+    env.update_current_time(8 * 3600)
+    return env
+
+
+def test_orders_are_indexed_by_id_and_status(env):
+    orders_collection = env.orders_collection
+    start_hex, finish_hex = env.map.hex_ids[:2].tolist()
+    orders_collection.add_orders([(start_hex, finish_hex)] * 3)
+    first, second, third = orders_collection.get_orders('unassigned')
+    assert orders_collection.get_order_by_id(second.order_id) is second
+    assert first.order_id < second.order_id < third.order_id
+
+    driver, = env.drivers_collection.add_drivers([(start_hex, 1000)])
+    driver.take_order(second, reward=1., pick_up_eta=0., order_finish_timestamp=env.start_timestamp + env.t + 600,
+                      order_driver_distance=0.)
+    assert orders_collection.status_view == {'assigned': {second.order_id},
+                                             'unassigned': {first.order_id, third.order_id}}
+
+    orders_collection.delete_unassigned_orders()
+    assert list(orders_collection.dict_view) == [second.order_id]
+    assert first.slot is None and third.slot is None
+    with pytest.raises(OrdersCollectionException):
+        orders_collection.get_order_by_id(first.order_id)
+
+    orders_collection.cancel_many([second])
+    assert len(orders_collection) == 0
+    assert orders_collection.status_view == {'assigned': set(), 'unassigned': set()}
+    assert driver.status == 'idle' and driver.order is None
+    # slots of removed orders are reused
+    orders_collection.add_orders([(start_hex, finish_hex)])
+    assert len(orders_collection.fleet) == 1
+    assert orders_collection.fleet.n_slots == 3
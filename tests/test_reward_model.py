@@ -0,0 +1,61 @@
+import pickle
+
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.linear_model import Ridge
+
+import reward_model.model
+from reward_model import RewardModel
+from reward_model.utils import convert_to_datetime, get_distance
+
+FEATURES = ['distance', 'duration'] + [f'p_w_{i}' for i in range(1, 8)] + [f'p_h_{i}' for i in range(24)] + \
+           [f'd_w_{i}' for i in range(1, 8)] + [f'd_h_{i}' for i in range(24)]
+
+
+@pytest.fixture
+def model(tmp_path, monkeypatch):
+    rng = np.random.RandomState(0)
+    ridge = Ridge().fit(rng.rand(50, len(FEATURES)), rng.rand(50, 1))
+    (tmp_path / 'src').mkdir()
+    with open(tmp_path / 'src' / 'model.pickle', 'wb') as f:
+        pickle.dump(ridge, f)
+    with open(tmp_path / 'src' / 'features.pickle', 'wb') as f:
+        pickle.dump(FEATURES, f)
+    monkeypatch.setattr(reward_model.model, 'cur_dir', str(tmp_path))
+    return RewardModel(cache_size=16)
+
+
+def requests(n):
+    rng = np.random.RandomState(1)
+    timestamps = 1477958400 + rng.randint(0, 7 * 24 * 60 * 60, n)
+    return [dict(order_driver_distance=float(rng.rand() * 2000),
+                 order_start_location=[104 + rng.rand() / 5, 30.6 + rng.rand() / 5],
+                 order_finish_location=[104 + rng.rand() / 5, 30.6 + rng.rand() / 5],
+                 driver_location=[104 + rng.rand() / 5, 30.6 + rng.rand() / 5],
+                 timestamp=int(t), order_finish_timestamp=int(t + rng.randint(300, 7200)),
+                 day_of_week=int(convert_to_datetime(t).weekday()), pick_up_eta=float(rng.rand() * 300))
+            for t in timestamps]
+
+
+def features_of(request):
+    # features of one request as RewardModel._prepare_request builds them
+    start, finish = convert_to_datetime(request['timestamp']), convert_to_datetime(request['order_finish_timestamp'])
+    values = dict(distance=get_distance(request['order_start_location'], request['order_finish_location']),
+                  duration=((finish - start).total_seconds() - request['pick_up_eta']) / 60)
+    values.update({f"p_w_{request['day_of_week'] + 1}": 1, f'p_h_{start.hour}': 1,
+                   f'd_w_{finish.isoweekday()}': 1, f'd_h_{finish.hour}': 1})
+    return [values.get(name, 0) for name in FEATURES]
+
+
+def test_predict_batch_matches_predict(model):
+    batch = requests(40)
+    expected = model.model.predict(np.array([features_of(request) for request in batch])).reshape(len(batch), -1)[:, 0]
+    np.testing.assert_allclose(model.predict_batch(batch), expected, rtol=1e-9, atol=1e-9)
+    np.testing.assert_allclose(model.predict_batch(pd.DataFrame(batch)), expected, rtol=1e-9, atol=1e-9)
+    np.testing.assert_allclose([model.predict(request) for request in batch], expected, rtol=1e-9, atol=1e-9)
+
+
+def test_predict_batch_empty(model):
+    assert model.predict_batch([]).shape == (0,)
+    assert model.predict_batch(pd.DataFrame(columns=sorted(model.request_keys))).shape == (0,)
@@ -0,0 +1,97 @@
+import os
+import time
+from datetime import datetime as dt
+
+import numpy as np
+import pytest
+from scipy.optimize import linear_sum_assignment
+
+pytest.importorskip('torch')
+import rl.utils
+from rl.utils import local_hours, match_arrays
+
+
+@pytest.fixture
+def berlin_time():
+    tz = os.environ.get('TZ')
+    os.environ['TZ'] = 'Europe/Berlin'
+    time.tzset()
+    yield
+    if tz is None:
+        del os.environ['TZ']
+    else:
+        os.environ['TZ'] = tz
+    time.tzset()
+
+
+def test_local_hours_across_dst_change(berlin_time):
+    # clocks went forward at 2020-03-29 01:00 UTC and back at 2020-10-25 01:00 UTC
+    timestamps = np.concatenate([np.arange(1585440000, 1585458000, 600), np.arange(1603580400, 1603598400, 600)])
+    expected = [dt.fromtimestamp(t).hour for t in timestamps.tolist()]
+    assert local_hours(timestamps).tolist() == expected
+    assert local_hours(timestamps[:0]).tolist() == []
+
+
+def random_pairs(rng, max_ids=60, max_pairs=200):
+    n_pairs = rng.randint(1, max_pairs)
+    drivers = rng.randint(0, rng.randint(1, max_ids), n_pairs) * 7
+    orders = rng.randint(0, rng.randint(1, max_ids), n_pairs) * 3
+    return drivers, orders, np.round(rng.normal(1, 2, n_pairs), 2)
+
+
+def dense_objective(drivers, orders, weights, maximize):
+    # linear_sum_assignment on the dense matrix, missing pairs are filled with min - 1 (max + 1)
+    driver_ids, rows = np.unique(drivers, return_inverse=True)
+    order_ids, cols = np.unique(orders, return_inverse=True)
+    matrix = np.zeros((len(driver_ids), len(order_ids)))
+    np.add.at(matrix, (rows, cols), weights)
+    fill = matrix[matrix != 0].min() - 1 if maximize else matrix[matrix != 0].max() + 1
+    matrix[matrix == 0] = fill
+    row_ind, col_ind = linear_sum_assignment(matrix, maximize=maximize)
+    return matrix[row_ind, col_ind].sum(), fill, min(matrix.shape)
+
+
+@pytest.mark.parametrize('dense_size', [0, rl.utils.DENSE_MATCHING_SIZE])
+@pytest.mark.parametrize('maximize', [True, False])
+def test_match_arrays_matches_dense_assignment(monkeypatch, dense_size, maximize):
+    monkeypatch.setattr(rl.utils, 'DENSE_MATCHING_SIZE', dense_size)
+    rng = np.random.RandomState(0)
+    for _ in range(150):
+        drivers, orders, weights = random_pairs(rng)
+        if not np.any(weights):
+            continue
+        total, pairs = match_arrays(drivers, orders, weights, maximize=maximize)
+        assert len(set(drivers[pairs])) == len(pairs) and len(set(orders[pairs])) == len(pairs)
+        expected, fill, n_assigned = dense_objective(drivers, orders, weights, maximize)
+        assert total + fill * (n_assigned - len(pairs)) == pytest.approx(expected)
+
+
+def greedy_pairs(rows, cols, gains, edges):
+    pairs, used_rows, used_cols = list(), set(), set()
+    for edge in edges[np.argsort(-gains[edges], kind='stable')].tolist():
+        if rows[edge] not in used_rows and cols[edge] not in used_cols:
+            used_rows.add(rows[edge])
+            used_cols.add(cols[edge])
+            pairs.append(edge)
+    return pairs
+
+
+def test_match_greedy_is_one_pass_in_gain_order():
+    rng = np.random.RandomState(1)
+    for _ in range(300):
+        n_pairs = rng.randint(1, 300)
+        rows, cols = rng.randint(0, rng.randint(1, 50), n_pairs), rng.randint(0, rng.randint(1, 50), n_pairs)
+        # rounded gains have ties
+        gains = np.round(rng.rand(n_pairs), 1)
+        edges = rng.permutation(n_pairs)[:rng.randint(0, n_pairs + 1)]
+        assert sorted(rl.utils._match_greedy(rows, cols, gains, edges).tolist()) == \
+            sorted(greedy_pairs(rows, cols, gains, edges))
+
+
+def test_match_arrays_out_of_budget_is_greedy():
+    rng = np.random.RandomState(2)
+    keys = np.unique(rng.randint(0, 500 * 500, 5000))
+    drivers, orders, weights = keys // 500, keys % 500, rng.rand(len(keys)) + 1
+    total, pairs = match_arrays(drivers, orders, weights, time_budget=0.)
+    assert sorted(pairs.tolist()) == sorted(greedy_pairs(drivers, orders, weights, np.arange(len(keys))))
+    assert total == pytest.approx(weights[pairs].sum())
@@ -0,0 +1,26 @@
+import pytest
+
+from simulator.runner import MEAN_COLUMNS, SUM_COLUMNS, summarize
+
+
+def step_data(step, total_drivers, assigned_orders=0):
+    total = dict.fromkeys(SUM_COLUMNS + MEAN_COLUMNS, 0)
+    total.update(total_drivers=total_drivers, assigned_orders=assigned_orders)
+    return dict(step=step, day_of_week=1, total=total, trajectories=[])
+
+
+def test_summarize_weights_means_by_seconds():
+    # the state before start_hour, then steps of seconds 28801..28810 with 10 drivers till 28805 and 20 afterwards
+    every_second = [step_data(0, 0)] + [step_data(sec, 10 if sec < 28805 else 20, assigned_orders=1)
+                                        for sec in range(28801, 28811)]
+    event_driven = [step_data(0, 0), step_data(28801, 10, assigned_orders=4), step_data(28805, 20, assigned_orders=5),
+                    step_data(28810, 20, assigned_orders=1)]
+    expected = summarize(every_second)
+    summary = summarize(event_driven)
+    assert summary['avg_total_drivers'] == pytest.approx(expected['avg_total_drivers'])
+    assert summary['assigned_orders'] == expected['assigned_orders'] == 10
+
+
+def test_summarize_empty():
+    summary = summarize([])
+    assert summary['steps'] == 0
@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+
+from simulator.utils.sinks import ColumnarSink, TRAJECTORY_COLUMNS, read_simulation
+
+SAMPLE_DTYPE = np.dtype([('trajectory_id', 'U32'),
+                         ('t_start', np.int64), ('hex_start', 'U15'),
+                         ('lon_start', np.float64), ('lat_start', np.float64),
+                         ('t_end', np.int64), ('hex_end', 'U15'), ('lon_end', np.float64), ('lat_end', np.float64),
+                         ('action', 'U11'), ('reward', np.float64), ('done', np.int8)])
+
+
+def step_data(step, n_trajectories):
+    trajectories = np.zeros(n_trajectories, dtype=SAMPLE_DTYPE)
+    trajectories['trajectory_id'] = [f'driver_{i}' for i in range(n_trajectories)]
+    trajectories['t_start'], trajectories['t_end'] = step, step + 1
+    trajectories['action'] = 'idle'
+    trajectories['reward'] = 1.5
+    return dict(step=step, day_of_week=1, total=dict(reward=1.5 * n_trajectories), trajectories=trajectories)
+
+
+@pytest.mark.parametrize('file_format', ['parquet', 'npz'])
+def test_empty_row_group_before_trajectories(tmp_path, file_format):
+    if file_format == 'parquet':
+        pytest.importorskip('pyarrow')
+    sink = ColumnarSink(str(tmp_path), row_group_size=1, file_format=file_format)
+    sink.open('simulation')
+    sink.write_step(step_data(0, 0))
+    sink.write_step(step_data(1, 2))
+    sink.close()
+
+    trajectories = read_simulation(str(tmp_path), 'simulation', table='trajectories')
+    assert list(trajectories.columns) == list(TRAJECTORY_COLUMNS)
+    assert trajectories['step'].tolist() == [1, 1]
+    assert trajectories['trajectory_id'].tolist() == ['driver_0', 'driver_1']
+    total = read_simulation(str(tmp_path), 'simulation')
+    assert total['reward'].tolist() == [0.0, 3.0]
@@ -0,0 +1,40 @@
+from simulator.trajectory import TrajectoryStore
+
+HEXES = ['hex_a', 'hex_b', 'hex_c']
+STATUSES = ['idle', 'assigned', 'reposition']
+
+
+def assign(store, k, t_assigned, t_finished, hexagon, reward):
+    # samples of Driver.update_trajectory('assigned')
+    store.append(k, store.state(t_assigned, 'assigned', hexagon, (1., 1.)))
+    store.append(k, store.state(t_finished, 'assigned', hexagon, (2., 2.)), reward=reward)
+    store.close(k)
+
+
+def test_rollback_drops_last_assignment():
+    # capacity 2 makes the table grow while samples of two drivers are interleaved
+    store = TrajectoryStore(HEXES, statuses=STATUSES, capacity=2)
+    first, second = store.add_driver('first'), store.add_driver('second')
+    store.open(first, store.state(0, 'idle', 'hex_a', (0., 0.)))
+    store.open(second, store.state(0, 'idle', 'hex_c', (0., 0.)))
+    store.append(first, store.state(10, 'idle', 'hex_b', (0.5, 0.5)))
+    assign(store, first, 20, 30, 'hex_b', reward=5.)
+    assign(store, second, 25, 40, 'hex_c', reward=7.)
+
+    store.rollback(first)
+    assert store.collect(first) == [0]
+    assert store.is_open(first)
+    assert store.is_idle_at(first, 'hex_b')
+    # the next sample starts where the cancelled assignment started
+    store.append(first, store.state(50, 'idle', 'hex_c', (3., 3.)))
+    samples = store.take(store.collect(first))
+    assert samples['t_start'].tolist() == [0, 10]
+    assert samples['t_end'].tolist() == [10, 50]
+    assert samples['hex_end'].tolist() == ['hex_b', 'hex_c']
+    assert samples['reward'].tolist() == [0., 0.]
+
+    # samples of the other driver are untouched
+    samples = store.take(store.collect(second))
+    assert samples['action'].tolist() == ['idle', 'assigned']
+    assert samples['reward'].tolist() == [0., 7.]
+    assert len(store) == 6